@@ -21,6 +21,7 @@ export type ConstructProps = {
 	resourceProps: LooseTypeObject;
 	removalPolicy: RemovalPolicy;
 	lambdaLayers?: pyLambda.PythonLayerVersion[];
+	environment?: { [key: string]: string };
 };
 
 export class CustomResource extends Construct {
@@ -56,6 +57,7 @@ export class CustomResource extends Construct {
 			role: lambdaRole,
 			timeout: Duration.minutes(5),
 			layers: props.lambdaLayers || [],
+			environment: props.environment,
 		});
 		lambdaFn.node.addDependency(logGroup);
 
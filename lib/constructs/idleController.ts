@@ -0,0 +1,167 @@
+import { Construct } from 'constructs';
+import { CfnOutput, Duration, RemovalPolicy, Stack } from 'aws-cdk-lib';
+import { NagSuppressions } from 'cdk-nag';
+import * as cloudwatch from 'aws-cdk-lib/aws-cloudwatch';
+import * as ec2 from 'aws-cdk-lib/aws-ec2';
+import * as elb from 'aws-cdk-lib/aws-elasticloadbalancingv2';
+import * as events from 'aws-cdk-lib/aws-events';
+import * as targets from 'aws-cdk-lib/aws-events-targets';
+import * as iam from 'aws-cdk-lib/aws-iam';
+import * as lambda from 'aws-cdk-lib/aws-lambda';
+import * as logs from 'aws-cdk-lib/aws-logs';
+import * as pyLambda from '@aws-cdk/aws-lambda-python-alpha';
+
+export type ConstructProps = {
+	removalPolicy: RemovalPolicy;
+	nucleusServerInstances: ec2.Instance[];
+	loadBalancer: elb.ApplicationLoadBalancer;
+	lambdaLayers: pyLambda.PythonLayerVersion[];
+	idleMinutes: number;
+	stopInstance: boolean;
+	// EventBridge schedule expression, e.g. cron(0 7 ? * MON-FRI *)
+	resumeSchedule?: string;
+	// resume on the first load balancer requests after an idle period
+	resumeOnTraffic: boolean;
+};
+
+export class NucleusIdleController extends Construct {
+	public readonly lambdaFn: pyLambda.PythonFunction;
+
+	constructor(scope: Construct, id: string, props: ConstructProps) {
+		super(scope, id);
+
+		const region: string = Stack.of(this).region;
+		const account: string = Stack.of(this).account;
+		const instanceArns = props.nucleusServerInstances.map(
+			(instance) => `arn:aws:ec2:${region}:${account}:instance/${instance.instanceId}`
+		);
+
+		const lambdaPolicy = new iam.PolicyDocument({
+			statements: [
+				new iam.PolicyStatement({
+					actions: ['ssm:SendCommand'],
+					resources: [...instanceArns, `arn:aws:ssm:${region}::document/AWS-RunShellScript`],
+				}),
+				new iam.PolicyStatement({
+					actions: ['ssm:GetCommandInvocation'],
+					resources: [`arn:aws:ssm:${region}:${account}:*`],
+				}),
+				new iam.PolicyStatement({
+					actions: ['ec2:StartInstances', 'ec2:StopInstances', 'ec2:CreateTags', 'ec2:DeleteTags'],
+					resources: instanceArns,
+				}),
+				new iam.PolicyStatement({
+					actions: ['ec2:DescribeInstances', 'cloudwatch:GetMetricStatistics'],
+					resources: ['*'],
+				}),
+			],
+		});
+
+		const lambdaRole = new iam.Role(this, 'lambdaRole', {
+			assumedBy: new iam.ServicePrincipal('lambda.amazonaws.com'),
+			inlinePolicies: {
+				lambdaPolicyDocument: lambdaPolicy,
+			},
+		});
+
+		const lambdaName = `${Stack.of(this).stackName}-NucleusIdleController`.slice(0, 64);
+
+		const logGroup = new logs.LogGroup(this, 'lambdaFnLogGroup', {
+			logGroupName: `/aws/lambda/${lambdaName}`,
+			retention: logs.RetentionDays.ONE_WEEK,
+			removalPolicy: props.removalPolicy,
+		});
+
+		// a resume that starts the instances waits for the boot, the SSM
+		// agent and every Nucleus service
+		this.lambdaFn = new pyLambda.PythonFunction(this, 'lambdaFn', {
+			functionName: lambdaName,
+			runtime: lambda.Runtime.PYTHON_3_9,
+			handler: 'handler',
+			entry: './src/lambda/scheduled/nucleusIdleController',
+			role: lambdaRole,
+			timeout: Duration.minutes(15),
+			layers: props.lambdaLayers,
+			environment: {
+				NUCLEUS_INSTANCE_IDS: props.nucleusServerInstances.map((instance) => instance.instanceId).join(','),
+				IDLE_MINUTES: `${props.idleMinutes}`,
+				IDLE_METRIC_DIMENSIONS: JSON.stringify({ LoadBalancer: props.loadBalancer.loadBalancerFullName }),
+				STOP_INSTANCE: `${props.stopInstance}`,
+			},
+		});
+		this.lambdaFn.node.addDependency(logGroup);
+
+		this.lambdaFn.addToRolePolicy(
+			new iam.PolicyStatement({
+				actions: ['logs:CreateLogStream', 'logs:PutLogEvents'],
+				resources: [logGroup.logGroupArn],
+			})
+		);
+
+		new events.Rule(this, 'IdleCheckRule', {
+			schedule: events.Schedule.rate(Duration.minutes(5)),
+			targets: [
+				new targets.LambdaFunction(this.lambdaFn, {
+					event: events.RuleTargetInput.fromObject({ action: 'check' }),
+				}),
+			],
+		});
+
+		if (props.resumeSchedule) {
+			new events.Rule(this, 'ResumeRule', {
+				schedule: events.Schedule.expression(props.resumeSchedule),
+				targets: [
+					new targets.LambdaFunction(this.lambdaFn, {
+						event: events.RuleTargetInput.fromObject({ action: 'resume' }),
+					}),
+				],
+			});
+		}
+
+		if (props.resumeOnTraffic) {
+			// goes to ALARM on the first requests after a quiet minute, which
+			// get 502 from the reverse proxy while the stack is suspended
+			const trafficAlarm = new cloudwatch.Alarm(this, 'TrafficAlarm', {
+				metric: props.loadBalancer.metricRequestCount({
+					period: Duration.minutes(1),
+					statistic: 'Sum',
+				}),
+				threshold: 1,
+				comparisonOperator: cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+				evaluationPeriods: 1,
+				treatMissingData: cloudwatch.TreatMissingData.NOT_BREACHING,
+			});
+
+			// resume skips servers that are not suspended
+			new events.Rule(this, 'TrafficResumeRule', {
+				eventPattern: {
+					source: ['aws.cloudwatch'],
+					detailType: ['CloudWatch Alarm State Change'],
+					resources: [trafficAlarm.alarmArn],
+					detail: { state: { value: ['ALARM'] } },
+				},
+				targets: [
+					new targets.LambdaFunction(this.lambdaFn, {
+						event: events.RuleTargetInput.fromObject({ action: 'resume' }),
+					}),
+				],
+			});
+		}
+
+		new CfnOutput(this, 'IdleControllerFunctionName', {
+			value: this.lambdaFn.functionName,
+			description: 'invoke with {"action": "resume"} to resume a suspended Nucleus stack',
+		});
+
+		NagSuppressions.addResourceSuppressions(
+			lambdaRole,
+			[
+				{
+					id: 'AwsSolutions-IAM5',
+					reason: 'Wildcard Permissions: DescribeInstances and GetMetricStatistics do not support resource-level permissions',
+				},
+			],
+			true
+		);
+	}
+}
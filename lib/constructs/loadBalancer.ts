@@ -1,12 +1,17 @@
 import { Construct } from 'constructs';
-import { Duration, RemovalPolicy } from 'aws-cdk-lib';
+import { Duration, RemovalPolicy, Stack } from 'aws-cdk-lib';
 import { ISubnet, SecurityGroup, Vpc } from 'aws-cdk-lib/aws-ec2';
 import { Certificate } from 'aws-cdk-lib/aws-certificatemanager';
 import { ARecord, IHostedZone, RecordTarget } from 'aws-cdk-lib/aws-route53';
 import { LoadBalancerTarget } from 'aws-cdk-lib/aws-route53-targets';
 import { AutoScalingGroup } from 'aws-cdk-lib/aws-autoscaling';
+import * as cloudwatch from 'aws-cdk-lib/aws-cloudwatch';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
+import * as iam from 'aws-cdk-lib/aws-iam';
+import * as pyLambda from '@aws-cdk/aws-lambda-python-alpha';
 import * as elb from 'aws-cdk-lib/aws-elasticloadbalancingv2';
 import * as s3 from 'aws-cdk-lib/aws-s3';
+import { CustomResource } from './common/customResource';
 
 export interface LoadBalancerProps {
     removalPolicy: RemovalPolicy;
@@ -19,10 +24,19 @@ export interface LoadBalancerProps {
     certificate: Certificate;
     hostedZone: IHostedZone;
     autoScalingGroup: AutoScalingGroup;
+    // simple: an alias record; latency or failover: a routed CNAME with a
+    // Route 53 health check on healthAlarm, one per regional deployment
+    dnsRouting?: string;
+    failoverRole?: string;
+    lambdaLayers: pyLambda.PythonLayerVersion[];
+    idempotencyTable: dynamodb.ITable;
 }
 
 export class LoadBalancerConstruct extends Construct {
     public readonly loadBalancer: elb.ApplicationLoadBalancer;
+    // in ALARM while no Nucleus server passes the target group health check,
+    // Route 53 health checks of routed records follow it (aws_utils/r53.py)
+    public readonly healthAlarm: cloudwatch.Alarm;
 
     /**
      * Creates a cross-account role allowing the AWS Prototyping Team
@@ -60,14 +74,6 @@ export class LoadBalancerConstruct extends Construct {
             'loadBalancer-logs'
         );
 
-        // add ALB as target for Route 53 Hosted Zone
-        new ARecord(this, 'LoadBalancerAliasRecord', {
-            zone: props.hostedZone,
-            recordName: `${props.domainPrefix}.${props.rootDomain}`,
-            ttl: Duration.seconds(300),
-            target: RecordTarget.fromAlias(new LoadBalancerTarget(this.loadBalancer)),
-        });
-
         // --------------------------------------------------------------------
         // Target Groups
         // --------------------------------------------------------------------
@@ -83,6 +89,81 @@ export class LoadBalancerConstruct extends Construct {
             },
         });
 
+        // the security group only admits ALLOWED_CIDR_RANGE_01 and the VPC,
+        // Route 53 health checkers could not probe the listener themselves
+        this.healthAlarm = new cloudwatch.Alarm(this, 'HealthAlarm', {
+            metric: targetGroup.metricHealthyHostCount({
+                period: Duration.minutes(1),
+                statistic: 'Minimum',
+            }),
+            threshold: 1,
+            comparisonOperator: cloudwatch.ComparisonOperator.LESS_THAN_THRESHOLD,
+            evaluationPeriods: 3,
+            treatMissingData: cloudwatch.TreatMissingData.BREACHING,
+        });
+
+        // --------------------------------------------------------------------
+        // DNS
+        // --------------------------------------------------------------------
+        const dnsRouting = props.dnsRouting ?? 'simple';
+        if (dnsRouting === 'simple') {
+            // add ALB as target for Route 53 Hosted Zone
+            new ARecord(this, 'LoadBalancerAliasRecord', {
+                zone: props.hostedZone,
+                recordName: `${props.domainPrefix}.${props.rootDomain}`,
+                ttl: Duration.seconds(300),
+                target: RecordTarget.fromAlias(new LoadBalancerTarget(this.loadBalancer)),
+            });
+        } else {
+            const stack = Stack.of(this);
+            const dnsRecordPolicy = new iam.PolicyDocument({
+                statements: [
+                    new iam.PolicyStatement({
+                        actions: ['route53:ListResourceRecordSets', 'route53:ChangeResourceRecordSets'],
+                        resources: [props.hostedZone.hostedZoneArn],
+                    }),
+                    new iam.PolicyStatement({
+                        actions: [
+                            'route53:ListHealthChecks',
+                            'route53:CreateHealthCheck',
+                            'route53:DeleteHealthCheck',
+                            'route53:ChangeTagsForResource',
+                        ],
+                        resources: ['*'],
+                    }),
+                    new iam.PolicyStatement({
+                        actions: ['cloudwatch:DescribeAlarms'],
+                        resources: [this.healthAlarm.alarmArn],
+                    }),
+                    new iam.PolicyStatement({
+                        actions: ['dynamodb:GetItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem'],
+                        resources: [props.idempotencyTable.tableArn],
+                    }),
+                ],
+            });
+
+            new CustomResource(this, 'DnsRecordCustomResource', {
+                lambdaName: 'DnsRecord',
+                lambdaCodePath: './src/lambda/customResources/dnsRecord',
+                lambdaPolicyDocument: dnsRecordPolicy,
+                lambdaLayers: props.lambdaLayers,
+                removalPolicy: props.removalPolicy,
+                environment: {
+                    IDEMPOTENCY_TABLE: props.idempotencyTable.tableName,
+                },
+                resourceProps: {
+                    HOSTED_ZONE_ID: props.hostedZone.hostedZoneId,
+                    ROOT_DOMAIN: props.rootDomain,
+                    DOMAIN_PREFIX: props.domainPrefix,
+                    ROUTING_POLICY: dnsRouting,
+                    SET_IDENTIFIER: `${stack.stackName}-${stack.region}`,
+                    SERVER_ADDRESS: this.loadBalancer.loadBalancerDnsName,
+                    HEALTH_CHECK_ALARM: this.healthAlarm.alarmName,
+                    FAILOVER: props.failoverRole ?? 'PRIMARY',
+                },
+            });
+        }
+
         // --------------------------------------------------------------------
         // LISTENERS
         // --------------------------------------------------------------------
@@ -2,9 +2,10 @@ import { Construct } from 'constructs';
 import { Stack, Tags, RemovalPolicy } from 'aws-cdk-lib';
 import { NagSuppressions } from 'cdk-nag';
 import { CustomResource } from './common/customResource';
-import { cleanEnv, bool, str } from 'envalid';
+import { cleanEnv, bool, num, str } from 'envalid';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as s3 from 'aws-cdk-lib/aws-s3';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as ec2 from 'aws-cdk-lib/aws-ec2';
 import * as secretsmanager from 'aws-cdk-lib/aws-secretsmanager';
 import * as pyLambda from '@aws-cdk/aws-lambda-python-alpha';
@@ -20,6 +21,9 @@ const env = cleanEnv(process.env, {
 	ROOT_DOMAIN: str({ default: '' }),
 	NUCLEUS_SERVER_PREFIX: str({ default: 'nucleus' }),
 	NUCLEUS_BUILD: str({ default: '' }),
+	NUCLEUS_SERVER_COUNT: num({ default: 1 }),
+	NUCLEUS_DATA_VOLUME_COUNT: num({ default: 0 }),
+	NUCLEUS_DATA_VOLUME_SIZE: num({ default: 512 }),
 });
 
 export type ConstructProps = {
@@ -29,10 +33,12 @@ export type ConstructProps = {
 	artifactsBucket: s3.IBucket;
 	nucleusServerSG: ec2.SecurityGroup;
 	lambdaLayers: pyLambda.PythonLayerVersion[];
+	idempotencyTable: dynamodb.ITable;
 };
 
 export class NucleusServerResources extends Construct {
 	public readonly nucleusServerInstance: ec2.Instance;
+	public readonly nucleusServerInstances: ec2.Instance[];
 
 	constructor(scope: Construct, id: string, props: ConstructProps) {
 		super(scope, id);
@@ -72,6 +78,18 @@ export class NucleusServerResources extends Construct {
 			}),
 		};
 
+		// extra gp3 volumes, striped into DATA_ROOT by `nst prepare-data-root`
+		const data_volumes: ec2.BlockDevice[] = [];
+		for (let i = 0; i < env.NUCLEUS_DATA_VOLUME_COUNT; i++) {
+			data_volumes.push({
+				deviceName: `/dev/sd${String.fromCharCode('f'.charCodeAt(0) + i)}`,
+				volume: ec2.BlockDeviceVolume.ebs(env.NUCLEUS_DATA_VOLUME_SIZE, {
+					encrypted: true,
+					volumeType: ec2.EbsDeviceVolumeType.GP3,
+				}),
+			});
+		}
+
 		// Canonical, Ubuntu, 20.04 LTS, amd64
 		const nucleusServerAMI = ec2.MachineImage.fromSsmParameter(
 			'/aws/service/canonical/ubuntu/server/focal/stable/current/amd64/hvm/ebs-gp2/ami-id',
@@ -80,18 +98,25 @@ export class NucleusServerResources extends Construct {
 			}
 		);
 
-		this.nucleusServerInstance = new ec2.Instance(this, 'NucleusServer', {
-			instanceType: new ec2.InstanceType('c5.4xlarge'),
-			machineImage: nucleusServerAMI,
-			blockDevices: [ebs_volume],
-			vpc: props.vpc,
-			role: instance_role,
-			securityGroup: props.nucleusServerSG,
-			vpcSubnets: { subnets: props.subnets },
-			detailedMonitoring: true,
-		});
-		this.nucleusServerInstance.applyRemovalPolicy(props.removalPolicy);
-		Tags.of(this.nucleusServerInstance).add('Name', `${stackName}/NucleusServer`);
+		// the first server keeps the original construct id so existing
+		// single-server deployments are not replaced
+		this.nucleusServerInstances = [];
+		for (let i = 0; i < env.NUCLEUS_SERVER_COUNT; i++) {
+			const instance = new ec2.Instance(this, i == 0 ? 'NucleusServer' : `NucleusServer${i}`, {
+				instanceType: new ec2.InstanceType('c5.4xlarge'),
+				machineImage: nucleusServerAMI,
+				blockDevices: [ebs_volume, ...data_volumes],
+				vpc: props.vpc,
+				role: instance_role,
+				securityGroup: props.nucleusServerSG,
+				vpcSubnets: { subnets: props.subnets },
+				detailedMonitoring: true,
+			});
+			instance.applyRemovalPolicy(props.removalPolicy);
+			Tags.of(instance).add('Name', `${stackName}/NucleusServer`);
+			this.nucleusServerInstances.push(instance);
+		}
+		this.nucleusServerInstance = this.nucleusServerInstances[0];
 
 		// artifacts bucket
 		instance_role.addToPolicy(
@@ -111,6 +136,14 @@ export class NucleusServerResources extends Construct {
 				resources: ['arn:aws:logs:*:*:log-group:/aws/ssm/*'],
 			})
 		);
+		// `nst metrics --output put-metric-data`
+		instance_role.addToPolicy(
+			new iam.PolicyStatement({
+				actions: ['cloudwatch:PutMetricData'],
+				resources: ['*'],
+				conditions: { StringEquals: { 'cloudwatch:namespace': 'Omniverse/Nucleus' } },
+			})
+		);
 
 		// --------------------------------------------------------------------
 		// CUSTOM RESOURCE - Nucleus Server Config
@@ -121,9 +154,9 @@ export class NucleusServerResources extends Construct {
 			statements: [
 				new iam.PolicyStatement({
 					actions: ['ssm:SendCommand'],
-					resources: [
-						`arn:aws:ec2:${region}:${account}:instance/${this.nucleusServerInstance.instanceId}`,
-					],
+					resources: this.nucleusServerInstances.map(
+						(instance) => `arn:aws:ec2:${region}:${account}:instance/${instance.instanceId}`
+					),
 				}),
 				new iam.PolicyStatement({
 					actions: ['ssm:SendCommand'],
@@ -137,6 +170,10 @@ export class NucleusServerResources extends Construct {
 					actions: ['secretsmanager:GetSecretValue', 'secretsmanager:DescribeSecret'],
 					resources: [ovMainLogin.secretArn, ovServiceLogin.secretArn],
 				}),
+				new iam.PolicyStatement({
+					actions: ['dynamodb:GetItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem'],
+					resources: [props.idempotencyTable.tableArn],
+				}),
 			],
 		});
 
@@ -146,7 +183,7 @@ export class NucleusServerResources extends Construct {
 			lambdaPolicyDocument: nucleusConfigLambdaPolicy,
 			resourceProps: {
 				nounce: 2,
-				instanceId: this.nucleusServerInstance.instanceId,
+				instanceIds: this.nucleusServerInstances.map((instance) => instance.instanceId),
 				reverseProxyDomain: fullDomainName,
 				nucleusBuild: env.NUCLEUS_BUILD,
 				artifactsBucket: props.artifactsBucket.bucketName,
@@ -154,9 +191,12 @@ export class NucleusServerResources extends Construct {
 				ovServiceLoginSecretArn: ovServiceLogin.secretArn,
 			},
 			lambdaLayers: props.lambdaLayers,
-			removalPolicy: props.removalPolicy
+			removalPolicy: props.removalPolicy,
+			environment: {
+				IDEMPOTENCY_TABLE: props.idempotencyTable.tableName,
+			},
 		});
-		nucleusServerConfig.resource.node.addDependency(this.nucleusServerInstance);
+		this.nucleusServerInstances.forEach((instance) => nucleusServerConfig.resource.node.addDependency(instance));
 
 		// -------------------------------
 		// CDK_NAG (security scan) suppressions
@@ -195,15 +235,17 @@ export class NucleusServerResources extends Construct {
 			true
 		);
 
-		NagSuppressions.addResourceSuppressions(
-			this.nucleusServerInstance,
-			[
-				{
-					id: 'AwsSolutions-EC29',
-					reason: 'CDK_NAG is not recognizing the applied removalPolicy',
-				},
-			],
-			true
+		this.nucleusServerInstances.forEach((instance) =>
+			NagSuppressions.addResourceSuppressions(
+				instance,
+				[
+					{
+						id: 'AwsSolutions-EC29',
+						reason: 'CDK_NAG is not recognizing the applied removalPolicy',
+					},
+				],
+				true
+			)
 		);
 	}
 }
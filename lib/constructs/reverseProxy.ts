@@ -1,11 +1,12 @@
 import { Construct } from 'constructs';
-import { Stack, RemovalPolicy, Tags } from 'aws-cdk-lib';
+import { Fn, Stack, RemovalPolicy, Tags } from 'aws-cdk-lib';
 import { NagSuppressions } from 'cdk-nag';
 import { CustomResource } from './common/customResource';
 import { cleanEnv, str } from 'envalid';
 import { AutoScalingResources } from './autoscaling';
 import * as iam from 'aws-cdk-lib/aws-iam';
 import * as s3 from 'aws-cdk-lib/aws-s3';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as ec2 from 'aws-cdk-lib/aws-ec2';
 import * as pyLambda from '@aws-cdk/aws-lambda-python-alpha';
 import * as dotenv from 'dotenv';
@@ -24,7 +25,8 @@ export type ConstructProps = {
 	subnets: ec2.ISubnet[];
 	securityGroup: ec2.SecurityGroup;
 	lambdaLayers: pyLambda.PythonLayerVersion[];
-	nucleusServerInstance: ec2.Instance;
+	nucleusServerInstances: ec2.Instance[];
+	idempotencyTable: dynamodb.ITable;
 };
 
 export class RevProxyResources extends Construct {
@@ -36,6 +38,10 @@ export class RevProxyResources extends Construct {
 		const region: string = Stack.of(this).region;
 		const account: string = Stack.of(this).account;
 		const stackName: string = Stack.of(this).stackName;
+		const nucleusServerAddresses = Fn.join(
+			',',
+			props.nucleusServerInstances.map((instance) => instance.instancePrivateDnsName)
+		);
 
 		const instanceRole = new iam.Role(this, 'ReverseProxyInstanceRole', {
 			assumedBy: new iam.ServicePrincipal('ec2.amazonaws.com'),
@@ -112,6 +118,10 @@ export class RevProxyResources extends Construct {
 					actions: ['ec2:DescribeInstances', 'ec2:DescribeInstanceStatus'],
 					resources: ['*'],
 				}),
+				new iam.PolicyStatement({
+					actions: ['dynamodb:GetItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem'],
+					resources: [props.idempotencyTable.tableArn],
+				}),
 			],
 		});
 
@@ -138,7 +148,8 @@ export class RevProxyResources extends Construct {
 						ARTIFACTS_BUCKET: props.artifactsBucket.bucketName,
 						NUCLEUS_ROOT_DOMAIN: env.ROOT_DOMAIN,
 						NUCLEUS_DOMAIN_PREFIX: env.NUCLEUS_SERVER_PREFIX,
-						NUCLEUS_SERVER_ADDRESS: props.nucleusServerInstance.instancePrivateDnsName,
+						NUCLEUS_SERVER_ADDRESS: nucleusServerAddresses,
+						IDEMPOTENCY_TABLE: props.idempotencyTable.tableName,
 					},
 					policies: {
 						reverseProxyConfigPolicy: reverseProxyConfigPolicy,
@@ -186,6 +197,10 @@ export class RevProxyResources extends Construct {
 					actions: ['ec2:DescribeTags', 'ec2:CreateTags'],
 					resources: ['*'],
 				}),
+				new iam.PolicyStatement({
+					actions: ['dynamodb:GetItem', 'dynamodb:PutItem', 'dynamodb:UpdateItem'],
+					resources: [props.idempotencyTable.tableArn],
+				}),
 			],
 		});
 
@@ -195,11 +210,16 @@ export class RevProxyResources extends Construct {
 			lambdaPolicyDocument: reverseProxyConfigLambdaPolicy,
 			lambdaLayers: props.lambdaLayers,
 			removalPolicy: props.removalPolicy,
+			environment: {
+				IDEMPOTENCY_TABLE: props.idempotencyTable.tableName,
+			},
 			resourceProps: {
 				nounce: 2,
 				STACK_NAME: stackName,
 				ARTIFACTS_BUCKET_NAME: props.artifactsBucket.bucketName,
 				FULL_DOMAIN: `${env.NUCLEUS_SERVER_PREFIX}.${env.ROOT_DOMAIN}`,
+				// only used to trigger an (incremental) update when the Nucleus backend is replaced
+				NUCLEUS_SERVER_ADDRESS: nucleusServerAddresses,
 				RP_AUTOSCALING_GROUP_NAME: autoScalingResources.autoScalingGroup.autoScalingGroupName,
 			},
 		});
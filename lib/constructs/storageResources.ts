@@ -4,6 +4,7 @@ import { Fn, Stack } from 'aws-cdk-lib';
 import { Construct } from 'constructs';
 import { RemovalPolicy, CfnOutput } from 'aws-cdk-lib';
 import * as s3 from 'aws-cdk-lib/aws-s3';
+import * as dynamodb from 'aws-cdk-lib/aws-dynamodb';
 import * as deployment from 'aws-cdk-lib/aws-s3-deployment';
 import * as path from 'path';
 
@@ -16,6 +17,7 @@ export interface StorageResourcesProps {
 
 export class StorageResources extends Construct {
     public readonly artifactsBucket: s3.Bucket;
+    public readonly idempotencyTable: dynamodb.Table;
 
     constructor(scope: Construct, id: string, props: StorageResourcesProps) {
         super(scope, id);
@@ -37,6 +39,14 @@ export class StorageResources extends Construct {
 
         this.artifactsBucket = artifactsDeployment.deployedBucket as s3.Bucket;
 
+        // claims on lifecycle and custom resource events, see src/lambda/common/aws_utils/idempotency.py
+        this.idempotencyTable = new dynamodb.Table(this, 'IdempotencyTable', {
+            partitionKey: { name: 'pk', type: dynamodb.AttributeType.STRING },
+            billingMode: dynamodb.BillingMode.PAY_PER_REQUEST,
+            timeToLiveAttribute: 'expires_at',
+            removalPolicy: props.removalPolicy,
+        });
+
         /**
          * CFN Outputs
          */
@@ -5,20 +5,27 @@ import { NucleusServerResources } from './constructs/nucleusServer';
 import { VpcResources } from './constructs/vpc';
 import { RemovalPolicy } from 'aws-cdk-lib';
 import { NagSuppressions } from 'cdk-nag';
-import { cleanEnv, str, bool } from 'envalid';
+import { cleanEnv, str, bool, num } from 'envalid';
 import * as lambda from 'aws-cdk-lib/aws-lambda';
 import * as pyLambda from '@aws-cdk/aws-lambda-python-alpha';
 import * as dotenv from 'dotenv';
 import { StorageResources } from './constructs/storageResources';
 import { LoadBalancerConstruct } from './constructs/loadBalancer';
 import { Route53Resources } from './constructs/route53';
+import { NucleusIdleController } from './constructs/idleController';
 
 dotenv.config();
 const env = cleanEnv(process.env, {
 	DEV_MODE: bool({ default: false }),
 	OMNIVERSE_ARTIFACTS_BUCKETNAME: str({ default: '' }),
 	ROOT_DOMAIN: str({ default: '' }),
-	NUCLEUS_SERVER_PREFIX: str({ default: '' })
+	NUCLEUS_SERVER_PREFIX: str({ default: '' }),
+	NUCLEUS_IDLE_MINUTES: num({ default: 0 }),
+	NUCLEUS_IDLE_STOP_INSTANCE: bool({ default: false }),
+	NUCLEUS_RESUME_SCHEDULE: str({ default: '' }),
+	NUCLEUS_RESUME_ON_TRAFFIC: bool({ default: true }),
+	NUCLEUS_DNS_ROUTING: str({ choices: ['simple', 'latency', 'failover'], default: 'simple' }),
+	NUCLEUS_DNS_FAILOVER_ROLE: str({ choices: ['PRIMARY', 'SECONDARY'], default: 'PRIMARY' }),
 });
 
 export class AppStack extends Stack {
@@ -35,7 +42,7 @@ export class AppStack extends Stack {
 			autoDelete = true;
 		}
 
-		const { artifactsBucket } = new StorageResources(this, "StorageResources", {
+		const { artifactsBucket, idempotencyTable } = new StorageResources(this, "StorageResources", {
 			bucketName: env.OMNIVERSE_ARTIFACTS_BUCKETNAME,
 			autoDelete: autoDelete,
 			removalPolicy: removalPolicy
@@ -63,6 +70,7 @@ export class AppStack extends Stack {
 			artifactsBucket: artifactsBucket,
 			nucleusServerSG: vpcResources.securityGroups.nucleus,
 			lambdaLayers: [commonUtilsLambdaLayer],
+			idempotencyTable: idempotencyTable,
 		});
 
 		const reverseProxyResources = new RevProxyResources(this, 'RevProxyResources', {
@@ -72,12 +80,13 @@ export class AppStack extends Stack {
 			subnets: vpcResources.subnets.reverseProxy,
 			securityGroup: vpcResources.securityGroups.reverseProxy,
 			lambdaLayers: [commonUtilsLambdaLayer],
-			nucleusServerInstance: nucleusServerResources.nucleusServerInstance,
+			nucleusServerInstances: nucleusServerResources.nucleusServerInstances,
+			idempotencyTable: idempotencyTable,
 		});
 
 		reverseProxyResources.node.addDependency(nucleusServerResources);
 
-		new LoadBalancerConstruct(this, 'LoadBalancerConstruct', {
+		const { loadBalancer } = new LoadBalancerConstruct(this, 'LoadBalancerConstruct', {
 			removalPolicy: removalPolicy,
 			autoDelete: autoDelete,
 			vpc: vpcResources.vpc,
@@ -88,8 +97,26 @@ export class AppStack extends Stack {
 			certificate: certificate,
 			hostedZone: hostedZone,
 			autoScalingGroup: reverseProxyResources.autoScalingGroup,
+			dnsRouting: env.NUCLEUS_DNS_ROUTING,
+			failoverRole: env.NUCLEUS_DNS_FAILOVER_ROLE,
+			lambdaLayers: [commonUtilsLambdaLayer],
+			idempotencyTable: idempotencyTable,
 		});
 
+		// suspend the Nucleus stack after NUCLEUS_IDLE_MINUTES without client connections
+		if (env.NUCLEUS_IDLE_MINUTES > 0) {
+			new NucleusIdleController(this, 'NucleusIdleController', {
+				removalPolicy: removalPolicy,
+				nucleusServerInstances: nucleusServerResources.nucleusServerInstances,
+				loadBalancer: loadBalancer,
+				lambdaLayers: [commonUtilsLambdaLayer],
+				idleMinutes: env.NUCLEUS_IDLE_MINUTES,
+				stopInstance: env.NUCLEUS_IDLE_STOP_INSTANCE,
+				resumeSchedule: env.NUCLEUS_RESUME_SCHEDULE,
+				resumeOnTraffic: env.NUCLEUS_RESUME_ON_TRAFFIC,
+			});
+		}
+
 		// -------------------------------
 		// NagSuppressions
 		// -------------------------------
@@ -13,6 +13,7 @@ from botocore.exceptions import ClientError
 import aws_utils.ssm as ssm
 import aws_utils.r53 as r53
 import aws_utils.ec2 as ec2
+import aws_utils.idempotency as idempotency
 import config.reverseProxy as config
 
 logger = logging.getLogger()
@@ -23,7 +24,8 @@ autoscaling = boto3.client("autoscaling")
 ARTIFACTS_BUCKET = os.environ["ARTIFACTS_BUCKET"]
 NUCLEUS_ROOT_DOMAIN = os.environ["NUCLEUS_ROOT_DOMAIN"]
 NUCLEUS_DOMAIN_PREFIX = os.environ["NUCLEUS_DOMAIN_PREFIX"]
-NUCLEUS_SERVER_ADDRESS = os.environ["NUCLEUS_SERVER_ADDRESS"]
+# comma separated when fronting a multi-Nucleus fleet
+NUCLEUS_SERVER_ADDRESSES = os.environ["NUCLEUS_SERVER_ADDRESS"].split(",")
 
 
 def send_lifecycle_action(event, result):
@@ -46,13 +48,13 @@ def send_lifecycle_action(event, result):
 
 
 def update_nginix_config(
-    instanceId, artifactsBucket, nucleusServerAddress, domain
+    instanceId, artifactsBucket, nucleusServerAddresses, domain
 ):
     # generate config for reverse proxy servers
     commands = []
     try:
         commands = config.get_config(
-            artifactsBucket, nucleusServerAddress, domain)
+            artifactsBucket, nucleusServerAddresses, domain)
         logger.debug(commands)
     except Exception as e:
         raise Exception("Failed to get Reverse Proxy config. {}".format(e))
@@ -71,15 +73,27 @@ def handler(event, context):
     transition = event["detail"]["LifecycleTransition"]
 
     if transition == "autoscaling:EC2_INSTANCE_LAUNCHING":
+        domain = f"{NUCLEUS_DOMAIN_PREFIX}.{NUCLEUS_ROOT_DOMAIN}"
         try:
-            update_nginix_config(
-                instanceId,
-                ARTIFACTS_BUCKET,
-                NUCLEUS_SERVER_ADDRESS,
-                f"{NUCLEUS_DOMAIN_PREFIX}.{NUCLEUS_ROOT_DOMAIN}",
+            # a redelivered event must not bootstrap the instance a second time
+            _, duplicate = idempotency.run_for_event(
+                event["detail"]["LifecycleActionToken"],
+                {"instanceId": instanceId, "addresses": NUCLEUS_SERVER_ADDRESSES, "domain": domain},
+                lambda: update_nginix_config(
+                    instanceId,
+                    ARTIFACTS_BUCKET,
+                    NUCLEUS_SERVER_ADDRESSES,
+                    domain,
+                ),
+                context,
             )
 
-            send_lifecycle_action(event, "CONTINUE")
+            # the original invocation completed the lifecycle action
+            if not duplicate:
+                send_lifecycle_action(event, "CONTINUE")
+
+        except (idempotency.DuplicateInProgress, idempotency.DuplicateFailed) as e:
+            logger.info(f"Duplicate lifecycle event, left to the original: {e}")
 
         except Exception as e:
 
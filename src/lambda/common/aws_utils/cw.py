@@ -0,0 +1,37 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import os
+import logging
+from datetime import datetime, timedelta, timezone
+
+import boto3
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+client = boto3.client("cloudwatch")
+
+
+def get_metric_values(namespace, metric_name, dimensions: dict, statistic, minutes, period=60) -> list:
+    """values of statistic per period over the last minutes, oldest first
+
+    CloudWatch has no datapoint for a period nothing was reported in, e.g.
+    load balancer metrics while there is no traffic.
+    """
+    end = datetime.now(timezone.utc)
+    response = client.get_metric_statistics(
+        Namespace=namespace,
+        MetricName=metric_name,
+        Dimensions=[{"Name": k, "Value": v} for k, v in dimensions.items()],
+        StartTime=end - timedelta(minutes=minutes),
+        EndTime=end,
+        Period=period,
+        Statistics=[statistic],
+    )
+    logger.debug(response)
+
+    datapoints = sorted(response["Datapoints"], key=lambda d: d["Timestamp"])
+    return [d[statistic] for d in datapoints]
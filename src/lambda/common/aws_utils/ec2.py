@@ -4,6 +4,7 @@
 
 
 import os
+import time
 import logging
 
 import boto3
@@ -177,3 +178,27 @@ def terminate_instances(instance_ids):
     response = client.terminate_instances(InstanceIds=instance_ids)
     logger.info(response)
     return response
+
+
+def start_instances(instance_ids):
+    response = client.start_instances(InstanceIds=instance_ids)
+    logger.info(response)
+    return response
+
+
+def stop_instances(instance_ids):
+    response = client.stop_instances(InstanceIds=instance_ids)
+    logger.info(response)
+    return response
+
+
+def wait_for_instance_state(id, state, timeout=300, interval=2):
+    # the boto3 waiters poll every 15s, too slow for a resume
+    deadline = time.monotonic() + timeout
+    while True:
+        current = get_instance_state(id)
+        if current == state:
+            return current
+        if time.monotonic() > deadline:
+            raise Exception(f"ERROR: {id} is {current}, not {state} after {timeout}s")
+        time.sleep(interval)
@@ -0,0 +1,235 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""run a handler's work at most once per event
+
+EventBridge and CloudFormation may deliver the same event more than once. The
+first copy claims the event key (LifecycleActionToken or RequestId plus a hash
+of the inputs) as IN_PROGRESS; copies arriving while it runs wait for its
+outcome instead of starting the work again, and later copies get the stored
+outcome until the record's TTL expires. A claim whose holder died (Lambda
+timeout) can be taken over once its in-flight deadline passes.
+
+The store is chosen from the environment: IDEMPOTENCY_TABLE for DynamoDB,
+IDEMPOTENCY_DB_PATH for a local SQLite file (tests, the simulator), neither to
+disable idempotency.
+"""
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+from contextlib import closing
+
+import boto3
+from botocore.exceptions import ClientError
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+IN_PROGRESS = "IN_PROGRESS"
+COMPLETED = "COMPLETED"
+FAILED = "FAILED"
+
+TTL_SECONDS = 24 * 3600
+POLL_SECONDS = 5
+
+
+class DuplicateInProgress(Exception):
+    """the original is still running and did not finish while we waited"""
+
+
+class DuplicateFailed(Exception):
+    """the original copy of this event failed"""
+
+
+def event_key(token, inputs) -> str:
+    digest = hashlib.sha256(
+        json.dumps(inputs, sort_keys=True, default=str).encode()).hexdigest()
+    return f"{token}:{digest[:16]}"
+
+
+class DynamoDBStore:
+    """table with a string partition key `pk` and TTL on `expires_at`"""
+
+    def __init__(self, table_name, client=None):
+        self.table_name = table_name
+        self.client = client or boto3.client("dynamodb")
+
+    def acquire(self, key, in_flight_until, expires_at):
+        now = int(time.time())
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    "pk": {"S": key},
+                    "status": {"S": IN_PROGRESS},
+                    "in_flight_until": {"N": str(int(in_flight_until))},
+                    "expires_at": {"N": str(int(expires_at))},
+                },
+                # new key, an abandoned claim, or a record TTL has not reaped yet
+                ConditionExpression="attribute_not_exists(pk)"
+                " OR (#s = :in_progress AND in_flight_until < :now)"
+                " OR expires_at < :now",
+                ExpressionAttributeNames={"#s": "status"},
+                ExpressionAttributeValues={
+                    ":in_progress": {"S": IN_PROGRESS},
+                    ":now": {"N": str(now)},
+                },
+            )
+            return True, None
+        except ClientError as e:
+            if e.response["Error"]["Code"] != "ConditionalCheckFailedException":
+                raise
+        return False, self.get(key)
+
+    def get(self, key):
+        item = self.client.get_item(
+            TableName=self.table_name, Key={"pk": {"S": key}}, ConsistentRead=True
+        ).get("Item")
+        if not item:
+            return None
+        return {
+            "status": item["status"]["S"],
+            "in_flight_until": int(item["in_flight_until"]["N"]),
+            "expires_at": int(item["expires_at"]["N"]),
+            "result": item.get("result", {}).get("S"),
+        }
+
+    def complete(self, key, status, result, expires_at):
+        self.client.update_item(
+            TableName=self.table_name,
+            Key={"pk": {"S": key}},
+            UpdateExpression="SET #s = :status, #r = :result, expires_at = :expires_at",
+            ExpressionAttributeNames={"#s": "status", "#r": "result"},
+            ExpressionAttributeValues={
+                ":status": {"S": status},
+                ":result": {"S": result},
+                ":expires_at": {"N": str(int(expires_at))},
+            },
+        )
+
+
+class SQLiteStore:
+    """same semantics as DynamoDBStore in a local file"""
+
+    def __init__(self, path):
+        self.path = path
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS idempotency ("
+                "pk TEXT PRIMARY KEY, status TEXT, in_flight_until INTEGER,"
+                " expires_at INTEGER, result TEXT)")
+
+    def _connect(self):
+        # concurrent handlers in one process or several share the file
+        return sqlite3.connect(self.path, timeout=30, isolation_level="IMMEDIATE")
+
+    def acquire(self, key, in_flight_until, expires_at):
+        now = int(time.time())
+        with closing(self._connect()) as db, db:
+            row = db.execute(
+                "SELECT status, in_flight_until, expires_at FROM idempotency WHERE pk = ?",
+                (key,)).fetchone()
+            if row is None or (row[0] == IN_PROGRESS and row[1] < now) or row[2] < now:
+                db.execute(
+                    "INSERT OR REPLACE INTO idempotency VALUES (?, ?, ?, ?, NULL)",
+                    (key, IN_PROGRESS, int(in_flight_until), int(expires_at)))
+                return True, None
+        return False, self.get(key)
+
+    def get(self, key):
+        with closing(self._connect()) as db, db:
+            row = db.execute(
+                "SELECT status, in_flight_until, expires_at, result FROM idempotency WHERE pk = ?",
+                (key,)).fetchone()
+        if row is None:
+            return None
+        return dict(zip(("status", "in_flight_until", "expires_at", "result"), row))
+
+    def complete(self, key, status, result, expires_at):
+        with closing(self._connect()) as db, db:
+            db.execute(
+                "UPDATE idempotency SET status = ?, result = ?, expires_at = ? WHERE pk = ?",
+                (status, result, int(expires_at), key))
+
+
+def get_store():
+    table_name = os.getenv("IDEMPOTENCY_TABLE")
+    if table_name:
+        return DynamoDBStore(table_name)
+    db_path = os.getenv("IDEMPOTENCY_DB_PATH")
+    if db_path:
+        return SQLiteStore(db_path)
+    return None
+
+
+def _outcome(record):
+    if record["status"] == FAILED:
+        raise DuplicateFailed(record["result"])
+    return json.loads(record["result"]) if record["result"] else None
+
+
+def run_once(store, key, fn, in_flight_seconds, ttl_seconds=TTL_SECONDS,
+             wait_seconds=None, poll_seconds=POLL_SECONDS):
+    """fn() for the first copy of an event, its outcome for every other copy
+
+    Returns (result, duplicate). Duplicates wait up to wait_seconds (default
+    in_flight_seconds) for a running original, then raise DuplicateInProgress.
+    A failed original is re-raised as DuplicateFailed, it is not retried.
+    in_flight_seconds should cover the invocation, e.g. the Lambda's remaining
+    time, so a claim left by a timed out invocation can be taken over.
+    """
+    if store is None:
+        return fn(), False
+
+    wait_seconds = in_flight_seconds if wait_seconds is None else wait_seconds
+    deadline = time.monotonic() + wait_seconds
+
+    while True:
+        now = time.time()
+        acquired, record = store.acquire(key, now + in_flight_seconds, now + ttl_seconds)
+        if acquired:
+            break
+
+        if record is not None and record["status"] != IN_PROGRESS:
+            logger.info(f"Duplicate event {key}, original {record['status']}")
+            return _outcome(record), True
+
+        # in progress, or the record expired or was deleted between the
+        # claim and the read: either way back off before claiming again
+        if time.monotonic() + poll_seconds > deadline:
+            raise DuplicateInProgress(f"Event {key} is still being handled by another invocation")
+        if record is None:
+            logger.info(f"Duplicate event {key} vanished before it could be read, claiming again")
+        else:
+            logger.info(f"Duplicate event {key} in progress, waiting for it")
+        time.sleep(poll_seconds)
+
+    try:
+        result = fn()
+    except Exception as e:
+        store.complete(key, FAILED, str(e), time.time() + ttl_seconds)
+        raise
+
+    store.complete(key, COMPLETED, json.dumps(result, default=str), time.time() + ttl_seconds)
+    return result, False
+
+
+def run_for_event(token, inputs, fn, context=None, margin_seconds=10):
+    """run_once for a Lambda event, in flight for the invocation's remaining time"""
+    remaining = context.get_remaining_time_in_millis() / 1000 if context else 900
+    return run_once(
+        get_store(), event_key(token, inputs), fn,
+        in_flight_seconds=remaining,
+        wait_seconds=max(remaining - margin_seconds, 0),
+    )
+
+
+def resource_event_inputs(event) -> dict:
+    """the parts of a custom resource event that define the work"""
+    return {k: event.get(k) for k in ("RequestType", "ResourceProperties", "OldResourceProperties")}
@@ -2,11 +2,26 @@
 # SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
 # Licensed under the Amazon Software License  http://aws.amazon.com/asl/
 
+import os
+import json
+import hashlib
+import uuid
+import logging
 
 import boto3
 
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
 client = boto3.client("route53")
 
+# location served by templates/nginx.conf on every reverse proxy
+HEALTH_CHECK_PATH = "/healthcheck"
+# tags for the console only, health checks are found by caller reference
+HEALTH_CHECK_TAG = "nucleus:record"
+HEALTH_CHECK_SET_TAG = "nucleus:set-identifier"
+
 
 def update_hosted_zone_cname_record(hostedZoneID, rootDomain, domainPrefix, serverAddress):
 
@@ -55,3 +70,284 @@ def delete_hosted_zone_cname_record(hostedZoneID, rootDomain, domainPrefix, serv
     # Expected exactly one of [AliasTarget, all of [TTL, and ResourceRecords], or TrafficPolicyInstanceId], but found none in Change with
     # [Action=DELETE, Name=nucleus-dev.awsps.myinstance.com, Type=CNAME, SetIdentifier=null]
     return response
+
+
+def get_record_sets(hostedZoneID, fqdn, recordType="CNAME"):
+    """all record sets (simple and routed) for fqdn/recordType"""
+    name = fqdn.rstrip(".") + "."
+    recordSets = []
+    paginator = client.get_paginator("list_resource_record_sets")
+    for page in paginator.paginate(
+        HostedZoneId=hostedZoneID, StartRecordName=name, StartRecordType=recordType
+    ):
+        for r in page["ResourceRecordSets"]:
+            if r["Name"] != name or r["Type"] != recordType:
+                return recordSets
+            recordSets.append(r)
+    return recordSets
+
+
+def _digest(*values):
+    return hashlib.sha256(json.dumps(values).encode()).hexdigest()[:16]
+
+
+def _reference_prefix(fqdn, setIdentifier=None):
+    """start of the CallerReference of the health checks ensure_health_check
+    creates for fqdn, and for one of its set identifiers"""
+    if setIdentifier is None:
+        return f"{_digest(fqdn)}-"
+    return f"{_digest(fqdn)}-{_digest(fqdn, setIdentifier)}-"
+
+
+def _is_for(healthCheck, fqdn, setIdentifier):
+    return healthCheck["callerReference"].startswith(_reference_prefix(fqdn, setIdentifier))
+
+
+def get_health_checks(fqdn):
+    """health checks created for fqdn by ensure_health_check, keyed by id
+
+    Found by the CallerReference prefix, from ListHealthChecks, which sees a
+    health check as soon as it is created; the tagging API lags behind and
+    a quick rerun would create duplicates.
+    """
+    prefix = _reference_prefix(fqdn)
+    healthChecks = {}
+    paginator = client.get_paginator("list_health_checks")
+    for page in paginator.paginate():
+        for h in page["HealthChecks"]:
+            if h["CallerReference"].startswith(prefix):
+                healthChecks[h["Id"]] = {
+                    "callerReference": h["CallerReference"],
+                    "config": h["HealthCheckConfig"],
+                }
+    return healthChecks
+
+
+def _health_check_config(targetAddress, port, protocol, path, requestInterval, failureThreshold, alarm):
+    if alarm:
+        # the alarm's state, no probe has to reach the endpoint
+        return {
+            "Type": "CLOUDWATCH_METRIC",
+            "AlarmIdentifier": {"Region": alarm["region"], "Name": alarm["name"]},
+            "InsufficientDataHealthStatus": "LastKnownStatus",
+        }
+    return {
+        "FullyQualifiedDomainName": targetAddress,
+        "Port": port,
+        "Type": protocol,
+        "ResourcePath": path,
+        "RequestInterval": requestInterval,
+        "FailureThreshold": failureThreshold,
+    }
+
+
+def ensure_health_check(
+    fqdn, setIdentifier, targetAddress=None, port=443, protocol="HTTPS", path=HEALTH_CHECK_PATH,
+    requestInterval=30, failureThreshold=3, existing=None, alarm=None
+):
+    """return the health check for one regional endpoint, creating it if needed
+
+    alarm: {"region", "name"} of a CloudWatch alarm that is in ALARM while
+    the endpoint is unhealthy, e.g. the load balancer's `HealthAlarm`. Without
+    it targetAddress is probed, which only works if the endpoint admits the
+    Route 53 health checkers of every region; the load balancer security
+    group does not.
+
+    existing: result of get_health_checks(fqdn), pass it in when ensuring
+    several endpoints to look them up once.
+    """
+    healthCheckConfig = _health_check_config(
+        targetAddress, port, protocol, path, requestInterval, failureThreshold, alarm)
+
+    if existing is None:
+        existing = get_health_checks(fqdn)
+    for healthCheckId, h in existing.items():
+        if not _is_for(h, fqdn, setIdentifier):
+            continue
+        if all(h["config"].get(k) == v for k, v in healthCheckConfig.items()):
+            return healthCheckId
+
+    # caller references can never be reused, even after the health check is
+    # deleted, so the owner prefix gets a random suffix
+    callerReference = _reference_prefix(fqdn, setIdentifier) + uuid.uuid4().hex[:24]
+    response = client.create_health_check(
+        CallerReference=callerReference,
+        HealthCheckConfig=healthCheckConfig,
+    )
+    healthCheckId = response["HealthCheck"]["Id"]
+
+    client.change_tags_for_resource(
+        ResourceType="healthcheck",
+        ResourceId=healthCheckId,
+        AddTags=[
+            {"Key": "Name", "Value": f"{fqdn}-{setIdentifier}"},
+            {"Key": HEALTH_CHECK_TAG, "Value": fqdn},
+            {"Key": HEALTH_CHECK_SET_TAG, "Value": setIdentifier},
+        ],
+    )
+    logger.info(f"Created health check {healthCheckId}: {setIdentifier} -> {json.dumps(healthCheckConfig)}")
+    return healthCheckId
+
+
+def _alarm(endpoint):
+    if not endpoint.get("healthCheckAlarm"):
+        return None
+    return {
+        "region": endpoint.get("alarmRegion", endpoint.get("region")),
+        "name": endpoint["healthCheckAlarm"],
+    }
+
+
+def _routed_record_set(fqdn, endpoint, healthCheckId, routingPolicy, ttl):
+    recordSet = {
+        "Name": fqdn,
+        "Type": "CNAME",
+        "SetIdentifier": endpoint["setIdentifier"],
+        "TTL": ttl,
+        "ResourceRecords": [{"Value": endpoint["serverAddress"]}],
+        "HealthCheckId": healthCheckId,
+    }
+    if routingPolicy == "latency":
+        recordSet["Region"] = endpoint["region"]
+    elif routingPolicy == "failover":
+        recordSet["Failover"] = endpoint["failover"]
+    else:
+        raise Exception(f"Unsupported routing policy: {routingPolicy}")
+    return recordSet
+
+
+def reconcile_routed_cname_records(
+    hostedZoneID, rootDomain, domainPrefix, endpoints, routingPolicy="latency", ttl=60
+):
+    """converge {domainPrefix}.{rootDomain} to one health checked record per endpoint
+
+    endpoints: list of dicts with `setIdentifier`, `serverAddress` and either
+    `region` (latency routing) or `failover` (PRIMARY / SECONDARY), and
+    `healthCheckAlarm`, the name of the endpoint's health alarm in `region`
+    (`alarmRegion` for failover records). Without an alarm the record target
+    is probed over HTTPS; `healthCheckAddress`, `healthCheckPort` and
+    `healthCheckProtocol` override where the /healthcheck probe is sent.
+
+    Records whose set identifier is not in endpoints, and a simple CNAME left
+    behind by update_hosted_zone_cname_record, are deleted in the same change
+    batch and their health checks removed afterwards. Running it again with
+    the same endpoints makes no changes.
+    """
+    fqdn = f"{domainPrefix}.{rootDomain}"
+
+    if routingPolicy == "failover":
+        roles = sorted(e["failover"] for e in endpoints)
+        if roles not in (["PRIMARY"], ["PRIMARY", "SECONDARY"]):
+            raise Exception(
+                f"Failover routing needs one PRIMARY and at most one SECONDARY: {roles}")
+
+    existing = get_health_checks(fqdn)
+    desired = {}
+    for e in endpoints:
+        healthCheckId = ensure_health_check(
+            fqdn,
+            e["setIdentifier"],
+            e.get("healthCheckAddress", e["serverAddress"]),
+            port=e.get("healthCheckPort", 443),
+            protocol=e.get("healthCheckProtocol", "HTTPS"),
+            existing=existing,
+            alarm=_alarm(e),
+        )
+        desired[e["setIdentifier"]] = _routed_record_set(
+            fqdn + ".", e, healthCheckId, routingPolicy, ttl)
+    liveHealthChecks = {r["HealthCheckId"] for r in desired.values()}
+
+    changes = []
+    for r in get_record_sets(hostedZoneID, fqdn):
+        setIdentifier = r.get("SetIdentifier")
+        if setIdentifier in desired and r == desired[setIdentifier]:
+            del desired[setIdentifier]
+        elif setIdentifier not in desired:
+            changes.append({"Action": "DELETE", "ResourceRecordSet": r})
+
+    for r in desired.values():
+        changes.append({"Action": "UPSERT", "ResourceRecordSet": r})
+
+    response = None
+    if changes:
+        response = client.change_resource_record_sets(
+            HostedZoneId=hostedZoneID,
+            ChangeBatch={
+                "Comment": f"Reconciling {routingPolicy} records for {fqdn}",
+                "Changes": changes,
+            },
+        )
+        logger.info(response)
+
+    # health checks can only be removed once no record references them
+    for healthCheckId in existing:
+        if healthCheckId not in liveHealthChecks:
+            logger.info(f"Deleting stale health check: {healthCheckId}")
+            client.delete_health_check(HealthCheckId=healthCheckId)
+
+    return response
+
+
+def upsert_routed_cname_record(
+    hostedZoneID, rootDomain, domainPrefix, endpoint, routingPolicy="latency", ttl=60
+):
+    """add or update a single region's record, leaving other regions' records alone
+
+    Used by each regional deployment to register itself; endpoint takes the
+    same keys as in reconcile_routed_cname_records.
+    """
+    fqdn = f"{domainPrefix}.{rootDomain}"
+    existing = get_health_checks(fqdn)
+    healthCheckId = ensure_health_check(
+        fqdn,
+        endpoint["setIdentifier"],
+        endpoint.get("healthCheckAddress", endpoint["serverAddress"]),
+        port=endpoint.get("healthCheckPort", 443),
+        protocol=endpoint.get("healthCheckProtocol", "HTTPS"),
+        existing=existing,
+        alarm=_alarm(endpoint),
+    )
+
+    response = client.change_resource_record_sets(
+        HostedZoneId=hostedZoneID,
+        ChangeBatch={
+            "Comment": f"Updating {fqdn} {endpoint['setIdentifier']} record",
+            "Changes": [
+                {
+                    "Action": "UPSERT",
+                    "ResourceRecordSet": _routed_record_set(
+                        fqdn, endpoint, healthCheckId, routingPolicy, ttl),
+                }
+            ],
+        },
+    )
+
+    for staleId, h in existing.items():
+        if _is_for(h, fqdn, endpoint["setIdentifier"]) and staleId != healthCheckId:
+            client.delete_health_check(HealthCheckId=staleId)
+
+    return response
+
+
+def delete_routed_cname_record(hostedZoneID, rootDomain, domainPrefix, setIdentifier):
+    """remove a single region's record and its health check"""
+    fqdn = f"{domainPrefix}.{rootDomain}"
+
+    response = None
+    for r in get_record_sets(hostedZoneID, fqdn):
+        if r.get("SetIdentifier") != setIdentifier:
+            continue
+        # delete requires the record exactly as stored, so reuse the listing
+        response = client.change_resource_record_sets(
+            HostedZoneId=hostedZoneID,
+            ChangeBatch={
+                "Comment": f"Deleting {fqdn} {setIdentifier} record",
+                "Changes": [{"Action": "DELETE", "ResourceRecordSet": r}],
+            },
+        )
+
+    for healthCheckId, h in get_health_checks(fqdn).items():
+        if _is_for(h, fqdn, setIdentifier):
+            client.delete_health_check(HealthCheckId=healthCheckId)
+
+    return response
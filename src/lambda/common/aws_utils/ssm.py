@@ -3,18 +3,27 @@
 # Licensed under the Amazon Software License  http://aws.amazon.com/asl/
 
 import os
+import json
 import time
+import uuid
 import logging
 
 import boto3
 from botocore.exceptions import ClientError
 
+# written by the scripts from config.*
+from config.phases import PHASE_MARKER
+
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
 logger = logging.getLogger()
 logger.setLevel(LOG_LEVEL)
 
 client = boto3.client("ssm")
 
+PHASE_LOG_DIR = "/var/log/ove-phases"
+PHASE_LOG_ATTEMPTS = 30
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "Omniverse/Provisioning")
+
 
 def get_param_value(name) -> str:
     response = client.get_parameter(Name=name)
@@ -34,13 +43,129 @@ def update_param_value(name, value) -> bool:
         return False
 
 
+def phase_profile(output) -> dict:
+    """per-phase durations from the `##phase|kind|name|epoch` markers in output
+
+    Phases without an end marker (the script exited or the output was
+    truncated) are reported with seconds None.
+    """
+    script = None
+    phases = []
+    started = {}
+    for line in (output or "").splitlines():
+        if not line.startswith(PHASE_MARKER + "|"):
+            continue
+        try:
+            _, kind, name, stamp = line.strip().split("|")
+            stamp = float(stamp)
+        except ValueError:
+            continue
+
+        if kind == "script":
+            script = script or name
+        elif kind == "start":
+            started[name] = len(phases)
+            phases.append({"name": name, "start": stamp, "end": None, "seconds": None})
+        elif kind == "end" and name in started:
+            phase = phases[started.pop(name)]
+            phase["end"] = stamp
+            phase["seconds"] = round(stamp - phase["start"], 3)
+
+    total = None
+    if phases:
+        last = max(p["end"] or p["start"] for p in phases)
+        total = round(last - phases[0]["start"], 3)
+    return {"script": script, "phases": phases, "total_seconds": total}
+
+
+def emit_phase_metrics(profile, instance_id, dimensions=None):
+    """one CloudWatch Embedded Metric Format line per completed phase
+
+    Printed rather than sent with PutMetricData, Lambda ships stdout to
+    CloudWatch Logs, which extracts the metrics without extra calls or IAM.
+    """
+    dimensions = dict(dimensions or {})
+    dimensions["Script"] = profile["script"] or "unknown"
+    keys = sorted(dimensions)
+
+    for phase in profile["phases"]:
+        if phase["seconds"] is None:
+            continue
+        print(json.dumps({
+            "_aws": {
+                "Timestamp": int(phase["end"] * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": METRICS_NAMESPACE,
+                    "Dimensions": [keys + ["Phase"], keys],
+                    "Metrics": [{"Name": "PhaseDuration", "Unit": "Seconds"}],
+                }],
+            },
+            **dimensions,
+            "Phase": phase["name"],
+            "InstanceId": instance_id,
+            "PhaseDuration": phase["seconds"],
+        }))
+
+
+def read_phase_log(instance_id, path) -> str:
+    """the markers a run wrote to path, fetched with a second command since
+    the run's own output is truncated; empty if they cannot be read"""
+    try:
+        response = client.send_command(
+            InstanceIds=[instance_id],
+            DocumentName="AWS-RunShellScript",
+            Parameters={"commands": [f"cat {path} && rm -f {path}"]},
+            Comment="aws_utils.ssm.read_phase_log",
+        )
+        command_id = response["Command"]["CommandId"]
+        for _ in range(PHASE_LOG_ATTEMPTS):
+            time.sleep(1)
+            try:
+                result = client.get_command_invocation(CommandId=command_id, InstanceId=instance_id)
+            except client.exceptions.InvocationDoesNotExist:
+                continue
+            if result["Status"] not in ("Pending", "InProgress", "Delayed"):
+                return result["StandardOutputContent"]
+    except ClientError as e:
+        logger.warning("Could not read phase log {}: {}".format(path, e))
+        return ""
+
+    logger.warning("Could not read phase log {} in time allowed".format(path))
+    return ""
+
+
+def _record_phases(result, instance_id, metric_dimensions, phase_log):
+    if not phase_log:
+        return
+    profile = phase_profile(read_phase_log(instance_id, phase_log))
+    result["PhaseProfile"] = profile
+    if profile["phases"]:
+        logger.info("Phase profile: {}".format(json.dumps(profile)))
+        emit_phase_metrics(profile, instance_id, metric_dimensions)
+
+
 def run_commands(
-    instance_id, commands, document="AWS-RunPowerShellScript", comment="aws_utils.ssm.run_commands"
+    instance_id, commands, document="AWS-RunPowerShellScript", comment="aws_utils.ssm.run_commands",
+    metric_dimensions=None, interval=10, attempts=10
 ):
     """alt document options:
     AWS-RunShellScript
+
+    Sends and polls after interval * attempt seconds; a short interval with
+    more attempts notices a quick command finishing sooner.
+
+    The result carries a PhaseProfile parsed from the phase markers of
+    config.* scripts, also emitted as PhaseDuration metrics with
+    metric_dimensions, e.g. {"NucleusBuild": build} to compare releases.
+    The markers go to a file of their own, read back once the command is
+    done, see read_phase_log.
     """
 
+    phase_log = None
+    if any(PHASE_MARKER in command for command in commands):
+        phase_log = f"{PHASE_LOG_DIR}/{uuid.uuid4().hex}.log"
+        commands = [f"mkdir -p {PHASE_LOG_DIR} && export OVE_PHASE_LOG={phase_log}"] + list(commands)
+
     # Run Commands
     logger.info("Calling SendCommand: {} for instance: {}".format(
         commands, instance_id))
@@ -49,7 +174,7 @@ def run_commands(
     while attempt < 20:
         attempt = attempt + 1
         try:
-            time.sleep(10 * attempt)
+            time.sleep(interval * attempt)
             logger.info("SendCommand, attempt #: {}".format(attempt))
             response = client.send_command(
                 InstanceIds=[instance_id],
@@ -88,10 +213,10 @@ def run_commands(
     )
     attempt = 0
     result = None
-    while attempt < 10:
+    while attempt < attempts:
         attempt = attempt + 1
         try:
-            time.sleep(10 * attempt)
+            time.sleep(interval * attempt)
             logger.info("GetCommandInvocation, attempt #: {}".format(attempt))
             result = client.get_command_invocation(
                 CommandId=command_id,
@@ -105,15 +230,16 @@ def run_commands(
             elif result["Status"] == "Success":
                 logger.info("Command Output: {}".format(
                     result["StandardOutputContent"]))
+                _record_phases(result, instance_id, metric_dimensions, phase_log)
 
                 if result["StandardErrorContent"]:
-                    message = "Command returned STDERR: {}".format(
-                        result["StandardErrorContent"])
+                    message = "Command returned STDERR: {}".format(result["StandardErrorContent"])
                     logger.warning(message)
 
                 break
 
             elif result["Status"] == "Failed":
+                _record_phases(result, instance_id, metric_dimensions, phase_log)
                 message = "Error Running Command: {}".format(
                     result["StandardErrorContent"])
                 logger.error(message)
@@ -1,37 +1,69 @@
+from config.phases import with_phase_markers
 
-def start_nucleus_config() -> list[str]:
-    return '''
+
+def start_nucleus_config(prewarm: bool = True) -> list[str]:
+    """prewarm=False skips reading the data volumes, for a resume on volumes
+    that were not restored since the stack last ran"""
+    lines = '''
         cd /opt/ove/base_stack || exit 1
+    '''.splitlines()
+    if prewarm:
+        lines += '''
+        echo "PREWARMING DATA ROOT ----------------------------------"
+        # a data volume restored from a snapshot is fetched from S3 on first read
+        sudo nst prewarm --mode files --recent-hours 72 --max-seconds 120 || true
+        '''.splitlines()
+    lines += '''
         echo "STARTING NUCLEUS STACK ----------------------------------"
         docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml start
     '''.splitlines()
+    if prewarm:
+        lines += '''
+        # --collect: a failed earlier run must not keep the unit name taken
+        sudo systemd-run --collect --unit nst-prewarm --nice 10 nst prewarm --mode device --parallelism 4 --rate-mb 100 || true
+        '''.splitlines()
+    lines += '''
+        echo "WAITING FOR NUCLEUS SERVICES ----------------------------------"
+        # succeeds only once every container is up and every upstream port answers
+        sudo nst wait-ready --env-file nucleus-stack.env --compose-file nucleus-stack-ssl.yml --timeout 300 || exit 1
+    '''.splitlines()
+    return with_phase_markers(lines)
+
+
+def nucleus_ready_config(timeout: int = 10) -> list[str]:
+    """exits 0 only if every Nucleus service is up, without starting anything"""
+    return f'''
+        cd /opt/ove/base_stack || exit 1
+        sudo nst wait-ready --env-file nucleus-stack.env --compose-file nucleus-stack-ssl.yml --timeout {timeout} || exit 1
+    '''.splitlines()
 
 
 def stop_nucleus_config() -> list[str]:
-    return '''
+    return with_phase_markers('''
         cd /opt/ove/base_stack || exit 1
         echo "STOPPING NUCLEUS STACK ----------------------------------"
         docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml stop
-    '''.splitlines()
+    '''.splitlines())
 
 
-def restart_nucleus_config() -> list[str]:
-    return '''
+def restart_nucleus_config(services: list[str] = None) -> list[str]:
+    services = " ".join(services or [])
+    return with_phase_markers(f'''
         cd /opt/ove/base_stack || exit 1
         echo "RESTARTING NUCLEUS STACK ----------------------------------"
-        docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml restart
-    '''.splitlines()
+        docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml restart {services}
+    '''.splitlines())
 
 
 def get_config(artifacts_bucket_name: str, full_domain: str, nucleus_build: str, ov_main_password: str, ov_service_password: str) -> list[str]:
-    return f'''
+    return with_phase_markers(f'''
         echo "------------------------ NUCLEUS SERVER CONFIG ------------------------"
         echo "UPDATING AND INSTALLING DEPS ----------------------------------"
         sudo apt-get update -y -q && sudo apt-get upgrade -y
         sudo apt-get install dialog apt-utils -y
 
         echo "INSTALLING AWS CLI ----------------------------------"
-        sudo curl "https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip" -o "awscliv2.zip"
+        sudo curl -sS "https://awscli.amazonaws.com/awscli-exe-linux-x86_64.zip" -o "awscliv2.zip"
         sudo apt-get install unzip
         sudo unzip awscliv2.zip
         sudo ./aws/install
@@ -40,7 +72,7 @@ def get_config(artifacts_bucket_name: str, full_domain: str, nucleus_build: str,
 
         echo "INSTALLING PYTHON ----------------------------------"
         sudo apt-get -y install python3.9
-        sudo curl https://bootstrap.pypa.io/get-pip.py -o get-pip.py
+        sudo curl -sS https://bootstrap.pypa.io/get-pip.py -o get-pip.py
         sudo python3.9 get-pip.py
         sudo pip3 install --upgrade pip
         sudo pip3 --version
@@ -55,17 +87,31 @@ def get_config(artifacts_bucket_name: str, full_domain: str, nucleus_build: str,
         sudo systemctl enable --now docker
 
         echo "INSTALLING DOCKER COMPOSE ----------------------------------"
-        sudo curl -L "https://github.com/docker/compose/releases/download/1.29.2/docker-compose-$(uname -s)-$(uname -m)" -o /usr/local/bin/docker-compose
+        sudo curl -sSL "https://github.com/docker/compose/releases/download/1.29.2/docker-compose-$(uname -s)-$(uname -m)" -o /usr/local/bin/docker-compose
         sudo chmod +x /usr/local/bin/docker-compose
 
         echo "INSTALLING NUCLEUS TOOLS ----------------------------------"
         sudo mkdir -p /opt/ove
         cd /opt/ove || exit 1
+        aws s3 cp --recursive s3://{artifacts_bucket_name}/tools/common/ ./common
         aws s3 cp --recursive s3://{artifacts_bucket_name}/tools/nucleusServer/ ./nucleusServer
         cd nucleusServer || exit 1
         sudo pip3 install -r requirements.txt
 
+        echo "PREPARING DATA ROOT ----------------------------------"
+        # stripes and mounts any extra data volumes, no-op on the root volume only
+        sudo nst prepare-data-root --mount-point /var/lib/omni/nucleus-data || exit 1
+
+        echo "BENCHMARKING LFT COMPRESSION ----------------------------------"
+        # sets LFT_COMPRESSION in the env generated below, once: skipped when a recommendation is saved
+        sudo nst benchmark-lft-compression --data-root /var/lib/omni/nucleus-data || true
+
         echo "UNPACKAGING NUCLEUS STACK ----------------------------------"
+        # keep what the running stack was started with, the archive overwrites both
+        if [ -f /opt/ove/base_stack/nucleus-stack.env ]; then
+            sudo cp /opt/ove/base_stack/nucleus-stack.env /opt/ove/base_stack/nucleus-stack.env.prev
+            sudo cp /opt/ove/base_stack/nucleus-stack-ssl.yml /opt/ove/base_stack/nucleus-stack-ssl.yml.prev
+        fi
         sudo tar xzvf stack/{nucleus_build}.tar.gz -C /opt/ove --strip-components=1
         cd /opt/ove/base_stack || exit 1
         omniverse_data_path=/var/lib/omni/nucleus-data
@@ -75,9 +121,18 @@ def get_config(artifacts_bucket_name: str, full_domain: str, nucleus_build: str,
         ./generate-sample-insecure-secrets.sh
 
         echo "PULLING NUCLEUS IMAGES ----------------------------------"
-        docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml pull
+        docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml pull --quiet
+
+        echo "PREWARMING DATA ROOT ----------------------------------"
+        # a data volume restored from a snapshot is fetched from S3 on first read
+        sudo nst prewarm --data-root $omniverse_data_path --mode files --recent-hours 72 --max-seconds 120 || true
 
         echo "STARTING NUCLEUS STACK ----------------------------------"
-        docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml up -d
+        if [ -f nucleus-stack.env.prev ]; then
+            sudo nst apply-nucleus-stack-env --previous-env nucleus-stack.env.prev --env-file nucleus-stack.env --compose-file nucleus-stack-ssl.yml --previous-compose-file nucleus-stack-ssl.yml.prev || exit 1
+        else
+            docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml up -d
+        fi
         docker-compose --env-file nucleus-stack.env -f nucleus-stack-ssl.yml ps -a
-    '''.splitlines()
+        sudo systemd-run --collect --unit nst-prewarm --nice 10 nst prewarm --data-root $omniverse_data_path --mode device --parallelism 4 --rate-mb 100 || true
+    '''.splitlines())
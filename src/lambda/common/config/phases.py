@@ -0,0 +1,53 @@
+import re
+
+# parsed back by aws_utils.ssm.phase_profile
+PHASE_MARKER = "##phase"
+# aws_utils.ssm.run_commands sets OVE_PHASE_LOG to a file per run, scripts
+# started another way append to PHASE_LOG
+PHASE_LOG = "/var/log/ove-phases.log"
+
+BANNER_PATTERN = re.compile(r'^\s*echo "([A-Z][A-Z0-9 ]*?) -{5,}"\s*$')
+TITLE_PATTERN = re.compile(r'^\s*echo "-{5,} ([A-Z][A-Z0-9 ]*?) -{5,}"\s*$')
+
+
+def _slug(title: str) -> str:
+    return title.strip().lower().replace(" ", "-")
+
+
+def _marker(kind: str, name: str) -> str:
+    # to a file read back after the script: SSM keeps only the first 24000
+    # characters of stdout and 8000 of stderr, which apt, pip and docker
+    # fill long before the last phase
+    return f'        echo "{PHASE_MARKER}|{kind}|{name}|$(date +%s.%N)" >> "${{OVE_PHASE_LOG:-{PHASE_LOG}}}"'
+
+
+def with_phase_markers(lines: list[str]) -> list[str]:
+    """add machine readable start/end markers around every banner section
+
+    `echo "SOME PHASE -----"` starts a phase that ends at the next banner or
+    at the end of the script; the `----- TITLE -----` banner names the script.
+    A phase left through `exit` has no end marker.
+    """
+    marked = []
+    current = None
+    script = None
+    for line in lines:
+        title = TITLE_PATTERN.match(line)
+        banner = BANNER_PATTERN.match(line)
+        if title and script is None:
+            script = _slug(title.group(1))
+            marked.append(line)
+            marked.append(_marker("script", script))
+            continue
+        if banner:
+            if current:
+                marked.append(_marker("end", current))
+            current = _slug(banner.group(1))
+            marked.append(line)
+            marked.append(_marker("start", current))
+            continue
+        marked.append(line)
+
+    if current:
+        marked.append(_marker("end", current))
+    return marked
@@ -1,5 +1,15 @@
-def get_config(artifacts_bucket_name: str, nucleus_address: str, full_domain: str) -> list[str]:
-    return f'''
+from config.phases import with_phase_markers
+
+
+def _server_address_args(nucleus_addresses: list[str]) -> str:
+    if isinstance(nucleus_addresses, str):
+        nucleus_addresses = [nucleus_addresses]
+    return " ".join(f"--server-address {a}" for a in nucleus_addresses)
+
+
+def get_config(artifacts_bucket_name: str, nucleus_addresses: list[str], full_domain: str) -> list[str]:
+    server_addresses = _server_address_args(nucleus_addresses)
+    return with_phase_markers(f'''
         echo "------------------------ REVERSE PROXY CONFIG ------------------------"
 
         echo "UPDATING PACKAGES ----------------------------------"
@@ -15,7 +25,7 @@ def get_config(artifacts_bucket_name: str, nucleus_address: str, full_domain: st
         sudo nginx -v
 
         echo "INSTALLING PYTHON ----------------------------------"
-        sudo wget https://www.python.org/ftp/python/3.9.9/Python-3.9.9.tgz -P /opt/python3.9
+        sudo wget -q https://www.python.org/ftp/python/3.9.9/Python-3.9.9.tgz -P /opt/python3.9
         cd /opt/python3.9 || exit 1
         sudo tar xzf Python-3.9.9.tgz
         cd Python-3.9.9 || exit 1
@@ -25,12 +35,40 @@ def get_config(artifacts_bucket_name: str, nucleus_address: str, full_domain: st
         echo "------------------------ REVERSE PROXY CONFIG ------------------------"
         echo "INSTALLING REVERSE PROXY TOOLS ----------------------------------"
         cd /opt || exit 1
+        sudo aws s3 cp --recursive s3://{artifacts_bucket_name}/tools/common/ ./common
         sudo aws s3 cp --recursive s3://{artifacts_bucket_name}/tools/reverseProxy/ ./reverseProxy
         cd reverseProxy || exit 1
         pip3 --version
         sudo pip3 install -r requirements.txt
-        sudo rpt generate-nginx-config --domain {full_domain} --server-address {nucleus_address}
+        sudo rpt generate-nginx-config --domain {full_domain} {server_addresses}
+        sudo rpt install-ticket-rotation
 
         echo "STARTING NGINX ----------------------------------"
         sudo service nginx restart
-    '''.splitlines()
+    '''.splitlines())
+
+
+def get_reconfigure_config(nucleus_addresses: list[str], full_domain: str) -> list[str]:
+    """re-render nginx.conf with the already installed tools and reload gracefully
+
+    Only valid on an instance that already went through get_config; fails
+    without touching the running config if nginx is not up or the rendered
+    config does not validate.
+    """
+    server_addresses = _server_address_args(nucleus_addresses)
+    return with_phase_markers(f'''
+        echo "------------------------ REVERSE PROXY RECONFIGURE ------------------------"
+        sudo systemctl is-active --quiet nginx || exit 1
+        cd /opt/reverseProxy || exit 1
+
+        echo "RENDERING NGINX CONFIG ----------------------------------"
+        sudo rpt generate-nginx-config --domain {full_domain} {server_addresses} --output-path /etc/nginx/nginx.conf.next || exit 1
+
+        echo "VALIDATING NGINX CONFIG ----------------------------------"
+        sudo nginx -t -c /etc/nginx/nginx.conf.next || exit 1
+        sudo cp /etc/nginx/nginx.conf /etc/nginx/nginx.conf.prev
+        sudo mv /etc/nginx/nginx.conf.next /etc/nginx/nginx.conf
+
+        echo "RELOADING NGINX ----------------------------------"
+        sudo nginx -s reload
+    '''.splitlines())
@@ -0,0 +1,105 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import os
+import logging
+import json
+
+from crhelper import CfnResource
+
+import aws_utils.r53 as r53
+import aws_utils.idempotency as idempotency
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
+logger = logging.getLogger()
+logger.setLevel(LOG_LEVEL)
+
+helper = CfnResource(
+    json_logging=False, log_level="DEBUG", boto_level="CRITICAL"
+)
+
+
+def endpoint(properties):
+    """this region's endpoint, as r53.upsert_routed_cname_record takes it"""
+    return {
+        "setIdentifier": properties["SET_IDENTIFIER"],
+        "serverAddress": properties["SERVER_ADDRESS"],
+        "region": properties["region"],
+        "failover": properties.get("FAILOVER", "PRIMARY"),
+        "healthCheckAlarm": properties["HEALTH_CHECK_ALARM"],
+    }
+
+
+def upsert_record(properties):
+    return r53.upsert_routed_cname_record(
+        properties["HOSTED_ZONE_ID"],
+        properties["ROOT_DOMAIN"],
+        properties["DOMAIN_PREFIX"],
+        endpoint(properties),
+        routingPolicy=properties["ROUTING_POLICY"],
+    )
+
+
+def delete_record(properties):
+    return r53.delete_routed_cname_record(
+        properties["HOSTED_ZONE_ID"],
+        properties["ROOT_DOMAIN"],
+        properties["DOMAIN_PREFIX"],
+        properties["SET_IDENTIFIER"],
+    )
+
+
+@helper.create
+def create(event, context):
+    logger.info("Create Event: %s", json.dumps(event, indent=2))
+
+    response, _ = idempotency.run_for_event(
+        event["RequestId"],
+        idempotency.resource_event_inputs(event),
+        lambda: upsert_record(event["ResourceProperties"]),
+        context,
+    )
+    logger.info("Change Results: %s", json.dumps(response, indent=2, default=str))
+
+
+@helper.update
+def update(event, context):
+    logger.info("Update Event: %s", json.dumps(event, indent=2))
+
+    response, _ = idempotency.run_for_event(
+        event["RequestId"],
+        idempotency.resource_event_inputs(event),
+        lambda: apply_update(event),
+        context,
+    )
+    logger.info("Change Results: %s", json.dumps(response, indent=2, default=str))
+
+
+def apply_update(event):
+    old = event.get("OldResourceProperties", {})
+    new = event["ResourceProperties"]
+    # Route 53 cannot change a record's name, set identifier or routing
+    # policy in place
+    keys = ("HOSTED_ZONE_ID", "ROOT_DOMAIN", "DOMAIN_PREFIX", "SET_IDENTIFIER", "ROUTING_POLICY")
+    if old and any(old.get(k) != new.get(k) for k in keys):
+        logger.info(f"Replacing record {old.get('SET_IDENTIFIER')}")
+        delete_record(old)
+    return upsert_record(new)
+
+
+@helper.delete
+def delete(event, context):
+    logger.info("Delete Event: %s", json.dumps(event, indent=2))
+
+    response, _ = idempotency.run_for_event(
+        event["RequestId"],
+        idempotency.resource_event_inputs(event),
+        lambda: delete_record(event["ResourceProperties"]),
+        context,
+    )
+    logger.info("Change Results: %s", json.dumps(response, indent=2, default=str))
+
+
+def handler(event, context):
+    helper(event, context)
@@ -5,12 +5,14 @@
 import os
 import logging
 import json
+from concurrent.futures import ThreadPoolExecutor
 
 
 from crhelper import CfnResource
 
 import aws_utils.ssm as ssm
 import aws_utils.sm as sm
+import aws_utils.idempotency as idempotency
 import config.nucleus as config
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
@@ -25,20 +27,26 @@ helper = CfnResource(json_logging=False, log_level="DEBUG",
 def create(event, context):
     logger.info("Create Event: %s", json.dumps(event, indent=2))
 
-    instanceId = event["ResourceProperties"]["instanceId"]
+    instanceIds = get_instance_ids(event["ResourceProperties"])
     reverseProxyDomain = event["ResourceProperties"]["reverseProxyDomain"]
     artifactsBucket = event["ResourceProperties"]["artifactsBucket"]
     nucleusBuild = event["ResourceProperties"]["nucleusBuild"]
     ovMainLoginSecretArn = event["ResourceProperties"]["ovMainLoginSecretArn"]
     ovServiceLoginSecretArn = event["ResourceProperties"]["ovServiceLoginSecretArn"]
 
-    response = update_nucleus_config(
-        instanceId,
-        artifactsBucket,
-        reverseProxyDomain,
-        nucleusBuild,
-        ovMainLoginSecretArn,
-        ovServiceLoginSecretArn,
+    # a redelivered event returns the first run's outcome instead of reinstalling
+    response, _ = idempotency.run_for_event(
+        event["RequestId"],
+        idempotency.resource_event_inputs(event),
+        lambda: update_nucleus_config(
+            instanceIds,
+            artifactsBucket,
+            reverseProxyDomain,
+            nucleusBuild,
+            ovMainLoginSecretArn,
+            ovServiceLoginSecretArn,
+        ),
+        context,
     )
     logger.info("Run Command Results: %s", json.dumps(response, indent=2))
 
@@ -47,26 +55,39 @@ def create(event, context):
 def update(event, context):
     logger.info("Update Event: %s", json.dumps(event, indent=2))
 
-    instanceId = event["ResourceProperties"]["instanceId"]
+    instanceIds = get_instance_ids(event["ResourceProperties"])
     reverseProxyDomain = event["ResourceProperties"]["reverseProxyDomain"]
     artifactsBucket = event["ResourceProperties"]["artifactsBucket"]
     nucleusBuild = event["ResourceProperties"]["nucleusBuild"]
     ovMainLoginSecretArn = event["ResourceProperties"]["ovMainLoginSecretArn"]
     ovServiceLoginSecretArn = event["ResourceProperties"]["ovServiceLoginSecretArn"]
 
-    response = update_nucleus_config(
-        instanceId,
-        artifactsBucket,
-        reverseProxyDomain,
-        nucleusBuild,
-        ovMainLoginSecretArn,
-        ovServiceLoginSecretArn,
+    # a redelivered event returns the first run's outcome instead of reinstalling
+    response, _ = idempotency.run_for_event(
+        event["RequestId"],
+        idempotency.resource_event_inputs(event),
+        lambda: update_nucleus_config(
+            instanceIds,
+            artifactsBucket,
+            reverseProxyDomain,
+            nucleusBuild,
+            ovMainLoginSecretArn,
+            ovServiceLoginSecretArn,
+        ),
+        context,
     )
     logger.info("Run Command Results: %s", json.dumps(response, indent=2))
 
 
+def get_instance_ids(properties):
+    # `instanceIds` for a multi-Nucleus fleet, `instanceId` for a single server
+    if "instanceIds" in properties:
+        return list(properties["instanceIds"])
+    return [properties["instanceId"]]
+
+
 def update_nucleus_config(
-    instanceId,
+    instanceIds,
     artifactsBucket,
     reverseProxyDomain,
     nucleusBuild,
@@ -91,8 +112,28 @@ def update_nucleus_config(
     for p in commands:
         print(p)
 
-    response = ssm.run_commands(
-        instanceId, commands, document="AWS-RunShellScript")
+    # configure every server at once, the install is dominated by waiting on
+    # the instances rather than by the Lambda
+    def run(instanceId):
+        return ssm.run_commands(
+            instanceId, commands, document="AWS-RunShellScript",
+            metric_dimensions={"NucleusBuild": nucleusBuild})
+
+    with ThreadPoolExecutor(max_workers=len(instanceIds)) as executor:
+        futures = {i: executor.submit(run, i) for i in instanceIds}
+
+    response = []
+    errors = []
+    for instanceId, future in futures.items():
+        try:
+            response.append(future.result())
+        except Exception as e:
+            errors.append(f"{instanceId}: {e}")
+
+    if errors:
+        raise Exception(
+            "Failed to configure Nucleus servers. {}".format("; ".join(errors)))
+
     return response
 
 
@@ -6,6 +6,7 @@ from crhelper import CfnResource
 
 import aws_utils.ssm as ssm
 import aws_utils.ec2 as ec2
+import aws_utils.idempotency as idempotency
 import config.reverseProxy as config
 
 LOG_LEVEL = os.getenv("LOG_LEVEL", "DEBUG")
@@ -16,16 +17,25 @@ helper = CfnResource(
     json_logging=False, log_level="DEBUG", boto_level="CRITICAL"
 )
 
+# properties that only feed the rendered nginx.conf; when nothing else
+# changed an update re-renders and reloads nginx instead of reinstalling
+INCREMENTAL_PROPERTIES = {"FULL_DOMAIN", "NUCLEUS_SERVER_ADDRESS"}
+
 
 @helper.create
 def create(event, context):
     logger.info("Create Event: %s", json.dumps(event, indent=2))
 
-    response = update_config(
-        event["ResourceProperties"]["STACK_NAME"],
-        event["ResourceProperties"]["ARTIFACTS_BUCKET_NAME"],
-        event["ResourceProperties"]["FULL_DOMAIN"],
-        event["ResourceProperties"]["RP_AUTOSCALING_GROUP_NAME"],
+    response, _ = idempotency.run_for_event(
+        event["RequestId"],
+        idempotency.resource_event_inputs(event),
+        lambda: update_config(
+            event["ResourceProperties"]["STACK_NAME"],
+            event["ResourceProperties"]["ARTIFACTS_BUCKET_NAME"],
+            event["ResourceProperties"]["FULL_DOMAIN"],
+            event["ResourceProperties"]["RP_AUTOSCALING_GROUP_NAME"],
+        ),
+        context,
     )
     logger.info("Run Command Results: %s", json.dumps(response, indent=2))
 
@@ -34,20 +44,54 @@ def create(event, context):
 def update(event, context):
     logger.info("Update Event: %s", json.dumps(event, indent=2))
 
-    response = update_config(
+    # a redelivered event returns the first run's outcome instead of reconfiguring
+    response, _ = idempotency.run_for_event(
+        event["RequestId"],
+        idempotency.resource_event_inputs(event),
+        lambda: apply_update(event),
+        context,
+    )
+    logger.info("Run Command Results: %s", json.dumps(response, indent=2))
+
+
+def apply_update(event):
+    changed = changed_properties(event)
+    logger.info(f"Changed properties: {sorted(changed)}")
+
+    if changed <= INCREMENTAL_PROPERTIES:
+        try:
+            response = update_config(
+                event["ResourceProperties"]["STACK_NAME"],
+                event["ResourceProperties"]["ARTIFACTS_BUCKET_NAME"],
+                event["ResourceProperties"]["FULL_DOMAIN"],
+                event["ResourceProperties"]["RP_AUTOSCALING_GROUP_NAME"],
+                incremental=True,
+            )
+            return response
+        except Exception as e:
+            logger.warning(
+                f"Incremental reconfigure failed, falling back to full config. {e}")
+
+    return update_config(
         event["ResourceProperties"]["STACK_NAME"],
         event["ResourceProperties"]["ARTIFACTS_BUCKET_NAME"],
         event["ResourceProperties"]["FULL_DOMAIN"],
         event["ResourceProperties"]["RP_AUTOSCALING_GROUP_NAME"],
     )
-    logger.info("Run Command Results: %s", json.dumps(response, indent=2))
+
+
+def changed_properties(event):
+    old = event.get("OldResourceProperties", {})
+    new = event["ResourceProperties"]
+    return {k for k in set(old) | set(new) if old.get(k) != new.get(k)}
 
 
 def update_config(
     stack_name,
     artifacts_bucket_name,
     full_domain,
-    rp_autoscaling_group_name
+    rp_autoscaling_group_name,
+    incremental=False,
 ):
     # get nucleus main instance id
     nucleus_instances = []
@@ -60,15 +104,23 @@ def update_config(
 
     logger.info(f"Nucleus Instances: {nucleus_instances}")
 
-    # get nucleus main hostname
-    nucleus_hostname = ec2.get_instance_private_dns_name(nucleus_instances[0])
-    logger.info(f"Nucleus Hostname: {nucleus_hostname}")
+    # get hostnames of every nucleus server, sorted so every proxy renders
+    # the same upstreams
+    nucleus_hostnames = sorted(
+        ec2.get_instance_private_dns_name(i) for i in nucleus_instances or [])
+    if not nucleus_hostnames:
+        raise Exception(f"No nucleus instances found for {stack_name}")
+    logger.info(f"Nucleus Hostnames: {nucleus_hostnames}")
 
     # generate config for reverse proxy servers
     commands = []
     try:
-        commands = config.get_config(
-            artifacts_bucket_name, nucleus_hostname, full_domain)
+        if incremental:
+            commands = config.get_reconfigure_config(
+                nucleus_hostnames, full_domain)
+        else:
+            commands = config.get_config(
+                artifacts_bucket_name, nucleus_hostnames, full_domain)
         logger.debug(commands)
     except Exception as e:
         raise Exception(f"Failed to get Reverse Proxy config. {e}")
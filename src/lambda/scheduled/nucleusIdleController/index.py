@@ -0,0 +1,249 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""suspend the Nucleus stack when nobody is connected, resume it on demand
+
+Invoked with {"action": ...}:
+    check    (every few minutes) suspend running servers once the idle
+             metric stayed at or under IDLE_THRESHOLD for IDLE_MINUTES
+    suspend  suspend now, {"stopInstance": true} to also stop the instances
+    resume   start what was suspended and return once every service answers,
+             also sent by the traffic alarm on the first requests after idling
+    status   instance state and suspension of every server
+
+Suspending stops the compose stack and, with STOP_INSTANCE, the instance.
+Resuming a stopped stack on a running instance takes seconds, resuming a
+stopped instance adds its boot. Time from the resume request to ready is
+published as TimeToReady.
+"""
+
+import os
+import json
+import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+import aws_utils.cw as cw
+import aws_utils.ec2 as ec2
+import aws_utils.ssm as ssm
+import config.nucleus as config
+
+logger = logging.getLogger()
+logger.setLevel(logging.INFO)
+
+INSTANCE_IDS = os.environ["NUCLEUS_INSTANCE_IDS"].split(",")
+IDLE_MINUTES = int(os.getenv("IDLE_MINUTES", "60"))
+IDLE_THRESHOLD = float(os.getenv("IDLE_THRESHOLD", "0"))
+# load balancer connections by default, they cover every client of the stack
+IDLE_METRIC_NAMESPACE = os.getenv("IDLE_METRIC_NAMESPACE", "AWS/ApplicationELB")
+IDLE_METRIC_NAME = os.getenv("IDLE_METRIC_NAME", "ActiveConnectionCount")
+IDLE_METRIC_STATISTIC = os.getenv("IDLE_METRIC_STATISTIC", "Sum")
+IDLE_METRIC_DIMENSIONS = json.loads(os.getenv("IDLE_METRIC_DIMENSIONS", "{}"))
+# "idle" when the metric is only reported while non-zero, as for a load
+# balancer, "busy" when missing data means the publisher is down
+IDLE_MISSING_DATA = os.getenv("IDLE_MISSING_DATA", "idle")
+STOP_INSTANCE = os.getenv("STOP_INSTANCE", "false").lower() == "true"
+METRICS_NAMESPACE = os.getenv("METRICS_NAMESPACE", "Omniverse/Nucleus")
+
+SUSPENDED_TAG = "NucleusSuspended"
+RESUMED_TAG = "NucleusResumedAt"
+
+
+def emit_metric(name, value, unit, mode, instance_id):
+    # Embedded Metric Format, as aws_utils.ssm.emit_phase_metrics
+    print(json.dumps({
+        "_aws": {
+            "Timestamp": int(time.time() * 1000),
+            "CloudWatchMetrics": [{
+                "Namespace": METRICS_NAMESPACE,
+                "Dimensions": [["Mode"], []],
+                "Metrics": [{"Name": name, "Unit": unit}],
+            }],
+        },
+        "Mode": mode,
+        "InstanceId": instance_id,
+        name: value,
+    }))
+
+
+def get_tags(instance) -> dict:
+    return {t["Key"]: t["Value"] for t in instance.get("Tags", [])}
+
+
+def is_idle() -> bool:
+    values = cw.get_metric_values(
+        IDLE_METRIC_NAMESPACE, IDLE_METRIC_NAME, IDLE_METRIC_DIMENSIONS,
+        IDLE_METRIC_STATISTIC, IDLE_MINUTES)
+    logger.info(f"{IDLE_METRIC_NAME} over the last {IDLE_MINUTES} minutes: {values}")
+    if not values:
+        return IDLE_MISSING_DATA == "idle"
+    return max(values) <= IDLE_THRESHOLD
+
+
+def recently_started(instance, tags) -> bool:
+    # the metric window still covers the time the stack was down
+    started = max(instance["LaunchTime"].timestamp(), float(tags.get(RESUMED_TAG, 0)))
+    return time.time() - started < IDLE_MINUTES * 60
+
+
+def suspend(instance_id, stop_instance):
+    instance = ec2.get_instance_description(instance_id)
+    tags = get_tags(instance)
+    state = instance["State"]["Name"]
+    if state != "running":
+        return {"skipped": state}
+
+    mode = "instance" if stop_instance else "stack"
+    ec2.update_tag_value([instance_id], SUSPENDED_TAG, mode)
+    # a resume tag from now on means a resume was attempted, see check
+    if RESUMED_TAG in tags:
+        ec2.delete_tag([instance_id], RESUMED_TAG, tags[RESUMED_TAG])
+    try:
+        ssm.run_commands(
+            instance_id, config.stop_nucleus_config(), document="AWS-RunShellScript",
+            metric_dimensions={"Action": "suspend"})
+    except Exception:
+        # the stack is still up, a suspension tag left behind would make
+        # check skip the server for good
+        ec2.delete_tag([instance_id], SUSPENDED_TAG, mode)
+        if RESUMED_TAG in tags:
+            ec2.update_tag_value([instance_id], RESUMED_TAG, tags[RESUMED_TAG])
+        raise
+    if stop_instance:
+        ec2.stop_instances([instance_id])
+
+    emit_metric("Suspends", 1, "Count", mode, instance_id)
+    return {"suspended": mode}
+
+
+def resume(instance_id):
+    started = time.monotonic()
+    instance = ec2.get_instance_description(instance_id)
+    tags = get_tags(instance)
+    state = instance["State"]["Name"]
+    if state == "running" and SUSPENDED_TAG not in tags:
+        return {"skipped": "not suspended"}
+    ec2.update_tag_value([instance_id], RESUMED_TAG, str(int(time.time())))
+
+    mode = tags.get(SUSPENDED_TAG, "none")
+    if state in ("stopping", "stopped"):
+        mode = "instance"
+        if state == "stopping":
+            ec2.wait_for_instance_state(instance_id, "stopped")
+        ec2.start_instances([instance_id])
+        ec2.wait_for_instance_state(instance_id, "running")
+
+    # same volumes as before the suspend, nothing to prewarm. Short polling
+    # intervals, the command is done in seconds when the instance was running
+    ssm.run_commands(
+        instance_id, config.start_nucleus_config(prewarm=False), document="AWS-RunShellScript",
+        metric_dimensions={"Action": "resume"}, interval=1, attempts=30)
+
+    seconds = round(time.monotonic() - started, 1)
+    if SUSPENDED_TAG in tags:
+        ec2.delete_tag([instance_id], SUSPENDED_TAG, tags[SUSPENDED_TAG])
+    emit_metric("TimeToReady", seconds, "Seconds", mode, instance_id)
+    logger.info(f"{instance_id} ready in {seconds}s after resuming {mode}")
+    return {"resumed": mode, "time_to_ready_seconds": seconds}
+
+
+def status(instance_id):
+    instance = ec2.get_instance_description(instance_id)
+    tags = get_tags(instance)
+    return {
+        "state": instance["State"]["Name"],
+        "suspended": tags.get(SUSPENDED_TAG),
+        "resumed_at": tags.get(RESUMED_TAG),
+    }
+
+
+def is_ready(instance_id) -> bool:
+    try:
+        ssm.run_commands(
+            instance_id, config.nucleus_ready_config(), document="AWS-RunShellScript",
+            interval=1, attempts=10)
+        return True
+    except Exception as e:
+        logger.info(f"{instance_id} not ready: {e}")
+        return False
+
+
+def reconcile(instance_id, tags):
+    """clear the suspension a failed resume left behind once the stack runs,
+    otherwise check would skip the server for good"""
+    if not is_ready(instance_id):
+        return {"skipped": "suspended, resume incomplete"}
+    ec2.delete_tag([instance_id], SUSPENDED_TAG, tags[SUSPENDED_TAG])
+    return {"reconciled": "running"}
+
+
+def check(instance_ids):
+    """suspend the running servers when the stack has been idle"""
+    idle = None
+    result = {}
+    suspending = []
+    for instance_id in instance_ids:
+        instance = ec2.get_instance_description(instance_id)
+        tags = get_tags(instance)
+        state = instance["State"]["Name"]
+        if state == "running" and SUSPENDED_TAG in tags and RESUMED_TAG in tags:
+            result[instance_id] = reconcile(instance_id, tags)
+            continue
+        if state != "running" or SUSPENDED_TAG in tags:
+            result[instance_id] = {"skipped": "suspended" if SUSPENDED_TAG in tags else state}
+            continue
+        if recently_started(instance, tags):
+            result[instance_id] = {"skipped": "recently started"}
+            continue
+
+        # one stack-wide metric, read once
+        if idle is None:
+            idle = is_idle()
+        if not idle:
+            result[instance_id] = {"skipped": "active"}
+            continue
+        suspending.append(instance_id)
+
+    if suspending:
+        result.update(for_each(suspending, lambda i: suspend(i, STOP_INSTANCE)))
+    return result
+
+
+def for_each(instance_ids, fn):
+    with ThreadPoolExecutor(max_workers=len(instance_ids)) as executor:
+        futures = {i: executor.submit(fn, i) for i in instance_ids}
+
+    result = {}
+    errors = []
+    for instance_id, future in futures.items():
+        try:
+            result[instance_id] = future.result()
+        except Exception as e:
+            errors.append(f"{instance_id}: {e}")
+
+    if errors:
+        raise Exception("ERROR: {}".format("; ".join(errors)))
+    return result
+
+
+def handler(event, context):
+    logger.info("Event: %s", json.dumps(event, indent=2))
+
+    action = event.get("action", "check")
+    instance_ids = event.get("instanceIds") or INSTANCE_IDS
+
+    if action == "check":
+        result = check(instance_ids)
+    elif action == "suspend":
+        stop_instance = event.get("stopInstance", STOP_INSTANCE)
+        result = for_each(instance_ids, lambda i: suspend(i, stop_instance))
+    elif action == "resume":
+        result = for_each(instance_ids, resume)
+    elif action == "status":
+        result = for_each(instance_ids, status)
+    else:
+        raise Exception(f"ERROR: unknown action {action}")
+
+    logger.info("Result: %s", json.dumps(result))
+    return result
@@ -0,0 +1,144 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+non-blocking logging for the nst, rpt and lsim tools
+
+Callers only check the level and enqueue a record; redaction, formatting and
+the write to stderr happen on a background thread. Stdout is left to command
+output, e.g. `--output-format json`.
+
+LOG_LEVEL    DEBUG (default), INFO, WARNING or ERROR
+LOG_FORMAT   text (default) for the bare message, or json for one object per
+             line with timestamp, level, elapsed_ms since start and any fields
+             passed as keyword arguments, e.g. duration_ms from timer()
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import queue
+import atexit
+import logging
+import logging.handlers
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'DEBUG').upper()
+LOG_FORMAT = os.getenv('LOG_FORMAT', 'text').lower()
+
+# key=value, key: value and "key": "value" where the key looks secret
+SECRET_PATTERN = re.compile(
+    r"""(?i)(\w*(?:password|passwd|secret|token|credential|private_key|api_key)\w*)"""
+    r"""(["']?\s*[=:]\s*)("[^"]*"|'[^']*'|[^\s,;&"']+)"""
+)
+REDACTED = "***"
+
+_secrets = set()
+
+
+def add_secret(value):
+    """redact this literal value wherever it appears in a message"""
+    if value and len(str(value)) >= 4:
+        _secrets.add(str(value))
+
+
+def redact(message):
+    for value in _secrets:
+        message = message.replace(value, REDACTED)
+
+    def replace(m):
+        value = m.group(3)
+        quote = value[0] if value[0] in "\"'" else ""
+        return f"{m.group(1)}{m.group(2)}{quote}{REDACTED}{quote}"
+
+    return SECRET_PATTERN.sub(replace, message)
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        message = redact(record.getMessage())
+        if record.exc_info:
+            message += "\n" + redact(self.formatException(record.exc_info))
+        return message
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        data = {
+            "timestamp": datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": redact(record.getMessage()),
+            "elapsed_ms": round(record.relativeCreated, 1),
+        }
+        for key, value in getattr(record, "fields", {}).items():
+            data[key] = redact(value) if isinstance(value, str) else value
+        if record.exc_info:
+            data["exception"] = redact(self.formatException(record.exc_info))
+        return json.dumps(data, default=str)
+
+
+class _QueueHandler(logging.handlers.QueueHandler):
+    def prepare(self, record):
+        # formatting is left to the listener thread
+        return record
+
+
+_logger = logging.getLogger(__name__.split(".")[0])
+_logger.setLevel(getattr(logging, LOG_LEVEL, logging.INFO))
+_logger.propagate = False
+
+_stream = logging.StreamHandler(sys.stderr)
+_stream.setFormatter(JsonFormatter() if LOG_FORMAT == "json" else TextFormatter())
+
+_queue = queue.SimpleQueue()
+_logger.handlers = [_QueueHandler(_queue)]
+_listener = logging.handlers.QueueListener(_queue, _stream)
+_listener.start()
+# drain the queue before the interpreter exits
+atexit.register(_listener.stop)
+
+logger = _logger
+
+
+def _log(level, args, fields, exc_info=False):
+    if _logger.isEnabledFor(level):
+        extra = {"fields": fields} if fields else None
+        _logger.log(level, " ".join(str(a) for a in args), exc_info=exc_info, extra=extra)
+
+
+def info(*args, **fields):
+    _log(logging.INFO, args, fields)
+
+
+def debug(*args, **fields):
+    _log(logging.DEBUG, args, fields)
+
+
+def warning(*args, **fields):
+    _log(logging.WARNING, args, fields)
+
+
+def error(*args, exc_info=False, **fields):
+    _log(logging.ERROR, args, fields, exc_info)
+
+
+def flush():
+    """block until every queued record is written"""
+    _listener.stop()
+    _listener.start()
+
+
+@contextmanager
+def timer(message, level=logging.INFO, **fields):
+    """log `message` with duration_ms once the block finishes"""
+    started = time.perf_counter()
+    try:
+        yield fields
+    finally:
+        fields["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        _log(level, (f"{message} ({fields['duration_ms']}ms)",), fields)
@@ -0,0 +1,349 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+in-memory EC2, Auto Scaling, SSM, Route 53 and Secrets Manager backends
+
+Only the operations the Lambda handlers and aws_utils call are implemented.
+Every call goes through World.call, which counts it, advances the virtual
+clock by the configured latency and may raise a throttling error.
+"""
+
+import json
+import random
+import itertools
+from collections import Counter
+
+DEFAULT_LATENCY = 0.05
+
+# SSM command durations, matched against the script banners in config.*
+DEFAULT_COMMAND_DURATIONS = {
+    "NUCLEUS SERVER CONFIG": 240.0,
+    "REVERSE PROXY RECONFIGURE": 5.0,
+    "REVERSE PROXY CONFIG": 180.0,
+    # aws_utils.ssm.read_phase_log
+    "cat /var/log/ove-phases/": 1.0,
+}
+DEFAULT_COMMAND_DURATION = 30.0
+
+
+class ClientError(Exception):
+    def __init__(self, error_response, operation_name):
+        self.response = error_response
+        self.operation_name = operation_name
+        error = error_response.get("Error", {})
+        super().__init__(
+            f"An error occurred ({error.get('Code')}) when calling the {operation_name} operation: {error.get('Message')}")
+
+
+def client_error(code, operation, message=""):
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+class World:
+    """shared state, clock and call accounting for one simulated invocation"""
+
+    def __init__(self, clock, latency=None, throttle=None, command_durations=None, seed=0):
+        self.clock = clock
+        self.latency = latency or {}
+        self.throttle = throttle or {}
+        self.command_durations = dict(DEFAULT_COMMAND_DURATIONS, **(command_durations or {}))
+        self.random = random.Random(seed)
+        self.calls = Counter()
+        self.throttled = Counter()
+
+        self.instances = {}
+        self.auto_scaling_groups = {}
+        self.lifecycle_actions = []
+        self.parameters = {}
+        self.secrets = {}
+        self.commands = {}
+        self.record_sets = []
+        self.health_checks = {}
+        self.health_check_tags = {}
+        self._ids = itertools.count(1)
+
+        self.services = {
+            "ec2": EC2(self),
+            "autoscaling": AutoScaling(self),
+            "ssm": SSM(self),
+            "secretsmanager": SecretsManager(self),
+            "route53": Route53(self),
+        }
+
+    def next_id(self, prefix):
+        return f"{prefix}{next(self._ids):08x}"
+
+    def reset_accounting(self):
+        self.calls.clear()
+        self.throttled.clear()
+
+    def call(self, service, operation):
+        name = f"{service}.{operation}"
+        self.calls[name] += 1
+        self.clock.advance(self.latency.get(name, self.latency.get(service, DEFAULT_LATENCY)))
+
+        rate = self.throttle.get(name, self.throttle.get(service, 0.0))
+        if rate and self.random.random() < rate:
+            self.throttled[name] += 1
+            raise client_error("ThrottlingException", operation, "Rate exceeded")
+
+    def command_duration(self, commands):
+        script = "\n".join(commands)
+        for pattern, duration in self.command_durations.items():
+            if pattern in script:
+                return duration
+        return DEFAULT_COMMAND_DURATION
+
+    def add_instance(self, instance_id=None, name=None, state="running"):
+        instance_id = instance_id or self.next_id("i-")
+        self.instances[instance_id] = {
+            "InstanceId": instance_id,
+            "PrivateDnsName": f"ip-10-0-0-{len(self.instances) + 10}.ec2.internal",
+            "PublicDnsName": "",
+            "State": {"Name": state},
+            "Tags": [{"Key": "Name", "Value": name}] if name else [],
+        }
+        return instance_id
+
+
+class _Paginator:
+    def __init__(self, operation):
+        self.operation = operation
+
+    def paginate(self, **kwargs):
+        yield self.operation(**kwargs)
+
+
+class Service:
+    name = None
+
+    def __init__(self, world):
+        self.world = world
+
+    def _call(self, operation):
+        self.world.call(self.name, operation)
+
+    def get_paginator(self, operation):
+        return _Paginator(getattr(self, operation))
+
+
+class EC2(Service):
+    name = "ec2"
+
+    def describe_instances(self, InstanceIds=None, **kwargs):
+        self._call("DescribeInstances")
+        ids = InstanceIds or list(self.world.instances)
+        return {"Reservations": [{"Instances": [
+            self.world.instances[i] for i in ids if i in self.world.instances]}]}
+
+    def describe_instance_status(self, InstanceIds=None, **kwargs):
+        self._call("DescribeInstanceStatus")
+        return {"InstanceStatuses": [
+            {"InstanceId": i, "InstanceStatus": {"Status": "ok"}, "SystemStatus": {"Status": "ok"}}
+            for i in (InstanceIds or [])]}
+
+    def create_tags(self, Resources, Tags):
+        self._call("CreateTags")
+        for i in Resources:
+            tags = {t["Key"]: t for t in self.world.instances[i]["Tags"]}
+            tags.update({t["Key"]: t for t in Tags})
+            self.world.instances[i]["Tags"] = list(tags.values())
+        return {}
+
+    def delete_tags(self, Resources, Tags):
+        self._call("DeleteTags")
+        keys = {t["Key"] for t in Tags}
+        for i in Resources:
+            self.world.instances[i]["Tags"] = [
+                t for t in self.world.instances[i]["Tags"] if t["Key"] not in keys]
+        return {}
+
+    def terminate_instances(self, InstanceIds):
+        self._call("TerminateInstances")
+        for i in InstanceIds:
+            self.world.instances[i]["State"] = {"Name": "shutting-down"}
+        return {"TerminatingInstances": [{"InstanceId": i} for i in InstanceIds]}
+
+
+class _Instance:
+    def __init__(self, world, instance_id):
+        self.world = world
+        self.id = instance_id
+
+    @property
+    def state(self):
+        self.world.call("ec2", "DescribeInstances")
+        return self.world.instances[self.id]["State"]
+
+    @property
+    def volumes(self):
+        world = self.world
+
+        class Volumes:
+            def all(self):
+                world.call("ec2", "DescribeVolumes")
+                return []
+        return Volumes()
+
+
+class _Instances:
+    def __init__(self, world):
+        self.world = world
+
+    def filter(self, Filters):
+        self.world.call("ec2", "DescribeInstances")
+        matches = []
+        for i, instance in self.world.instances.items():
+            tags = {t["Key"]: t["Value"] for t in instance["Tags"]}
+            if all(
+                f["Name"].startswith("tag:") and tags.get(f["Name"][4:]) in f["Values"]
+                for f in Filters
+            ):
+                matches.append(_Instance(self.world, i))
+        return matches
+
+
+class EC2Resource:
+    def __init__(self, world):
+        self.world = world
+        self.instances = _Instances(world)
+
+    def Instance(self, instance_id):
+        return _Instance(self.world, instance_id)
+
+
+class AutoScaling(Service):
+    name = "autoscaling"
+
+    def describe_auto_scaling_groups(self, AutoScalingGroupNames):
+        self._call("DescribeAutoScalingGroups")
+        return {"AutoScalingGroups": [
+            {
+                "AutoScalingGroupName": name,
+                "Instances": [{"InstanceId": i} for i in self.world.auto_scaling_groups[name]],
+            }
+            for name in AutoScalingGroupNames if name in self.world.auto_scaling_groups]}
+
+    def complete_lifecycle_action(self, **kwargs):
+        self._call("CompleteLifecycleAction")
+        self.world.lifecycle_actions.append(kwargs)
+        return {}
+
+
+class SSMExceptions:
+    class InvocationDoesNotExist(ClientError):
+        pass
+
+
+class SSM(Service):
+    name = "ssm"
+    exceptions = SSMExceptions
+
+    def send_command(self, InstanceIds, DocumentName, Parameters, **kwargs):
+        self._call("SendCommand")
+        command_id = self.world.next_id("cmd-")
+        commands = Parameters["commands"]
+        self.world.commands[command_id] = {
+            "InstanceIds": InstanceIds,
+            "Commands": commands,
+            "Started": self.world.clock.now,
+            "Duration": self.world.command_duration(commands),
+        }
+        return {"Command": {"CommandId": command_id, "Status": "Pending"}}
+
+    def get_command_invocation(self, CommandId, InstanceId):
+        self._call("GetCommandInvocation")
+        command = self.world.commands.get(CommandId)
+        if command is None or InstanceId not in command["InstanceIds"]:
+            raise SSMExceptions.InvocationDoesNotExist(
+                {"Error": {"Code": "InvocationDoesNotExist"}}, "GetCommandInvocation")
+
+        elapsed = self.world.clock.now - command["Started"]
+        status = "Success" if elapsed >= command["Duration"] else "InProgress"
+        return {
+            "CommandId": CommandId,
+            "InstanceId": InstanceId,
+            "Status": status,
+            "StandardOutputContent": "",
+            "StandardErrorContent": "",
+        }
+
+    def get_parameter(self, Name):
+        self._call("GetParameter")
+        return {"Parameter": {"Name": Name, "Value": self.world.parameters[Name]}}
+
+    def put_parameter(self, Name, Value, Overwrite=False):
+        self._call("PutParameter")
+        self.world.parameters[Name] = Value
+        return {"Version": 1}
+
+
+class SecretsManager(Service):
+    name = "secretsmanager"
+
+    def get_secret_value(self, SecretId):
+        self._call("GetSecretValue")
+        return {"SecretString": json.dumps(self.world.secrets[SecretId])}
+
+
+class Route53Exceptions:
+    class NoSuchHealthCheck(ClientError):
+        pass
+
+
+class Route53(Service):
+    name = "route53"
+    exceptions = Route53Exceptions
+
+    def list_resource_record_sets(self, **kwargs):
+        self._call("ListResourceRecordSets")
+        return {"ResourceRecordSets": sorted(
+            self.world.record_sets, key=lambda r: (r["Name"], r["Type"]))}
+
+    def change_resource_record_sets(self, HostedZoneId, ChangeBatch):
+        self._call("ChangeResourceRecordSets")
+        for change in ChangeBatch["Changes"]:
+            record = dict(change["ResourceRecordSet"])
+            record["Name"] = record["Name"].rstrip(".") + "."
+            key = (record["Name"], record["Type"], record.get("SetIdentifier"))
+            self.world.record_sets = [
+                r for r in self.world.record_sets
+                if (r["Name"], r["Type"], r.get("SetIdentifier")) != key]
+            if change["Action"] in ("CREATE", "UPSERT"):
+                self.world.record_sets.append(record)
+        return {"ChangeInfo": {"Id": self.world.next_id("change-"), "Status": "PENDING"}}
+
+    def get_health_check(self, HealthCheckId):
+        self._call("GetHealthCheck")
+        if HealthCheckId not in self.world.health_checks:
+            raise Route53Exceptions.NoSuchHealthCheck(
+                {"Error": {"Code": "NoSuchHealthCheck"}}, "GetHealthCheck")
+        return {"HealthCheck": self.world.health_checks[HealthCheckId]}
+
+    def list_health_checks(self, **kwargs):
+        self._call("ListHealthChecks")
+        return {"HealthChecks": list(self.world.health_checks.values())}
+
+    def create_health_check(self, CallerReference, HealthCheckConfig):
+        self._call("CreateHealthCheck")
+        health_check_id = self.world.next_id("hc-")
+        self.world.health_checks[health_check_id] = {
+            "Id": health_check_id,
+            "CallerReference": CallerReference,
+            "HealthCheckConfig": dict(HealthCheckConfig),
+        }
+        return {"HealthCheck": self.world.health_checks[health_check_id]}
+
+    def delete_health_check(self, HealthCheckId):
+        self._call("DeleteHealthCheck")
+        self.world.health_checks.pop(HealthCheckId, None)
+        self.world.health_check_tags.pop(HealthCheckId, None)
+        return {}
+
+    def change_tags_for_resource(self, ResourceType, ResourceId, AddTags=None, **kwargs):
+        self._call("ChangeTagsForResource")
+        tags = self.world.health_check_tags.setdefault(ResourceId, {})
+        tags.update({t["Key"]: t["Value"] for t in AddTags or []})
+        return {}
@@ -0,0 +1,46 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+virtual clock standing in for the `time` module inside simulated handlers
+"""
+
+
+class LambdaTimeout(BaseException):
+    """raised when simulated time passes the function timeout
+
+    Derives from BaseException so the handlers' `except Exception` blocks
+    can not swallow it, just as they can not catch a real Lambda timeout.
+    """
+
+
+class VirtualClock:
+    def __init__(self, start=1_600_000_000.0):
+        self.now = start
+        self.slept = 0.0
+        self.deadline = None
+        self.timeout = None
+
+    def set_deadline(self, timeout):
+        self.timeout = timeout
+        self.deadline = None if timeout is None else self.now + timeout
+
+    def advance(self, seconds):
+        self.now += seconds
+        if self.deadline is not None and self.now > self.deadline:
+            raise LambdaTimeout(f"Task timed out after {self.timeout:.2f} seconds")
+
+    # `time` module interface used by aws_utils
+    def sleep(self, seconds):
+        self.slept += seconds
+        self.advance(seconds)
+
+    def time(self):
+        return self.now
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
@@ -0,0 +1,404 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+runs the Lambda handlers under src/lambda against the in-memory backends
+
+Each invocation imports the handler and the common layer fresh, with boto3,
+botocore and crhelper replaced by the simulated backends and the `time`
+module of every loaded layer module replaced by the virtual clock, so
+sleeps and polling cost no real time.
+"""
+
+import io
+import os
+import sys
+import math
+import time
+import tempfile
+import types
+import importlib.util
+from pathlib import Path
+from contextlib import redirect_stdout
+
+from lsim.clock import VirtualClock, LambdaTimeout
+from lsim.backends import World, EC2Resource, ClientError
+
+LAMBDA_ROOT = Path(__file__).resolve().parents[3] / "lambda"
+
+HANDLERS = {
+    "nucleusServerConfig": "customResources/nucleusServerConfig/index.py",
+    "reverseProxyConfig": "customResources/reverseProxyConfig/index.py",
+    "reverseProxyLifecycle": "asgLifeCycleHooks/reverseProxy/index.py",
+    "dnsRecord": "customResources/dnsRecord/index.py",
+}
+
+# matches Duration.minutes(5) in lib/constructs
+DEFAULT_TIMEOUT = 300
+
+STACK_NAME = "omni-app"
+ROOT_DOMAIN = "example.com"
+DOMAIN_PREFIX = "nucleus"
+ARTIFACTS_BUCKET = "omni-artifacts"
+RP_ASG = "omni-app-ReverseProxyAutoScalingGroup"
+HOSTED_ZONE_ID = "Z0123456789"
+
+# modules shipped in the common layer, purged between invocations
+LAYER_PACKAGES = ("aws_utils", "config")
+
+
+class CfnResource:
+    """stand-in for crhelper.CfnResource that records the response instead
+    of sending it to CloudFormation"""
+
+    def __init__(self, *args, **kwargs):
+        self.handlers = {}
+        self.result = None
+
+    def _register(self, request_type):
+        def decorator(fn):
+            self.handlers[request_type] = fn
+            return fn
+        return decorator
+
+    @property
+    def create(self):
+        return self._register("Create")
+
+    @property
+    def update(self):
+        return self._register("Update")
+
+    @property
+    def delete(self):
+        return self._register("Delete")
+
+    def __call__(self, event, context):
+        try:
+            self.handlers[event["RequestType"]](event, context)
+            self.result = {"Status": "SUCCESS"}
+        except Exception as e:
+            self.result = {"Status": "FAILED", "Reason": str(e)}
+
+
+def _fake_modules(world):
+    boto3 = types.ModuleType("boto3")
+    boto3.client = lambda name, *args, **kwargs: world.services[name]
+    boto3.resource = lambda name, *args, **kwargs: EC2Resource(world)
+
+    botocore = types.ModuleType("botocore")
+    exceptions = types.ModuleType("botocore.exceptions")
+    exceptions.ClientError = ClientError
+    botocore.exceptions = exceptions
+
+    crhelper = types.ModuleType("crhelper")
+    crhelper.CfnResource = CfnResource
+
+    return {
+        "boto3": boto3,
+        "botocore": botocore,
+        "botocore.exceptions": exceptions,
+        "crhelper": crhelper,
+    }
+
+
+def _is_layer_module(name):
+    return name.split(".")[0] in LAYER_PACKAGES
+
+
+class Simulation:
+    def __init__(self, lambda_root=LAMBDA_ROOT, timeout=DEFAULT_TIMEOUT, **world_options):
+        self.lambda_root = Path(lambda_root)
+        self.timeout = timeout
+        self.clock = VirtualClock()
+        self.world = World(self.clock, **world_options)
+        self.results = []
+        # handlers dedupe redelivered events through aws_utils.idempotency
+        self._state_dir = tempfile.TemporaryDirectory()
+        self.idempotency_db = os.path.join(self._state_dir.name, "idempotency.db")
+
+    def setup_stack(self, reverse_proxies=1):
+        world = self.world
+        world.add_instance("i-nucleus0001", f"{STACK_NAME}/NucleusServer")
+        world.auto_scaling_groups[RP_ASG] = [
+            world.add_instance(name=f"{STACK_NAME}/ReverseProxyServer")
+            for _ in range(reverse_proxies)
+        ]
+        world.secrets["ovMainLogin"] = {"username": "omniverse", "password": "main"}
+        world.secrets["ovServiceLogin"] = {"username": "omniverse", "password": "service"}
+
+    def _load(self, handler, environment):
+        path = self.lambda_root / HANDLERS[handler]
+        saved_modules = dict(sys.modules)
+        saved_path = list(sys.path)
+        saved_environ = dict(os.environ)
+
+        for name in list(sys.modules):
+            if _is_layer_module(name):
+                del sys.modules[name]
+        sys.modules.update(_fake_modules(self.world))
+        sys.path.insert(0, str(self.lambda_root / "common"))
+        os.environ.update(environment)
+
+        def restore():
+            sys.modules.clear()
+            sys.modules.update(saved_modules)
+            sys.path[:] = saved_path
+            os.environ.clear()
+            os.environ.update(saved_environ)
+
+        try:
+            spec = importlib.util.spec_from_file_location(f"lsim_handler_{handler}", path)
+            module = importlib.util.module_from_spec(spec)
+            spec.loader.exec_module(module)
+        except BaseException:
+            restore()
+            raise
+
+        for name, loaded in list(sys.modules.items()):
+            if _is_layer_module(name) and getattr(loaded, "time", None) is time:
+                loaded.time = self.clock
+        if getattr(module, "time", None) is time:
+            module.time = self.clock
+
+        return module, restore
+
+    def invoke(self, scenario, handler, event, environment=None):
+        module, restore = self._load(
+            handler, dict(environment or {}, LOG_LEVEL="WARNING", IDEMPOTENCY_DB_PATH=self.idempotency_db))
+
+        self.world.reset_accounting()
+        started = self.clock.now
+        slept = self.clock.slept
+        self.clock.set_deadline(self.timeout)
+        actions = len(self.world.lifecycle_actions)
+
+        status = None
+        reason = None
+        try:
+            with redirect_stdout(io.StringIO()):
+                module.handler(event, None)
+            helper = getattr(module, "helper", None)
+            if isinstance(helper, CfnResource):
+                status = helper.result["Status"]
+                reason = helper.result.get("Reason")
+            elif len(self.world.lifecycle_actions) > actions:
+                status = self.world.lifecycle_actions[-1]["LifecycleActionResult"]
+            else:
+                status = "SUCCESS"
+        except LambdaTimeout as e:
+            status = "TIMEOUT"
+            reason = str(e)
+        except Exception as e:
+            status = "FAILED"
+            reason = str(e)
+        finally:
+            self.clock.set_deadline(None)
+            restore()
+
+        wall = min(self.clock.now - started, self.timeout)
+        result = {
+            "scenario": scenario,
+            "handler": handler,
+            "status": status,
+            "reason": reason,
+            "api_calls": dict(sorted(self.world.calls.items())),
+            "api_call_total": sum(self.world.calls.values()),
+            "throttled": sum(self.world.throttled.values()),
+            "sleep_seconds": round(self.clock.slept - slept, 3),
+            "wall_seconds": round(wall, 3),
+            "billed_ms": math.ceil(wall * 1000),
+        }
+        self.results.append(result)
+        return result
+
+
+def _nucleus_properties(nounce=2):
+    return {
+        "nounce": nounce,
+        "instanceIds": ["i-nucleus0001"],
+        "reverseProxyDomain": f"{DOMAIN_PREFIX}.{ROOT_DOMAIN}",
+        "nucleusBuild": "nucleus-stack-2022.1.0",
+        "artifactsBucket": ARTIFACTS_BUCKET,
+        "ovMainLoginSecretArn": "ovMainLogin",
+        "ovServiceLoginSecretArn": "ovServiceLogin",
+    }
+
+
+def _reverse_proxy_properties(world, nounce=2, domain=None):
+    return {
+        "nounce": nounce,
+        "STACK_NAME": STACK_NAME,
+        "ARTIFACTS_BUCKET_NAME": ARTIFACTS_BUCKET,
+        "FULL_DOMAIN": domain or f"{DOMAIN_PREFIX}.{ROOT_DOMAIN}",
+        "NUCLEUS_SERVER_ADDRESS": world.instances["i-nucleus0001"]["PrivateDnsName"],
+        "RP_AUTOSCALING_GROUP_NAME": RP_ASG,
+    }
+
+
+def _dns_record_properties(routing_policy="latency", region="us-west-2"):
+    return {
+        "HOSTED_ZONE_ID": HOSTED_ZONE_ID,
+        "ROOT_DOMAIN": ROOT_DOMAIN,
+        "DOMAIN_PREFIX": DOMAIN_PREFIX,
+        "ROUTING_POLICY": routing_policy,
+        "SET_IDENTIFIER": f"{STACK_NAME}-{region}",
+        "SERVER_ADDRESS": f"{STACK_NAME}-alb.{region}.elb.amazonaws.com",
+        "HEALTH_CHECK_ALARM": f"{STACK_NAME}-HealthAlarm",
+        "FAILOVER": "PRIMARY",
+        "region": region,
+    }
+
+
+def _cfn_event(request_type, properties, old_properties=None, request_id=None):
+    event = {
+        "RequestType": request_type,
+        "RequestId": request_id or f"req-{request_type.lower()}",
+        "ResourceProperties": properties,
+    }
+    if old_properties is not None:
+        event["OldResourceProperties"] = old_properties
+    return event
+
+
+def _lifecycle_event(transition, instance_id):
+    return {
+        "detail": {
+            "LifecycleHookName": "ReverseProxyScaleUpLifecycleHook",
+            "AutoScalingGroupName": RP_ASG,
+            "LifecycleActionToken": f"token-{instance_id}",
+            "LifecycleTransition": transition,
+            "EC2InstanceId": instance_id,
+        }
+    }
+
+
+def _lifecycle_environment(world):
+    return {
+        "ARTIFACTS_BUCKET": ARTIFACTS_BUCKET,
+        "NUCLEUS_ROOT_DOMAIN": ROOT_DOMAIN,
+        "NUCLEUS_DOMAIN_PREFIX": DOMAIN_PREFIX,
+        "NUCLEUS_SERVER_ADDRESS": world.instances["i-nucleus0001"]["PrivateDnsName"],
+    }
+
+
+def scenario_create(sim):
+    world = sim.world
+    sim.invoke("create", "nucleusServerConfig", _cfn_event("Create", _nucleus_properties()))
+    for instance_id in world.auto_scaling_groups[RP_ASG]:
+        sim.invoke(
+            "create", "reverseProxyLifecycle",
+            _lifecycle_event("autoscaling:EC2_INSTANCE_LAUNCHING", instance_id),
+            _lifecycle_environment(world))
+    sim.invoke("create", "reverseProxyConfig",
+               _cfn_event("Create", _reverse_proxy_properties(world)))
+
+
+def scenario_update(sim):
+    world = sim.world
+    sim.invoke("update", "nucleusServerConfig",
+               _cfn_event("Update", _nucleus_properties(3), _nucleus_properties(2)))
+    sim.invoke("update", "reverseProxyConfig", _cfn_event(
+        "Update",
+        _reverse_proxy_properties(world, domain=f"nucleus2.{ROOT_DOMAIN}"),
+        _reverse_proxy_properties(world)))
+    sim.invoke("update", "reverseProxyConfig", _cfn_event(
+        "Update", _reverse_proxy_properties(world, 3), _reverse_proxy_properties(world, 2)))
+
+
+def scenario_scale_out(sim):
+    world = sim.world
+    instance_id = world.add_instance(name=f"{STACK_NAME}/ReverseProxyServer")
+    world.auto_scaling_groups[RP_ASG].append(instance_id)
+    sim.invoke(
+        "scale-out", "reverseProxyLifecycle",
+        _lifecycle_event("autoscaling:EC2_INSTANCE_LAUNCHING", instance_id),
+        _lifecycle_environment(world))
+
+
+def scenario_scale_in(sim):
+    world = sim.world
+    instance_id = world.auto_scaling_groups[RP_ASG][-1]
+    sim.invoke(
+        "scale-in", "reverseProxyLifecycle",
+        _lifecycle_event("autoscaling:EC2_INSTANCE_TERMINATING", instance_id),
+        _lifecycle_environment(world))
+    world.auto_scaling_groups[RP_ASG].remove(instance_id)
+    world.instances[instance_id]["State"] = {"Name": "terminated"}
+
+
+def scenario_duplicate_events(sim):
+    """every event delivered twice, the second copy should be cheap"""
+    world = sim.world
+    event = _cfn_event("Update", _nucleus_properties(4), _nucleus_properties(3))
+    for _ in range(2):
+        sim.invoke("duplicate-events", "nucleusServerConfig", event)
+
+    instance_id = world.add_instance(name=f"{STACK_NAME}/ReverseProxyServer")
+    world.auto_scaling_groups[RP_ASG].append(instance_id)
+    event = _lifecycle_event("autoscaling:EC2_INSTANCE_LAUNCHING", instance_id)
+    for _ in range(2):
+        sim.invoke("duplicate-events", "reverseProxyLifecycle", event, _lifecycle_environment(world))
+
+
+def scenario_routed_dns(sim):
+    """routed record for the load balancer, created, rerun as a new request
+    right away, switched to failover routing and deleted"""
+    sim.invoke("routed-dns", "dnsRecord", _cfn_event("Create", _dns_record_properties()))
+    sim.invoke("routed-dns", "dnsRecord", _cfn_event(
+        "Create", _dns_record_properties(), request_id="req-create-rerun"))
+    sim.invoke("routed-dns", "dnsRecord", _cfn_event(
+        "Update", _dns_record_properties("failover"), _dns_record_properties()))
+    sim.invoke("routed-dns", "dnsRecord", _cfn_event("Delete", _dns_record_properties("failover")))
+
+
+SCENARIOS = {
+    "create": scenario_create,
+    "update": scenario_update,
+    "scale-out": scenario_scale_out,
+    "scale-in": scenario_scale_in,
+    "duplicate-events": scenario_duplicate_events,
+    "routed-dns": scenario_routed_dns,
+}
+
+
+def run(scenarios=None, reverse_proxies=1, **options):
+    """run scenarios in order against one simulated deployment"""
+    sim = Simulation(**options)
+    sim.setup_stack(reverse_proxies)
+    for name in scenarios or SCENARIOS:
+        SCENARIOS[name](sim)
+    return sim.results
+
+
+def summarize(results):
+    totals = {}
+    for r in results:
+        key = (r["scenario"], r["handler"])
+        t = totals.setdefault(key, {
+            "scenario": r["scenario"], "handler": r["handler"], "invocations": 0,
+            "failures": 0, "api_call_total": 0, "throttled": 0, "wall_seconds": 0.0, "billed_ms": 0,
+        })
+        t["invocations"] += 1
+        t["failures"] += r["status"] not in ("SUCCESS", "CONTINUE")
+        for k in ("api_call_total", "throttled", "wall_seconds", "billed_ms"):
+            t[k] += r[k]
+    return list(totals.values())
+
+
+def format_report(results):
+    lines = [
+        f"{'scenario':<17}{'handler':<23}{'status':<9}{'calls':>7}{'throttled':>11}"
+        f"{'slept(s)':>10}{'wall(s)':>10}{'billed(ms)':>12}"
+    ]
+    for r in results:
+        lines.append(
+            f"{r['scenario']:<17}{r['handler']:<23}{r['status']:<9}{r['api_call_total']:>7}"
+            f"{r['throttled']:>11}{r['sleep_seconds']:>10.1f}{r['wall_seconds']:>10.1f}{r['billed_ms']:>12}")
+        if r["reason"]:
+            lines.append(f"{'':<17}{r['reason']}")
+    lines.append("")
+    lines.append(f"total billed: {sum(r['billed_ms'] for r in results)} ms, "
+                 f"api calls: {sum(r['api_call_total'] for r in results)}")
+    return "\n".join(lines)
@@ -0,0 +1,72 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+offline deployment simulator for the Lambda handlers
+"""
+
+# std lib modules
+import json
+
+# 3rd party modules
+import click
+
+import ovetools.logger as logger
+import lsim.simulator as simulator
+
+pass_config = click.make_pass_decorator(object, ensure=True)
+
+
+def parse_pairs(values, name):
+    """["ssm.SendCommand=0.2", ...] -> {"ssm.SendCommand": 0.2}"""
+    pairs = {}
+    for value in values:
+        key, sep, number = value.rpartition("=")
+        if not sep:
+            raise click.BadParameter(f"expected KEY=NUMBER, got: {value}", param_hint=name)
+        pairs[key] = float(number)
+    return pairs
+
+
+@click.group()
+@pass_config
+def main(config):
+    pass
+
+
+@main.command()
+@pass_config
+@click.option("--scenario", "scenarios", multiple=True, type=click.Choice(list(simulator.SCENARIOS)),
+              help="scenarios to run in order, defaults to all")
+@click.option("--reverse-proxies", default=1, show_default=True, help="initial reverse proxy ASG size")
+@click.option("--latency", multiple=True, metavar="API=SECONDS",
+              help="per call latency, API is a service (ssm) or operation (ssm.SendCommand)")
+@click.option("--throttle", multiple=True, metavar="API=RATE",
+              help="probability a call is throttled, API as for --latency")
+@click.option("--command-duration", multiple=True, metavar="PATTERN=SECONDS",
+              help="duration of SSM commands whose script contains PATTERN")
+@click.option("--timeout", default=simulator.DEFAULT_TIMEOUT, show_default=True, help="Lambda timeout in seconds")
+@click.option("--seed", default=0, show_default=True)
+@click.option("--lambda-root", default=str(simulator.LAMBDA_ROOT), show_default=True)
+@click.option("--output-format", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def run(config, scenarios, reverse_proxies, latency, throttle, command_duration, timeout, seed,
+        lambda_root, output_format):
+    logger.info(f"run: {scenarios=}, {reverse_proxies=}, {timeout=}, {seed=}")
+
+    results = simulator.run(
+        scenarios=list(scenarios) or None,
+        reverse_proxies=reverse_proxies,
+        lambda_root=lambda_root,
+        timeout=timeout,
+        latency=parse_pairs(latency, "--latency"),
+        throttle=parse_pairs(throttle, "--throttle"),
+        command_durations=parse_pairs(command_duration, "--command-duration"),
+        seed=seed,
+    )
+
+    if output_format == "json":
+        click.echo(json.dumps(
+            {"invocations": results, "summary": simulator.summarize(results)}, indent=2))
+    else:
+        click.echo(simulator.format_report(results))
@@ -0,0 +1,264 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+measure whether LFT_COMPRESSION pays off for the content under DATA_ROOT
+
+A random sample of files is compressed with zlib (gzip/deflate, as HTTP
+compression) to get the compression ratio and the codec throughput on one
+core and on all cores. A transfer streams, so with compression it moves raw
+bytes at the rate of its slowest stage: server compression, the compressed
+bytes on the link or client decompression. That is compared with sending
+the raw bytes at each link bandwidth, once for a single transfer and once
+for a busy server where `concurrent_transfers` share the spare cores.
+"""
+
+import os
+import json
+import time
+import zlib
+import random
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import ovetools.logger as logger
+import nst.profile as profile
+from nst.prewarm import DATA_ROOT, STATE_DIR
+
+RECOMMENDATION_PATH = f"{STATE_DIR}/lft-compression.json"
+
+BLOCK_SIZE = 64 * 1024
+MB = 1024 ** 2
+
+
+def sample_files(root, max_files, seed=None):
+    """up to max_files regular files, uniformly from the whole tree"""
+    rng = random.Random(seed)
+    sample, seen = [], 0
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            if os.path.islink(path) or not os.path.isfile(path):
+                continue
+            seen += 1
+            if len(sample) < max_files:
+                sample.append(path)
+            else:
+                i = rng.randrange(seen)
+                if i < max_files:
+                    sample[i] = path
+    # read_samples stops at its size budget, not at the end of the tree
+    rng.shuffle(sample)
+    return sample
+
+
+def read_samples(paths, sample_mb, chunk_mb):
+    """(path, bytes) with up to chunk_mb from each file, sample_mb in total"""
+    samples, total = [], 0
+    for path in paths:
+        if total >= sample_mb * MB:
+            break
+        try:
+            with open(path, "rb") as file:
+                data = file.read(min(chunk_mb * MB, sample_mb * MB - total))
+        except OSError as e:
+            logger.debug(f"Skipping {path}: {e}")
+            continue
+        if data:
+            samples.append((path, data))
+            total += len(data)
+    return samples
+
+
+def _compress(data, level):
+    # in BLOCK_SIZE writes, as a streamed response body
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    parts = [compressor.compress(data[i:i + BLOCK_SIZE]) for i in range(0, len(data), BLOCK_SIZE)]
+    parts.append(compressor.flush())
+    return b"".join(parts)
+
+
+def _decompress(data):
+    return zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data)
+
+
+def _compressed_size(samples, level):
+    return sum(len(_compress(data, level)) for _, data in samples)
+
+
+def measure(samples, level=6, threads=None):
+    """ratio and MB/s of raw data through the codec. zlib releases the GIL,
+    so threads measure the multi-core rate"""
+    threads = threads or os.cpu_count()
+    raw = sum(len(data) for _, data in samples)
+
+    started = time.perf_counter()
+    compressed = [_compress(data, level) for _, data in samples]
+    single = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for data in compressed:
+        _decompress(data)
+    decompress = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        for future in [executor.submit(_compressed_size, samples, level) for _ in range(threads)]:
+            future.result()
+    multi = time.perf_counter() - started
+
+    by_type = {}
+    for (path, data), out in zip(samples, compressed):
+        kind = Path(path).suffix.lower() or "(none)"
+        entry = by_type.setdefault(kind, {"files": 0, "raw_bytes": 0, "compressed_bytes": 0})
+        entry["files"] += 1
+        entry["raw_bytes"] += len(data)
+        entry["compressed_bytes"] += len(out)
+    for entry in by_type.values():
+        entry["ratio"] = round(entry["raw_bytes"] / max(entry["compressed_bytes"], 1), 2)
+
+    return {
+        "files": len(samples),
+        "raw_bytes": raw,
+        "compressed_bytes": sum(len(out) for out in compressed),
+        "ratio": round(raw / max(sum(len(out) for out in compressed), 1), 3),
+        "level": level,
+        "compress_mb_s": round(raw / MB / single, 1),
+        "decompress_mb_s": round(raw / MB / decompress, 1),
+        "threads": threads,
+        "compress_multi_mb_s": round(threads * raw / MB / multi, 1),
+        "by_type": dict(sorted(by_type.items(), key=lambda kv: -kv[1]["raw_bytes"])),
+    }
+
+
+def spare_cores(profile_path=profile.PROFILE_PATH, cpus=None):
+    """cores left over at p95 host CPU by `nst profile`, half the cores
+    without a profile"""
+    cpus = cpus or os.cpu_count()
+    if Path(profile_path).is_file():
+        try:
+            summary = profile.summarize(profile_path)
+            used = summary["series"][profile.HOST]["cpu_cores"]["p95"]
+            return max(summary["cpus"] - used, 0.5), "profile"
+        except (profile.ProfileError, KeyError, ValueError, OSError) as e:
+            logger.warning(f"Could not read {profile_path}: {e}")
+    return cpus / 2, "default"
+
+
+def transfer_rates(measured, mbps, spare, concurrent_transfers):
+    """MB/s of raw data per transfer, raw and compressed, at a link of mbps"""
+    link = mbps / 8 * 1000 ** 2 / MB
+    per_core = measured["compress_multi_mb_s"] / measured["threads"]
+    busy = min(measured["compress_mb_s"], per_core * spare / concurrent_transfers)
+
+    def compressed(server):
+        return min(server, link * measured["ratio"], measured["decompress_mb_s"])
+
+    return {
+        "mbps": mbps,
+        "raw_mb_s": round(link, 1),
+        "compressed_mb_s": round(compressed(measured["compress_mb_s"]), 1),
+        "compressed_busy_mb_s": round(compressed(busy), 1),
+        # seconds per GiB of raw data
+        "raw_s_per_gib": round(1024 / link, 2),
+        "compressed_s_per_gib": round(1024 / compressed(measured["compress_mb_s"]), 2),
+        "compressed_busy_s_per_gib": round(1024 / compressed(busy), 2),
+    }
+
+
+def recommend(gain, min_gain, margin=0.0, previous=None):
+    """1 if compression is at least min_gain times faster. To change a previous
+    recommendation the gain has to cross min_gain by margin, so a rerun does
+    not flip the setting, and recreate the LFT services, on timing noise"""
+    if previous == 1:
+        return 0 if gain < min_gain - margin else 1
+    if previous == 0:
+        return 1 if gain >= min_gain + margin else 0
+    return 1 if gain >= min_gain else 0
+
+
+def benchmark(data_root=DATA_ROOT, sample_mb=64, max_files=500, chunk_mb=4, level=6, threads=None,
+              bandwidths=(50, 200, 1000, 10000), client_mbps=200, concurrent_transfers=None,
+              min_gain=1.1, margin=0.1, previous=None, profile_path=profile.PROFILE_PATH, seed=0):
+    """measurements, transfer comparison and the recommended LFT_COMPRESSION;
+    None when there is nothing under data_root to sample. The same seed
+    samples the same files of an unchanged tree"""
+    with logger.timer("sampling", level=logging.DEBUG):
+        samples = read_samples(sample_files(data_root, max_files, seed), sample_mb, chunk_mb)
+    if not samples:
+        return None
+
+    with logger.timer("measuring", level=logging.DEBUG):
+        measured = measure(samples, level, threads)
+    spare, spare_source = spare_cores(profile_path)
+    # one transfer per core by default, sharing the spare ones
+    concurrent_transfers = concurrent_transfers or os.cpu_count()
+
+    links = [transfer_rates(measured, mbps, spare, concurrent_transfers)
+             for mbps in sorted(set(bandwidths) | {client_mbps})]
+    target = next(link for link in links if link["mbps"] == client_mbps)
+    # decided for a busy server, the case compression makes worse
+    gain = target["raw_s_per_gib"] / target["compressed_busy_s_per_gib"]
+
+    return {
+        "data_root": str(data_root),
+        "measured": measured,
+        "spare_cores": round(spare, 2),
+        "spare_cores_source": spare_source,
+        "concurrent_transfers": concurrent_transfers,
+        "links": links,
+        "client_mbps": client_mbps,
+        "min_gain": min_gain,
+        "margin": margin,
+        "previous": previous,
+        "gain": round(gain, 2),
+        "LFT_COMPRESSION": recommend(gain, min_gain, margin, previous),
+        "measured_at": int(time.time()),
+    }
+
+
+def save_recommendation(result, path=RECOMMENDATION_PATH):
+    Path(path).parent.mkdir(parents=True, exist_ok=True)
+    with open(path, "w") as file:
+        json.dump(result, file, indent=2)
+
+
+def load_recommendation(path=RECOMMENDATION_PATH):
+    """the LFT_COMPRESSION saved by the last benchmark, None if there is none"""
+    try:
+        with open(path, "r") as file:
+            return int(json.load(file)["LFT_COMPRESSION"])
+    except (OSError, ValueError, KeyError) as e:
+        logger.debug(f"No LFT compression recommendation in {path}: {e}")
+        return None
+
+
+def format_report(result):
+    m = result["measured"]
+    lines = [
+        f"{result['data_root']}: {m['files']} files, {m['raw_bytes'] / MB:.1f} MB sampled, "
+        f"zlib level {m['level']}",
+        f"ratio {m['ratio']:.2f}, compress {m['compress_mb_s']} MB/s on 1 core, "
+        f"{m['compress_multi_mb_s']} MB/s on {m['threads']} threads, decompress {m['decompress_mb_s']} MB/s",
+        f"busy server: {result['concurrent_transfers']} transfers sharing {result['spare_cores']} spare cores "
+        f"({result['spare_cores_source']})",
+        "",
+        f"{'type':<12}{'files':>8}{'MB':>10}{'ratio':>8}",
+    ]
+    for kind, entry in list(m["by_type"].items())[:10]:
+        lines.append(f"{kind:<12}{entry['files']:>8}{entry['raw_bytes'] / MB:>10.1f}{entry['ratio']:>8.2f}")
+
+    lines += ["", f"{'link Mbps':>10}{'raw s/GiB':>12}{'compressed':>12}{'busy':>12}"]
+    for link in result["links"]:
+        marker = "  <- clients" if link["mbps"] == result["client_mbps"] else ""
+        lines.append(f"{link['mbps']:>10}{link['raw_s_per_gib']:>12}{link['compressed_s_per_gib']:>12}"
+                     f"{link['compressed_busy_s_per_gib']:>12}{marker}")
+
+    needed = f"{result['min_gain']}x needed"
+    if result.get("previous") is not None:
+        needed += f", {result['margin']} past it to change LFT_COMPRESSION={result['previous']}"
+    lines += ["", f"LFT_COMPRESSION={result['LFT_COMPRESSION']} "
+                  f"({result['gain']:.2f}x at {result['client_mbps']} Mbps on a busy server, {needed})"]
+    return "\n".join(lines)
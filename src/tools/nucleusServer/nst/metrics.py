@@ -0,0 +1,385 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+scrape the Nucleus Prometheus endpoint (METRICS_PORT in nucleus-stack.env)
+and publish selected series to CloudWatch
+
+The response is parsed line by line as it streams in, and only series that
+pass the filters are kept. Counters are published as per second rates between
+two scrapes, gauges as they are. Labels not listed as dimensions are summed
+away, which keeps the number of CloudWatch series (and their cost) bounded.
+Metrics go out as Embedded Metric Format lines (stdout, a file the
+CloudWatch agent tails, or the agent's tcp/udp listener) or through
+PutMetricData.
+"""
+
+import re
+import sys
+import json
+import time
+import math
+import socket
+import signal
+import logging
+import threading
+import urllib.parse
+import urllib.error
+import urllib.request
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import boto3
+
+import ovetools.logger as logger
+
+METRICS_URL = "http://127.0.0.1:3010/metrics"
+NAMESPACE = "Omniverse/Nucleus"
+IMDS_URL = "http://169.254.169.254/latest"
+
+# per le bucket series multiply everything by the bucket count, _created
+# holds timestamps
+DEFAULT_EXCLUDE = [r"_bucket$", r"_created$"]
+
+EMF_MAX_METRICS = 100
+PUT_METRIC_DATA_MAX = 1000
+
+SAMPLE_PATTERN = re.compile(r"^([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{(.*)\})?\s+(\S+)(?:\s+(-?\d+))?\s*$")
+LABEL_PATTERN = re.compile(r'\s*([a-zA-Z_][a-zA-Z0-9_]*)\s*=\s*"((?:[^"\\]|\\.)*)"\s*,?')
+COUNTER_SUFFIXES = ("_total", "_count", "_sum")
+
+
+def _unescape(value):
+    return value.replace("\\\\", "\0").replace('\\"', '"').replace("\\n", "\n").replace("\0", "\\")
+
+
+def parse_labels(text):
+    return {m.group(1): _unescape(m.group(2)) for m in LABEL_PATTERN.finditer(text or "")}
+
+
+def iter_samples(lines):
+    """(name, labels, value, type) from Prometheus text format lines
+
+    `lines` is any iterable of str or bytes, e.g. an HTTP response, so the
+    body is never held in memory at once.
+    """
+    types = {}
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("#"):
+            parts = line.split(None, 3)
+            if len(parts) == 4 and parts[1] == "TYPE":
+                types[parts[2]] = parts[3]
+            continue
+        m = SAMPLE_PATTERN.match(line)
+        if m is None:
+            logger.debug(f"Unparsed metrics line: {line[:200]}")
+            continue
+        name, labels, value = m.group(1), m.group(2), m.group(3)
+        try:
+            value = float(value)
+        except ValueError:
+            continue
+        yield name, parse_labels(labels), value, _type(name, types)
+
+
+def _type(name, types):
+    if name in types:
+        return types[name]
+    for suffix in ("_bucket", "_sum", "_count", "_total"):
+        if name.endswith(suffix) and name[:-len(suffix)] in types:
+            family = types[name[:-len(suffix)]]
+            # the _sum and _count of a histogram or summary only go up
+            return "counter" if family in ("histogram", "summary", "counter") else family
+    return "counter" if name.endswith(COUNTER_SUFFIXES) else "untyped"
+
+
+class Filter:
+    def __init__(self, include=(), exclude=DEFAULT_EXCLUDE, dimensions=()):
+        self.include = [re.compile(p) for p in include]
+        self.exclude = [re.compile(p) for p in exclude]
+        self.dimensions = list(dimensions)
+
+    def accepts(self, name):
+        if self.include and not any(p.search(name) for p in self.include):
+            return False
+        return not any(p.search(name) for p in self.exclude)
+
+    def key(self, name, labels):
+        # CloudWatch refuses empty dimension values
+        return name, tuple((d, labels[d] or "none") for d in self.dimensions if d in labels)
+
+
+def scrape(url, metric_filter, timeout=10):
+    """{(name, dimensions): (value, type)} with dropped labels summed"""
+    series = {}
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        for name, labels, value, metric_type in iter_samples(response):
+            if not metric_filter.accepts(name) or math.isnan(value):
+                continue
+            # summed before the rate, so a reset of one labelled counter reads
+            # as a reset of the sum for one interval
+            key = metric_filter.key(name, labels)
+            previous = series.get(key)
+            series[key] = ((previous[0] if previous else 0) + value, metric_type)
+    return series
+
+
+class Rates:
+    """per second rates of counters between consecutive scrapes"""
+
+    def __init__(self):
+        self.previous = {}
+
+    def update(self, series, now):
+        values = []
+        previous, self.previous = self.previous, {}
+        for key, (value, metric_type) in series.items():
+            if metric_type == "counter":
+                self.previous[key] = (value, now)
+                if key not in previous:
+                    continue
+                last_value, last_time = previous[key]
+                elapsed = now - last_time
+                if elapsed <= 0:
+                    continue
+                # a counter going down was reset, the new value counts from zero
+                delta = value - last_value if value >= last_value else value
+                values.append((key, delta / elapsed, _unit(key[0], rate=True), True))
+            else:
+                values.append((key, value, _unit(key[0]), False))
+        return values
+
+
+def _unit(name, rate=False):
+    if rate and name.endswith("_count"):
+        return "Count/Second"
+    if "_bytes" in name:
+        unit = "Bytes"
+    elif "_seconds" in name:
+        # seconds per second, e.g. the busy fraction from a duration _sum
+        return "None" if rate else "Seconds"
+    else:
+        unit = "Count" if rate else "None"
+    return f"{unit}/Second" if rate else unit
+
+
+def _cloudwatch_name(name, rate):
+    return f"{name}_per_second" if rate else name
+
+
+def emf_documents(values, namespace, static_dimensions, timestamp):
+    """one EMF document per dimension set, at most EMF_MAX_METRICS each"""
+    groups = {}
+    for (name, dimensions), value, unit, rate in values:
+        if math.isinf(value):
+            continue
+        groups.setdefault(dimensions, []).append((_cloudwatch_name(name, rate), value, unit))
+
+    documents = []
+    for dimensions, metrics in groups.items():
+        dimension_values = dict(static_dimensions)
+        dimension_values.update(dimensions)
+        for i in range(0, len(metrics), EMF_MAX_METRICS):
+            batch = metrics[i:i + EMF_MAX_METRICS]
+            document = {
+                "_aws": {
+                    "Timestamp": int(timestamp * 1000),
+                    "CloudWatchMetrics": [{
+                        "Namespace": namespace,
+                        "Dimensions": [sorted(dimension_values)],
+                        "Metrics": [{"Name": name, "Unit": unit} for name, _, unit in batch],
+                    }],
+                },
+                **dimension_values,
+            }
+            document.update({name: value for name, value, _ in batch})
+            documents.append(document)
+    return documents
+
+
+class EMFWriter:
+    """EMF lines to stdout, a file, or the CloudWatch agent's tcp:// or udp:// listener"""
+
+    def __init__(self, target="stdout"):
+        self.target = target
+        self.url = urllib.parse.urlsplit(target)
+
+    def write(self, documents):
+        payload = "".join(json.dumps(document, separators=(",", ":")) + "\n" for document in documents)
+        if not payload:
+            return
+        if self.target == "stdout":
+            sys.stdout.write(payload)
+            sys.stdout.flush()
+        elif self.url.scheme == "udp":
+            with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+                # one datagram per document, the agent parses each on its own
+                for line in payload.splitlines():
+                    sock.sendto(line.encode(), (self.url.hostname, self.url.port))
+        elif self.url.scheme == "tcp":
+            with socket.create_connection((self.url.hostname, self.url.port), timeout=5) as sock:
+                sock.sendall(payload.encode())
+        else:
+            with open(self.target, "a") as file:
+                file.write(payload)
+
+
+class PutMetricDataWriter:
+    def __init__(self, namespace, static_dimensions, client=None):
+        self.namespace = namespace
+        self.static_dimensions = static_dimensions
+        self.client = client or boto3.client("cloudwatch")
+
+    def write(self, values, timestamp):
+        data = []
+        for (name, dimensions), value, unit, rate in values:
+            if math.isinf(value):
+                continue
+            dimension_values = dict(self.static_dimensions)
+            dimension_values.update(dimensions)
+            data.append({
+                "MetricName": _cloudwatch_name(name, rate),
+                "Dimensions": [{"Name": k, "Value": v} for k, v in sorted(dimension_values.items())],
+                "Timestamp": timestamp,
+                "Value": value,
+                "Unit": unit,
+            })
+        for i in range(0, len(data), PUT_METRIC_DATA_MAX):
+            self.client.put_metric_data(Namespace=self.namespace, MetricData=data[i:i + PUT_METRIC_DATA_MAX])
+        return len(data)
+
+
+def instance_id(timeout=1):
+    """from IMDSv2, None off EC2"""
+    try:
+        request = urllib.request.Request(
+            f"{IMDS_URL}/api/token", method="PUT", headers={"X-aws-ec2-metadata-token-ttl-seconds": "60"})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            token = response.read().decode()
+        request = urllib.request.Request(
+            f"{IMDS_URL}/meta-data/instance-id", headers={"X-aws-ec2-metadata-token": token})
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            return response.read().decode()
+    except (OSError, urllib.error.URLError):
+        return None
+
+
+def run(url=METRICS_URL, interval=60, metric_filter=None, namespace=NAMESPACE, static_dimensions=None,
+        output="emf", emf_target="stdout", count=None):
+    """scrape every `interval` seconds until SIGTERM/SIGINT, or `count` scrapes"""
+    metric_filter = metric_filter or Filter()
+    static_dimensions = static_dimensions or {}
+    if output == "emf":
+        emf = EMFWriter(emf_target)
+    else:
+        put = PutMetricDataWriter(namespace, static_dimensions)
+
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    rates = Rates()
+    scrapes = 0
+    next_at = time.monotonic()
+    while not stop.is_set():
+        now = time.time()
+        try:
+            with logger.timer("scrape", level=logging.DEBUG) as fields:
+                series = scrape(url, metric_filter)
+                fields["series"] = len(series)
+            values = rates.update(series, now)
+            if output == "emf":
+                emf.write(emf_documents(values, namespace, static_dimensions, now))
+            else:
+                put.write(values, now)
+            logger.debug(f"Published {len(values)} values from {len(series)} series")
+        except (OSError, urllib.error.URLError) as e:
+            # Nucleus restarting, keep going
+            logger.warning(f"Scrape of {url} failed: {e}")
+        except Exception as e:
+            logger.error(f"Publishing failed: {e}")
+
+        scrapes += 1
+        if count and scrapes >= count:
+            break
+        next_at += interval
+        if next_at < time.monotonic():
+            next_at = time.monotonic() + interval
+        stop.wait(next_at - time.monotonic())
+    return scrapes
+
+
+class LocalExporter:
+    """Prometheus endpoint with Nucleus-like series that move between
+    scrapes, for trying the agent where Nucleus is not running"""
+
+    SERVICES = ("api", "lft", "discovery", "search")
+
+    def __init__(self, host="127.0.0.1", port=0):
+        started = time.monotonic()
+        services = self.SERVICES
+
+        def body():
+            elapsed = time.monotonic() - started
+            lines = [
+                "# HELP nucleus_requests_total Requests handled",
+                "# TYPE nucleus_requests_total counter",
+            ]
+            for i, service in enumerate(services):
+                for status in ("200", "500"):
+                    rate = (i + 1) * 10 if status == "200" else 0.1
+                    lines.append(f'nucleus_requests_total{{service="{service}",status="{status}"}} {rate * elapsed:.3f}')
+            lines += [
+                "# HELP nucleus_transferred_bytes_total Bytes sent and received",
+                "# TYPE nucleus_transferred_bytes_total counter",
+                f'nucleus_transferred_bytes_total{{direction="out"}} {int(5e6 * elapsed)}',
+                f'nucleus_transferred_bytes_total{{direction="in"}} {int(1e6 * elapsed)}',
+                "# HELP nucleus_connections Open client connections",
+                "# TYPE nucleus_connections gauge",
+            ]
+            for service in services:
+                lines.append(f'nucleus_connections{{service="{service}"}} {20 + int(10 * math.sin(elapsed / 30))}')
+            lines += [
+                "# HELP nucleus_queue_depth Requests waiting for a worker",
+                "# TYPE nucleus_queue_depth gauge",
+                f"nucleus_queue_depth {int(elapsed) % 7}",
+                "# HELP nucleus_request_duration_seconds Request latency",
+                "# TYPE nucleus_request_duration_seconds histogram",
+            ]
+            for le in ("0.01", "0.1", "1", "+Inf"):
+                lines.append(f'nucleus_request_duration_seconds_bucket{{le="{le}"}} {int(100 * elapsed)}')
+            lines += [
+                f"nucleus_request_duration_seconds_sum {2.5 * elapsed:.3f}",
+                f"nucleus_request_duration_seconds_count {int(100 * elapsed)}",
+            ]
+            return ("\n".join(lines) + "\n").encode()
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                data = body()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.host, self.port = self.server.server_address[:2]
+        self.url = f"http://{self.host}:{self.port}/metrics"
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,306 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+read every block of a volume restored from an EBS snapshot, so the first
+access to a file does not wait for EBS to fetch it from S3
+
+Files under DATA_ROOT are read first, most recently used first, then the
+whole backing device in SEGMENT_SIZE pieces. Finished files and segments are
+appended to a state file named after the EBS volume id, so an interrupted
+run picks up where it stopped and a volume restored again (a new volume id)
+starts over. Reads use O_DIRECT where possible to leave the page cache to
+Nucleus.
+"""
+
+import os
+import mmap
+import time
+import signal
+import threading
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import ovetools.logger as logger
+
+DATA_ROOT = "/var/lib/omni/nucleus-data"
+STATE_DIR = "/var/lib/nst"
+
+CHUNK_SIZE = 1024 ** 2
+SEGMENT_SIZE = 64 * 1024 ** 2
+
+
+class RateLimiter:
+    """spaces reads so all threads together stay under `mb_per_s`"""
+
+    def __init__(self, mb_per_s):
+        self.rate = mb_per_s * 1024 ** 2 if mb_per_s else None
+        self.lock = threading.Lock()
+        self.next = time.monotonic()
+
+    def wait(self, size):
+        if not self.rate:
+            return
+        with self.lock:
+            now = time.monotonic()
+            start = max(self.next, now)
+            self.next = start + size / self.rate
+        if start > now:
+            time.sleep(start - now)
+
+
+class Progress:
+    def __init__(self, name, total, interval):
+        self.name = name
+        self.total = total
+        self.interval = interval
+        self.done = 0
+        self.lock = threading.Lock()
+        self.started = self.reported = time.monotonic()
+
+    def add(self, size):
+        with self.lock:
+            self.done += size
+            now = time.monotonic()
+            if now - self.reported < self.interval:
+                return
+            self.reported = now
+        self.report()
+
+    def report(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        rate = self.done / elapsed
+        eta = (self.total - self.done) / rate if rate else 0
+        percent = 100 * self.done / self.total if self.total else 100
+        logger.info(
+            f"{self.name}: {self.done / 1024 ** 3:.1f}/{self.total / 1024 ** 3:.1f} GiB ({percent:.1f}%), "
+            f"{rate / 1024 ** 2:.0f} MB/s, {eta / 60:.0f} min left",
+            done_bytes=self.done, total_bytes=self.total, mb_s=round(rate / 1024 ** 2, 1))
+
+
+class State:
+    """append-only log of finished work, one key per line"""
+
+    def __init__(self, path, restart=False):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        if restart:
+            self.path.unlink(missing_ok=True)
+        self.done = set()
+        if self.path.is_file():
+            with open(self.path, "r") as file:
+                self.done = {line.rstrip("\n") for line in file}
+        self.lock = threading.Lock()
+        self._file = open(self.path, "a", buffering=1)
+
+    def mark(self, key):
+        with self.lock:
+            self.done.add(key)
+            self._file.write(key + "\n")
+
+    def close(self):
+        self._file.close()
+
+
+def backing_device(path):
+    """/dev node of the filesystem holding path, None for overlay, tmpfs, ..."""
+    st = os.stat(path)
+    sys_path = Path(f"/sys/dev/block/{os.major(st.st_dev)}:{os.minor(st.st_dev)}")
+    if not sys_path.exists():
+        return None
+    return f"/dev/{sys_path.resolve().name}"
+
+
+def volume_id(device):
+    """EBS volume id(s) behind device, from the NVMe serial (vol0123... )"""
+    name = Path(os.path.realpath(device)).name
+    block = Path("/sys/class/block") / name
+    members = sorted(p.name for p in (block / "slaves").iterdir()) if (block / "slaves").is_dir() else []
+    if members:
+        return "+".join(volume_id(f"/dev/{member}") for member in members)
+    # a partition has the serial on its disk
+    for serial in (block / "device" / "serial", block.resolve().parent / "device" / "serial"):
+        if serial.is_file():
+            value = serial.read_text().strip()
+            if value:
+                return value.replace("vol", "vol-", 1) if value.startswith("vol") and "-" not in value else value
+    sectors = block / "size"
+    return f"{name}-{sectors.read_text().strip() if sectors.is_file() else 0}"
+
+
+def _size(device):
+    fd = os.open(device, os.O_RDONLY)
+    try:
+        return os.lseek(fd, 0, os.SEEK_END)
+    finally:
+        os.close(fd)
+
+
+def _open(path):
+    """(fd, direct); O_DIRECT is refused by some filesystems. O_NOATIME keeps
+    prewarm from making every file look recently used"""
+    for flags, direct in ((os.O_DIRECT | os.O_NOATIME, True), (os.O_DIRECT, True),
+                          (os.O_NOATIME, False), (0, False)):
+        try:
+            return os.open(path, os.O_RDONLY | flags), direct
+        except OSError:
+            continue
+    return os.open(path, os.O_RDONLY), False
+
+
+_buffers = threading.local()
+
+
+def _read(fd, direct, offset, length, limiter, progress, stop):
+    # mmap memory is page aligned, as O_DIRECT requires
+    if not hasattr(_buffers, "chunk"):
+        _buffers.chunk = mmap.mmap(-1, CHUNK_SIZE)
+    start, end = offset, offset + length
+    while offset < end and not stop.is_set():
+        limiter.wait(CHUNK_SIZE)
+        read = os.preadv(fd, [_buffers.chunk], offset)
+        if read <= 0:
+            break
+        progress.add(min(read, end - offset))
+        offset += read
+    if not direct:
+        os.posix_fadvise(fd, start, offset - start, os.POSIX_FADV_DONTNEED)
+    return offset >= end
+
+
+def _run(tasks, worker, parallelism, stop):
+    """worker(task) on `parallelism` threads, pulling tasks lazily"""
+    tasks = iter(tasks)
+    lock = threading.Lock()
+
+    def loop():
+        while not stop.is_set():
+            with lock:
+                task = next(tasks, None)
+            if task is None:
+                return
+            worker(task)
+
+    with ThreadPoolExecutor(max_workers=parallelism) as executor:
+        for future in [executor.submit(loop) for _ in range(parallelism)]:
+            future.result()
+
+
+def recent_files(root, recent_hours=0):
+    """(path, size) most recently used first; with recent_hours only files
+    used in that window. noatime mounts leave modification time as the signal"""
+    cutoff = time.time() - recent_hours * 3600 if recent_hours else 0
+    files = []
+    for directory, _, names in os.walk(root):
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                st = os.lstat(path)
+            except OSError:
+                continue
+            if not os.path.isfile(path) or os.path.islink(path) or st.st_size == 0:
+                continue
+            used = max(st.st_atime, st.st_mtime)
+            if used >= cutoff:
+                files.append((used, path, st.st_size))
+    files.sort(reverse=True)
+    return [(path, size) for _, path, size in files]
+
+
+def prewarm_files(files, state, parallelism, limiter, progress_seconds, stop):
+    pending = [(path, size) for path, size in files if f"f {path}" not in state.done]
+    progress = Progress("files", sum(size for _, size in pending), progress_seconds)
+    logger.info(f"Reading {len(pending)} files, {len(files) - len(pending)} already done")
+
+    def worker(task):
+        path, size = task
+        try:
+            fd, direct = _open(path)
+        except OSError as e:
+            logger.debug(f"Skipping {path}: {e}")
+            state.mark(f"f {path}")
+            return
+        try:
+            if _read(fd, direct, 0, size, limiter, progress, stop):
+                state.mark(f"f {path}")
+        finally:
+            os.close(fd)
+
+    _run(pending, worker, parallelism, stop)
+    progress.report()
+    return progress.done
+
+
+def prewarm_device(device, state, parallelism, limiter, progress_seconds, stop):
+    size = _size(device)
+    segments = (size + SEGMENT_SIZE - 1) // SEGMENT_SIZE
+    pending = [i for i in range(segments) if f"s {i}" not in state.done]
+    progress = Progress(device, sum(min(SEGMENT_SIZE, size - i * SEGMENT_SIZE) for i in pending), progress_seconds)
+    logger.info(f"Reading {len(pending)} of {segments} segments of {device}")
+
+    fd, direct = _open(device)
+    try:
+        def worker(i):
+            if _read(fd, direct, i * SEGMENT_SIZE, min(SEGMENT_SIZE, size - i * SEGMENT_SIZE),
+                     limiter, progress, stop):
+                state.mark(f"s {i}")
+
+        _run(pending, worker, parallelism, stop)
+    finally:
+        os.close(fd)
+    progress.report()
+    return progress.done
+
+
+def prewarm(data_root=DATA_ROOT, device=None, mode="both", recent_hours=0, parallelism=8, rate_mb=0,
+            progress_seconds=10, state_dir=STATE_DIR, restart=False, max_seconds=0):
+    """returns a summary; stops cleanly on SIGTERM/SIGINT or after max_seconds
+    and resumes on the next run"""
+    stop = threading.Event()
+    interrupted = threading.Event()
+
+    def interrupt(*_):
+        interrupted.set()
+        stop.set()
+
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, interrupt)
+    budget = threading.Timer(max_seconds, stop.set) if max_seconds else None
+    if budget:
+        budget.daemon = True
+        budget.start()
+
+    device = device or backing_device(data_root)
+    if device is None:
+        if mode != "files":
+            logger.warning(f"{data_root} is not on a block device, only reading files")
+        mode = "files"
+
+    key = volume_id(device) if device else Path(data_root).name
+    state = State(Path(state_dir) / f"prewarm-{key}.state", restart)
+    limiter = RateLimiter(rate_mb)
+    started = time.monotonic()
+    read = 0
+    try:
+        if mode in ("files", "both"):
+            read += prewarm_files(recent_files(data_root, recent_hours), state, parallelism, limiter,
+                                  progress_seconds, stop)
+        if mode in ("device", "both") and not stop.is_set():
+            read += prewarm_device(device, state, parallelism, limiter, progress_seconds, stop)
+    finally:
+        state.close()
+        if budget:
+            budget.cancel()
+
+    elapsed = time.monotonic() - started
+    return {
+        "device": device,
+        "volume": key,
+        "state": str(state.path),
+        "bytes": read,
+        "seconds": round(elapsed, 1),
+        "mb_s": round(read / 1024 ** 2 / elapsed, 1) if elapsed else 0,
+        "interrupted": interrupted.is_set(),
+        "out_of_time": stop.is_set() and not interrupted.is_set(),
+    }
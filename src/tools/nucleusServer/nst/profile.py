@@ -0,0 +1,503 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+resource sampler for the Nucleus compose stack and an instance sizing report
+
+`record` reads cumulative counters for the host (/proc) and for every
+container of the compose project (its cgroup and network namespace) at a fixed
+interval and appends them to a fixed-size ring buffer file, so it can run for
+days with constant disk use. Counters are stored raw; rates are computed when
+the report is built, which keeps each sample to a few small file reads.
+
+Ring file layout: a 64 byte header, a table of MAX_SERIES names of 32 bytes,
+then `capacity` records of RECORD (timestamp, series id, FIELDS).
+"""
+
+import os
+import math
+import mmap
+import time
+import struct
+import signal
+import resource
+import threading
+import subprocess
+from pathlib import Path
+
+import ovetools.logger as logger
+
+STACK_DIR = "/opt/ove/base_stack"
+PROFILE_PATH = "/var/lib/nst/profile.ring"
+
+MAGIC = b"NSTPROF1"
+HEADER = struct.Struct("<8sHHIIIIdQQ")
+HEADER_SIZE = 64
+MAX_SERIES = 64
+NAME_SIZE = 32
+DATA_OFFSET = HEADER_SIZE + MAX_SERIES * NAME_SIZE
+
+FIELDS = ("cpu_usec", "memory_bytes", "read_bytes", "write_bytes", "read_ops", "write_ops", "rx_bytes", "tx_bytes")
+RECORD = struct.Struct("<dH6x" + "Q" * len(FIELDS))
+
+HOST = "host"
+SELF = "nst-profile"
+
+CLK_TCK = os.sysconf("SC_CLK_TCK")
+SECTOR_SIZE = 512
+VIRTUAL_INTERFACES = ("lo", "docker", "br-", "veth", "virbr")
+VIRTUAL_DISKS = ("loop", "ram", "zram")
+
+
+class ProfileError(Exception):
+    """no profile at the path, or one this version cannot read"""
+
+
+class RingFile:
+    """append-only ring of fixed size records in an mmap'ed file"""
+
+    def __init__(self, path, capacity=None, interval=None, create=True):
+        self.path = Path(path)
+        exists = self.path.is_file() and self.path.stat().st_size >= DATA_OFFSET
+        if not exists and not create:
+            raise ProfileError(f"ERROR: No profile at {path}")
+
+        if not exists:
+            if not capacity:
+                raise Exception("ERROR: capacity is required to create a profile")
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with open(self.path, "wb") as file:
+                file.write(HEADER.pack(
+                    MAGIC, 1, MAX_SERIES, RECORD.size, capacity, int((interval or 0) * 1000),
+                    os.cpu_count(), time.time(), _meminfo().get("MemTotal", 0), 0))
+                # sparse until written
+                file.truncate(DATA_OFFSET + capacity * RECORD.size)
+
+        self._file = open(self.path, "r+b" if create else "rb")
+        self._mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_WRITE if create else mmap.ACCESS_READ)
+        (magic, _, max_series, record_size, self.capacity, interval_ms,
+         self.cpus, self.created, self.memory_total, self.count) = HEADER.unpack_from(self._mm, 0)
+        if (magic != MAGIC or max_series != MAX_SERIES or record_size != RECORD.size
+                or len(self._mm) < DATA_OFFSET + self.capacity * RECORD.size):
+            self.close()
+            raise ProfileError(f"ERROR: {path} is not an nst profile, or was written by another version")
+        if exists and capacity and capacity != self.capacity:
+            logger.warning(f"{path} keeps its capacity of {self.capacity} records, remove it to resize")
+        self.interval = interval_ms / 1000
+        self.series = self._read_series()
+
+    def _read_series(self):
+        names = []
+        for i in range(MAX_SERIES):
+            raw = self._mm[HEADER_SIZE + i * NAME_SIZE:HEADER_SIZE + (i + 1) * NAME_SIZE].rstrip(b"\0")
+            if not raw:
+                break
+            names.append(raw.decode())
+        return names
+
+    def series_id(self, name):
+        if name in self.series:
+            return self.series.index(name)
+        if len(self.series) == MAX_SERIES:
+            return None
+        offset = HEADER_SIZE + len(self.series) * NAME_SIZE
+        self._mm[offset:offset + NAME_SIZE] = name.encode()[:NAME_SIZE].ljust(NAME_SIZE, b"\0")
+        self.series.append(name)
+        return len(self.series) - 1
+
+    def append(self, timestamp, series_id, values):
+        RECORD.pack_into(self._mm, DATA_OFFSET + (self.count % self.capacity) * RECORD.size,
+                         timestamp, series_id, *values)
+        # the count goes last, a reader never sees a half written record as valid
+        self.count += 1
+        struct.pack_into("<Q", self._mm, HEADER.size - 8, self.count)
+
+    def records(self):
+        """(timestamp, series name, values) oldest first"""
+        first = max(self.count - self.capacity, 0)
+        for n in range(first, self.count):
+            timestamp, series_id, *values = RECORD.unpack_from(
+                self._mm, DATA_OFFSET + (n % self.capacity) * RECORD.size)
+            if series_id < len(self.series):
+                yield timestamp, self.series[series_id], values
+
+    def flush(self):
+        self._mm.flush()
+
+    def close(self):
+        self._mm.close()
+        self._file.close()
+
+
+def _read(path):
+    with open(path, "r") as file:
+        return file.read()
+
+
+def _meminfo():
+    try:
+        return {
+            line.split(":")[0]: int(line.split()[1]) * 1024
+            for line in _read("/proc/meminfo").splitlines() if line.endswith("kB")
+        }
+    except OSError:
+        return {}
+
+
+def _net_dev(path="/proc/net/dev"):
+    rx = tx = 0
+    for line in _read(path).splitlines()[2:]:
+        name, counters = line.split(":", 1)
+        if name.strip().startswith(VIRTUAL_INTERFACES):
+            continue
+        counters = counters.split()
+        rx += int(counters[0])
+        tx += int(counters[8])
+    return rx, tx
+
+
+def _physical_disks():
+    """whole disks and arrays, but not the members of an md/dm device, which
+    would count the same I/O twice"""
+    disks = set()
+    for name in os.listdir("/sys/block"):
+        if name.startswith(VIRTUAL_DISKS):
+            continue
+        holders = Path("/sys/block") / name / "holders"
+        if holders.is_dir() and any(holders.iterdir()):
+            continue
+        disks.add(name)
+    return disks
+
+
+def host_sample(disks):
+    cpu = [int(v) for v in _read("/proc/stat").splitlines()[0].split()[1:]]
+    # user nice system idle iowait irq softirq steal ...: busy leaves out idle, iowait and steal
+    busy = sum(cpu[:8]) - cpu[3] - cpu[4] - cpu[7]
+    memory = _meminfo()
+
+    read_bytes = write_bytes = read_ops = write_ops = 0
+    for line in _read("/proc/diskstats").splitlines():
+        fields = line.split()
+        if fields[2] in disks:
+            read_ops += int(fields[3])
+            read_bytes += int(fields[5]) * SECTOR_SIZE
+            write_ops += int(fields[7])
+            write_bytes += int(fields[9]) * SECTOR_SIZE
+
+    rx, tx = _net_dev()
+    return (
+        busy * 1_000_000 // CLK_TCK,
+        memory.get("MemTotal", 0) - memory.get("MemAvailable", 0),
+        read_bytes, write_bytes, read_ops, write_ops, rx, tx,
+    )
+
+
+def self_sample():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return (int((usage.ru_utime + usage.ru_stime) * 1_000_000), usage.ru_maxrss * 1024, 0, 0, 0, 0, 0, 0)
+
+
+def _cgroup_paths(pid):
+    """controller -> cgroup directory; cgroup v2 uses the "" controller"""
+    paths = {}
+    for line in _read(f"/proc/{pid}/cgroup").splitlines():
+        _, controllers, path = line.split(":", 2)
+        for controller in controllers.split(",") if controllers else [""]:
+            root = "/sys/fs/cgroup" if controller == "" else f"/sys/fs/cgroup/{controller}"
+            if controller == "" and not Path("/sys/fs/cgroup/cgroup.controllers").is_file():
+                continue
+            paths[controller] = root + path
+    return paths
+
+
+def _keyed(text):
+    return {k: int(v) for k, v in (line.split()[:2] for line in text.splitlines() if line.strip())}
+
+
+def container_sample(pid, paths):
+    if "" in paths:
+        base = Path(paths[""])
+        cpu_usec = _keyed(_read(base / "cpu.stat"))["usage_usec"]
+        # working set, page cache that can be dropped does not count
+        memory = int(_read(base / "memory.current")) - _keyed(_read(base / "memory.stat")).get("inactive_file", 0)
+        io = {"rbytes": 0, "wbytes": 0, "rios": 0, "wios": 0}
+        for line in _read(base / "io.stat").splitlines():
+            for pair in line.split()[1:]:
+                key, value = pair.split("=")
+                if key in io:
+                    io[key] += int(value)
+        read_bytes, write_bytes, read_ops, write_ops = io["rbytes"], io["wbytes"], io["rios"], io["wios"]
+    else:
+        cpu_usec = int(_read(Path(paths["cpuacct"]) / "cpuacct.usage")) // 1000
+        memory_path = Path(paths["memory"])
+        memory = int(_read(memory_path / "memory.usage_in_bytes")) - _keyed(
+            _read(memory_path / "memory.stat")).get("total_inactive_file", 0)
+
+        def blkio(name):
+            totals = {"Read": 0, "Write": 0}
+            for line in _read(Path(paths["blkio"]) / name).splitlines():
+                parts = line.split()
+                if len(parts) == 3 and parts[1] in totals:
+                    totals[parts[1]] += int(parts[2])
+            return totals["Read"], totals["Write"]
+
+        read_bytes, write_bytes = blkio("blkio.throttle.io_service_bytes")
+        read_ops, write_ops = blkio("blkio.throttle.io_serviced")
+
+    rx, tx = _net_dev(f"/proc/{pid}/net/dev")
+    return (cpu_usec, max(memory, 0), read_bytes, write_bytes, read_ops, write_ops, rx, tx)
+
+
+def stack_containers(stack_dir=STACK_DIR):
+    """service name -> (pid, cgroup paths) for the running containers of the
+    compose project in stack_dir"""
+    ids = subprocess.run(
+        ["docker", "ps", "-q", "--no-trunc", "--filter",
+         f"label=com.docker.compose.project.working_dir={stack_dir}"],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    if not ids:
+        return {}
+
+    output = subprocess.run(
+        ["docker", "inspect", "--format",
+         '{{.State.Pid}} {{index .Config.Labels "com.docker.compose.service"}}', *ids],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    containers = {}
+    for line in output.splitlines():
+        pid, service = line.split(" ", 1)
+        if pid == "0":
+            continue
+        try:
+            containers[service] = (pid, _cgroup_paths(pid))
+        except OSError:
+            continue
+    return containers
+
+
+def record(path=PROFILE_PATH, interval=10, capacity=None, stack_dir=STACK_DIR, refresh=30,
+           duration=None, nice=10):
+    """sample until SIGTERM/SIGINT (or for `duration` seconds)
+
+    The container list is refreshed every `refresh` samples, and right away
+    when a container disappears, e.g. after `nst apply-nucleus-stack-env`.
+    """
+    if nice:
+        os.nice(nice)
+    ring = RingFile(path, capacity, interval)
+    interval = ring.interval or interval
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    disks = _physical_disks()
+    host_id, self_id = ring.series_id(HOST), ring.series_id(SELF)
+    containers, samples, stale = {}, 0, True
+    deadline = time.monotonic() + duration if duration else None
+    next_at = time.monotonic()
+    logger.info(f"Sampling every {interval}s into {path} ({ring.capacity} records)")
+
+    while not stop.is_set():
+        if stale or samples % refresh == 0:
+            stale = False
+            try:
+                containers = stack_containers(stack_dir)
+            except (OSError, subprocess.CalledProcessError) as e:
+                logger.warning(f"Could not list containers: {e}")
+                containers = {}
+            disks = _physical_disks()
+
+        now = time.time()
+        ring.append(now, host_id, host_sample(disks))
+        for service, (pid, paths) in list(containers.items()):
+            series_id = ring.series_id(service)
+            if series_id is None:
+                continue
+            try:
+                ring.append(now, series_id, container_sample(pid, paths))
+            except (OSError, KeyError, ValueError):
+                # stopped or recreated, pick up the new container on the next sample
+                del containers[service]
+                stale = True
+        ring.append(now, self_id, self_sample())
+
+        samples += 1
+        if samples % 60 == 0:
+            ring.flush()
+        if deadline and time.monotonic() >= deadline:
+            break
+
+        next_at += interval
+        if next_at < time.monotonic():
+            # suspended or overloaded: skip the missed samples instead of catching up
+            next_at = time.monotonic() + interval
+        stop.wait(next_at - time.monotonic())
+
+    ring.flush()
+    ring.close()
+    logger.info(f"Stopped after {samples} samples")
+
+
+METRICS = ("cpu_cores", "memory_gib", "read_mb_s", "write_mb_s", "read_iops", "write_iops", "rx_mb_s", "tx_mb_s")
+
+
+def _rates(previous, current, elapsed):
+    deltas = [c - p for p, c in zip(previous, current)]
+    # a counter that went backwards belongs to a restarted container
+    if any(d < 0 for i, d in enumerate(deltas) if i != 1):
+        return None
+    cpu, _, read_bytes, write_bytes, read_ops, write_ops, rx, tx = deltas
+    mb = 1024 ** 2
+    return (
+        cpu / 1_000_000 / elapsed, current[1] / 1024 ** 3,
+        read_bytes / mb / elapsed, write_bytes / mb / elapsed,
+        read_ops / elapsed, write_ops / elapsed,
+        rx / mb / elapsed, tx / mb / elapsed,
+    )
+
+
+def percentile(values, p):
+    """nearest rank"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def summarize(path=PROFILE_PATH, since=None):
+    """p50/p95/p99/max of every metric for every series"""
+    ring = RingFile(path, create=False)
+    previous, samples = {}, {}
+    first = last = None
+    for timestamp, series, values in ring.records():
+        if since and timestamp < since:
+            continue
+        first = timestamp if first is None else first
+        last = timestamp
+        if series in previous:
+            prev_timestamp, prev_values = previous[series]
+            elapsed = timestamp - prev_timestamp
+            # gaps (restarts of the sampler) would average out the peaks
+            if 0 < elapsed <= 3 * (ring.interval or elapsed):
+                rates = _rates(prev_values, values, elapsed)
+                if rates:
+                    samples.setdefault(series, []).append(rates)
+        previous[series] = (timestamp, values)
+
+    summary = {
+        "path": str(path),
+        "cpus": ring.cpus,
+        "memory_gib": round(ring.memory_total / 1024 ** 3, 1),
+        "interval": ring.interval,
+        "hours": round((last - first) / 3600, 2) if first else 0,
+        "series": {},
+    }
+    for series, rows in samples.items():
+        summary["series"][series] = {"samples": len(rows)}
+        for i, metric in enumerate(METRICS):
+            column = [row[i] for row in rows]
+            summary["series"][series][metric] = {
+                "p50": round(percentile(column, 50), 3),
+                "p95": round(percentile(column, 95), 3),
+                "p99": round(percentile(column, 99), 3),
+                "max": round(max(column), 3),
+            }
+    ring.close()
+    return summary
+
+
+# GiB of memory per vCPU
+FAMILIES = {"c6i": 2, "m6i": 4, "r6i": 8}
+# size: (vCPUs, baseline network Gbps, baseline EBS Mbps), the same for all three families
+SIZES = {
+    "large": (2, 0.781, 650),
+    "xlarge": (4, 1.562, 1250),
+    "2xlarge": (8, 3.125, 2500),
+    "4xlarge": (16, 6.25, 5000),
+    "8xlarge": (32, 12.5, 10000),
+    "12xlarge": (48, 18.75, 15000),
+    "16xlarge": (64, 25, 20000),
+}
+GP3_BASELINE = (3000, 125)
+GP3_MAX = (16000, 1000)
+
+
+def recommend(summary, cpu_target=0.6, memory_headroom=1.25, bandwidth_target=0.7, io_headroom=1.2):
+    """smallest c6i/m6i/r6i size that keeps p95 CPU under cpu_target, p99
+    memory (plus headroom) in RAM and p95 network and EBS traffic under
+    bandwidth_target of the baseline; gp3 IOPS/throughput for p99 disk I/O"""
+    host = summary["series"].get(HOST)
+    if not host:
+        raise Exception("ERROR: No host samples in the profile yet")
+
+    vcpus = host["cpu_cores"]["p95"] / cpu_target
+    memory = host["memory_gib"]["p99"] * memory_headroom
+    network_gbps = (host["rx_mb_s"]["p95"] + host["tx_mb_s"]["p95"]) * 8 * 1.048576 / 1000 / bandwidth_target
+    ebs_mbps = (host["read_mb_s"]["p95"] + host["write_mb_s"]["p95"]) * 8 * 1.048576 / bandwidth_target
+
+    candidates = []
+    for family, gib_per_vcpu in FAMILIES.items():
+        for size, (size_vcpus, size_network, size_ebs) in SIZES.items():
+            if (size_vcpus >= vcpus and size_vcpus * gib_per_vcpu >= memory
+                    and size_network >= network_gbps and size_ebs >= ebs_mbps):
+                # the smallest instance wins; price roughly follows vCPUs x memory ratio
+                candidates.append((size_vcpus * (1 + gib_per_vcpu / 8), f"{family}.{size}"))
+                break
+    instance_type = min(candidates)[1] if candidates else "larger than r6i.16xlarge"
+
+    iops = (host["read_iops"]["p99"] + host["write_iops"]["p99"]) * io_headroom
+    throughput = (host["read_mb_s"]["p99"] + host["write_mb_s"]["p99"]) * io_headroom
+    volumes = max(math.ceil(iops / GP3_MAX[0]), math.ceil(throughput / GP3_MAX[1]), 1)
+    ebs = {
+        "volumes": volumes,
+        "iops": max(GP3_BASELINE[0], math.ceil(iops / volumes / 100) * 100),
+        "throughput_mb_s": max(GP3_BASELINE[1], math.ceil(throughput / volumes)),
+    }
+
+    return {
+        "instance_type": instance_type,
+        "needed": {
+            "vcpus": round(vcpus, 1),
+            "memory_gib": round(memory, 1),
+            "network_gbps": round(network_gbps, 2),
+            "ebs_mbps": round(ebs_mbps),
+        },
+        "gp3": ebs,
+    }
+
+
+def format_report(summary, recommendation):
+    lines = [
+        f"{summary['path']}: {summary['hours']}h every {summary['interval']}s, "
+        f"host {summary['cpus']} vCPUs / {summary['memory_gib']} GiB",
+        "",
+        f"{'series':<24}{'metric':<12}{'p50':>10}{'p95':>10}{'p99':>10}{'max':>10}",
+    ]
+    order = [HOST] + sorted(s for s in summary["series"] if s not in (HOST, SELF)) + [SELF]
+    for series in order:
+        stats = summary["series"].get(series)
+        if not stats:
+            continue
+        label = series
+        for metric in METRICS:
+            values = stats[metric]
+            if series == SELF and metric not in ("cpu_cores", "memory_gib"):
+                continue
+            lines.append(
+                f"{label:<24}{metric:<12}{values['p50']:>10.3f}{values['p95']:>10.3f}"
+                f"{values['p99']:>10.3f}{values['max']:>10.3f}")
+            label = ""
+
+    needed, gp3 = recommendation["needed"], recommendation["gp3"]
+    lines.append("")
+    lines.append(
+        f"needed: {needed['vcpus']} vCPUs, {needed['memory_gib']} GiB, "
+        f"{needed['network_gbps']} Gbps network, {needed['ebs_mbps']} Mbps EBS")
+    lines.append(f"instance type: {recommendation['instance_type']}")
+    lines.append(
+        f"data volumes: {gp3['volumes']} x gp3 at {gp3['iops']} IOPS / {gp3['throughput_mb_s']} MB/s"
+        + (" (NUCLEUS_DATA_VOLUME_COUNT, striped by nst prepare-data-root)" if gp3["volumes"] > 1 else ""))
+    return "\n".join(lines)
@@ -0,0 +1,288 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+helpers for applying nucleus-stack.env changes to a running compose stack
+
+Changed env keys are mapped to the compose services that reference them
+(`${KEY}` anywhere in the service definition), and only those services are
+recreated, in depends_on order, each gated on container readiness.
+"""
+
+import io
+import re
+import time
+import socket
+import hashlib
+import subprocess
+from pathlib import Path
+
+import yaml
+from dotenv import dotenv_values
+
+import ovetools.logger as logger
+
+VARIABLE_PATTERN = re.compile(r"\$\{?([A-Za-z_][A-Za-z0-9_]*)")
+
+# the ports the reverse proxy routes to, rpt's UPSTREAM_PORTS
+SERVICE_PORT_KEYS = (
+    "API_PORT_2",
+    "LFT_PORT",
+    "DISCOVERY_PORT",
+    "AUTH_PORT",
+    "AUTH_LOGIN_FORM_PORT",
+    "WEB_PORT",
+    "TAGGING_PORT",
+    "SEARCH_PORT",
+)
+
+
+def _diff(previous, current):
+    return {k for k in set(previous) | set(current) if previous.get(k) != current.get(k)}
+
+
+def diff_env(previous_path, current_path):
+    """keys added, removed or changed between two env files"""
+    previous = dotenv_values(previous_path) if Path(previous_path).is_file() else {}
+    return _diff(previous, dotenv_values(current_path))
+
+
+def diff_env_text(previous, current):
+    return _diff(dotenv_values(stream=io.StringIO(previous)),
+                 dotenv_values(stream=io.StringIO(current)))
+
+
+def file_hash(path):
+    if not Path(path).is_file():
+        return None
+    with open(path, "rb") as file:
+        return hashlib.sha256(file.read()).hexdigest()
+
+
+def _variables(node):
+    if isinstance(node, dict):
+        for k, v in node.items():
+            yield from _variables(k)
+            yield from _variables(v)
+    elif isinstance(node, list):
+        for v in node:
+            yield from _variables(v)
+    elif isinstance(node, str):
+        yield from VARIABLE_PATTERN.findall(node)
+
+
+def load_compose(compose_path):
+    """services -> (variables, depends_on), plus variables used outside services"""
+    with open(compose_path, "r") as file:
+        compose = yaml.safe_load(file)
+
+    services = {}
+    for name, definition in (compose.get("services") or {}).items():
+        depends_on = definition.get("depends_on") or []
+        if isinstance(depends_on, dict):
+            depends_on = list(depends_on)
+        services[name] = {
+            "variables": set(_variables(definition)),
+            "depends_on": list(depends_on),
+        }
+
+    shared = set()
+    for section, definition in compose.items():
+        if section != "services":
+            shared.update(_variables(definition))
+
+    return services, shared
+
+
+def affected_services(changed_keys, services, shared):
+    """services to recreate for changed_keys, None if the whole stack must be
+
+    Keys used by networks/volumes, or not referenced anywhere in the compose
+    file (they may still be read by the containers through env_file), can
+    not be narrowed to a set of services.
+    """
+    affected = set()
+    for key in changed_keys:
+        if key in shared:
+            return None
+        users = {name for name, s in services.items() if key in s["variables"]}
+        if not users:
+            return None
+        affected.update(users)
+    return affected
+
+
+def restart_order(services, targets):
+    """targets sorted so every service comes after the ones it depends on"""
+    ordered = []
+    visiting = set()
+
+    def visit(name):
+        if name in ordered or name not in services:
+            return
+        if name in visiting:
+            raise Exception(f"Circular depends_on in compose file at: {name}")
+        visiting.add(name)
+        for dependency in services[name]["depends_on"]:
+            visit(dependency)
+        visiting.discard(name)
+        ordered.append(name)
+
+    for name in sorted(services):
+        visit(name)
+
+    return [name for name in ordered if name in targets]
+
+
+def compose_command(env_file, compose_file, *args):
+    return ["docker-compose", "--env-file", env_file, "-f", compose_file, *args]
+
+
+def wait_until_ready(env_file, compose_file, service, timeout=300, interval=2):
+    """wait for the service's container to be running and, if it defines a
+    healthcheck, healthy. One-shot containers count once they exit with 0."""
+    deadline = time.monotonic() + timeout
+    while True:
+        container_id = subprocess.run(
+            compose_command(env_file, compose_file, "ps", "-q", service),
+            capture_output=True, text=True,
+        ).stdout.strip()
+
+        if container_id:
+            state = subprocess.run(
+                ["docker", "inspect", "--format",
+                 "{{.State.Status}} {{.State.ExitCode}} {{if .State.Health}}{{.State.Health.Status}}{{end}}",
+                 container_id],
+                capture_output=True, text=True,
+            ).stdout.split()
+            if state[:2] == ["exited", "0"]:
+                return True
+            if state and state[0] == "running" and (len(state) == 2 or state[2] == "healthy"):
+                return True
+            logger.debug(f"{service}: {' '.join(state)}")
+
+        if time.monotonic() > deadline:
+            raise Exception(f"ERROR: {service} not ready after {timeout}s")
+        time.sleep(interval)
+
+
+def apply_env_changes(previous_env, env_file, compose_file, previous_compose=None,
+                      timeout=300, dry_run=False):
+    """recreate only the services affected by the env change
+
+    Returns the list of services recreated, in order, or ["*"] when the whole
+    stack had to be brought up.
+    """
+    changed = diff_env(previous_env, env_file)
+    logger.info(f"Changed keys: {sorted(changed)}")
+
+    services, shared = load_compose(compose_file)
+    targets = affected_services(changed, services, shared)
+
+    if previous_compose is not None and file_hash(previous_compose) != file_hash(compose_file):
+        logger.info(f"{compose_file} changed, applying to the whole stack")
+        targets = None
+
+    if targets is None:
+        if not dry_run:
+            subprocess.run(compose_command(env_file, compose_file, "up", "-d"), check=True)
+            for service in restart_order(services, set(services)):
+                wait_until_ready(env_file, compose_file, service, timeout)
+        return ["*"]
+
+    ordered = restart_order(services, targets)
+    logger.info(f"Services to recreate: {ordered}")
+
+    for service in ordered:
+        if dry_run:
+            continue
+        started = time.monotonic()
+        subprocess.run(
+            compose_command(env_file, compose_file, "up", "-d", "--no-deps", service),
+            check=True,
+        )
+        wait_until_ready(env_file, compose_file, service, timeout)
+        logger.info(f"{service} ready in {time.monotonic() - started:.1f}s")
+
+    return ordered
+
+
+def service_ports(env_file, keys=SERVICE_PORT_KEYS):
+    values = dotenv_values(env_file)
+    return {key: int(values[key]) for key in keys if str(values.get(key) or "").isdigit()}
+
+
+def _answers(host, port, timeout=1):
+    try:
+        with socket.create_connection((host, port), timeout=timeout):
+            return True
+    except OSError:
+        return False
+
+
+def _ready_services(env_file, compose_file):
+    """services whose containers are all running (and healthy, if they define
+    a healthcheck) or exited with 0, in one docker call for the whole stack"""
+    container_ids = subprocess.run(
+        compose_command(env_file, compose_file, "ps", "-q"),
+        capture_output=True, text=True,
+    ).stdout.split()
+    if not container_ids:
+        return set()
+
+    states = subprocess.run(
+        ["docker", "inspect", "--format",
+         '{{index .Config.Labels "com.docker.compose.service"}} '
+         "{{.State.Status}} {{.State.ExitCode}} {{if .State.Health}}{{.State.Health.Status}}{{end}}",
+         *container_ids],
+        capture_output=True, text=True,
+    ).stdout.splitlines()
+
+    ready, not_ready = set(), set()
+    for line in states:
+        state = line.split()
+        if len(state) < 3:
+            continue
+        if state[1:3] == ["exited", "0"] or (state[1] == "running" and (len(state) == 3 or state[3] == "healthy")):
+            ready.add(state[0])
+        else:
+            not_ready.add(state[0])
+    return ready - not_ready
+
+
+def wait_ready(env_file, compose_file, host="127.0.0.1", ports=None, timeout=300, interval=1):
+    """wait for every compose service to be ready and every service port to
+    accept connections
+
+    Ports default to SERVICE_PORT_KEYS from env_file. Returns the seconds
+    until each service and port was first ready, and the total.
+    """
+    services, _ = load_compose(compose_file)
+    ports = service_ports(env_file) if ports is None else ports
+
+    started = time.monotonic()
+    ready_at = {}
+    while True:
+        elapsed = round(time.monotonic() - started, 1)
+        ready = _ready_services(env_file, compose_file)
+        for service in ready:
+            ready_at.setdefault(service, elapsed)
+        for key, port in ports.items():
+            if key not in ready_at and _answers(host, port):
+                ready_at[key] = elapsed
+
+        # a container that went down again is waited for again
+        waiting = [s for s in services if s not in ready] + [k for k in ports if k not in ready_at]
+        if not waiting:
+            break
+        if time.monotonic() - started > timeout:
+            raise Exception(f"ERROR: not ready after {timeout}s: {', '.join(waiting)}")
+        logger.debug(f"Waiting for {', '.join(waiting)}")
+        time.sleep(interval)
+
+    return {
+        "seconds": round(time.monotonic() - started, 1),
+        "services": {s: ready_at[s] for s in services},
+        "ports": {f"{k}={p}": ready_at[k] for k, p in ports.items()},
+    }
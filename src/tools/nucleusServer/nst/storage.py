@@ -0,0 +1,318 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+DATA_ROOT volume layout: discover spare block devices, stripe them with
+mdadm RAID 0, create XFS, persist the mount in fstab and benchmark it
+
+Everything that changes the system is expressed as a plan of steps first, so
+`--dry-run` shows exactly what would run. Loop devices are only considered
+when asked for, which is how the plan is exercised without real volumes.
+"""
+
+import os
+import json
+import mmap
+import time
+import random
+import shlex
+import shutil
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import ovetools.logger as logger
+
+LABEL = "nucleus-data"
+RAID_DEVICE = f"/dev/md/{LABEL}"
+FSTAB_PATH = "/etc/fstab"
+MDADM_CONF_PATH = "/etc/mdadm/mdadm.conf"
+
+EBS_MODEL = "Amazon Elastic Block Store"
+INSTANCE_STORE_MODEL = "Amazon EC2 NVMe Instance Storage"
+
+CHUNK_KB = 256
+ALLOCSIZE = "16m"
+MIN_SIZE = 1024 ** 3
+
+
+def _lsblk():
+    output = subprocess.run(
+        ["lsblk", "-J", "-b", "-o", "NAME,PATH,TYPE,SIZE,MODEL,MOUNTPOINT,FSTYPE,LABEL"],
+        capture_output=True, text=True, check=True,
+    ).stdout
+    return json.loads(output)["blockdevices"]
+
+
+def _swaps():
+    try:
+        with open("/proc/swaps", "r") as file:
+            return {line.split()[0] for line in file.readlines()[1:] if line.strip()}
+    except OSError:
+        return set()
+
+
+def device_kind(device):
+    model = (device.get("model") or "").strip()
+    if device["type"] == "loop":
+        return "loop"
+    if model == INSTANCE_STORE_MODEL:
+        return "instance-store"
+    if model == EBS_MODEL:
+        return "ebs"
+    return "other"
+
+
+def _in_use(device, swaps):
+    return bool(
+        device.get("children")
+        or device.get("mountpoint")
+        or device.get("fstype")
+        or device["path"] in swaps
+    )
+
+
+def discover_devices(include_instance_store=False, include_loop=False, min_size=MIN_SIZE):
+    """unpartitioned, unmounted, unformatted disks big enough to hold data"""
+    swaps = _swaps()
+    candidates = []
+    for device in _lsblk():
+        kind = device_kind(device)
+        if device["type"] not in ("disk", "loop") or device["name"].startswith(("zram", "ram")):
+            continue
+        if kind == "loop" and not include_loop:
+            continue
+        if kind == "instance-store" and not include_instance_store:
+            logger.info(f"Skipping instance store {device['path']}, see --include-instance-store")
+            continue
+        if int(device["size"] or 0) < min_size or _in_use(device, swaps):
+            continue
+        candidates.append({"path": device["path"], "kind": kind, "size": int(device["size"])})
+    return candidates
+
+
+def find_labeled(label=LABEL):
+    """device already carrying the data root filesystem, if any"""
+    def walk(devices):
+        for device in devices:
+            if device.get("label") == label:
+                return device
+            found = walk(device.get("children") or [])
+            if found:
+                return found
+        return None
+    return walk(_lsblk())
+
+
+def fstab_line(mount_point, label=LABEL, allocsize=ALLOCSIZE):
+    # nofail: a missing volume must not stop the instance from booting
+    options = f"defaults,noatime,allocsize={allocsize},logbsize=256k,nofail"
+    return f"LABEL={label} {mount_point} xfs {options} 0 2"
+
+
+def update_fstab(mount_point, line, fstab_path=FSTAB_PATH):
+    """replace any entry for mount_point with line"""
+    lines = []
+    if Path(fstab_path).is_file():
+        with open(fstab_path, "r") as file:
+            lines = [
+                l.rstrip("\n") for l in file
+                if l.strip().startswith("#") or len(l.split()) < 2 or l.split()[1] != mount_point
+            ]
+    lines.append(line)
+    with open(fstab_path + ".tmp", "w") as file:
+        file.write("\n".join(lines) + "\n")
+    os.replace(fstab_path + ".tmp", fstab_path)
+
+
+def plan(devices, mount_point, stripe=True, chunk_kb=CHUNK_KB, allocsize=ALLOCSIZE, label=LABEL):
+    """ordered (description, command) steps; a command is an argv list or a
+    callable for the steps done in Python"""
+    kinds = {d["kind"] for d in devices}
+    if "instance-store" in kinds and kinds - {"instance-store"}:
+        raise Exception("ERROR: Will not stripe instance store with persistent volumes, "
+                        "the array would be lost on every stop")
+    if len(devices) > 1 and not stripe:
+        raise Exception(f"ERROR: {len(devices)} devices given, use --stripe or pass a single --device")
+
+    steps = []
+    tools = {"mkfs.xfs": "xfsprogs"}
+    if len(devices) > 1:
+        tools["mdadm"] = "mdadm"
+    packages = [package for tool, package in tools.items() if shutil.which(tool) is None]
+    if packages:
+        steps.append((f"install {' '.join(packages)}", ["apt-get", "install", "-y", *packages]))
+
+    paths = [d["path"] for d in devices]
+    if len(devices) > 1:
+        target = RAID_DEVICE
+        steps.append((
+            f"stripe {len(paths)} devices into {target} with {chunk_kb}KiB chunks",
+            ["mdadm", "--create", target, "--run", "--level=0", f"--chunk={chunk_kb}",
+             f"--raid-devices={len(paths)}", f"--name={label}", *paths],
+        ))
+        steps.append((
+            f"persist the array in {MDADM_CONF_PATH}",
+            ["sh", "-c", f"mdadm --detail --scan {target} >> {MDADM_CONF_PATH} && update-initramfs -u"],
+        ))
+        # align allocation groups and the log to the stripe
+        mkfs = ["mkfs.xfs", "-f", "-K", "-L", label, "-d", f"su={chunk_kb}k,sw={len(paths)}", target]
+    else:
+        target = paths[0]
+        mkfs = ["mkfs.xfs", "-f", "-K", "-L", label, target]
+
+    steps.append((f"create XFS on {target}", mkfs))
+    steps.append((f"create {mount_point}", ["mkdir", "-p", mount_point]))
+
+    line = fstab_line(mount_point, label, allocsize)
+    steps.append((f"persist mount in {FSTAB_PATH}: {line}", lambda: update_fstab(mount_point, line)))
+    steps.append((f"mount {mount_point}", ["mount", mount_point]))
+    return steps
+
+
+def describe(steps):
+    return [
+        description if callable(command) else f"{description}\n    $ {shlex.join(command)}"
+        for description, command in steps
+    ]
+
+
+def execute(steps):
+    for description, command in steps:
+        logger.info(description)
+        if callable(command):
+            command()
+        else:
+            subprocess.run(command, check=True)
+
+
+def is_mounted(mount_point):
+    return os.path.ismount(mount_point)
+
+
+def check_mount_point(mount_point):
+    """refuse to mount over data already written to the root volume"""
+    path = Path(mount_point)
+    if path.is_dir() and not is_mounted(mount_point) and any(path.iterdir()):
+        raise Exception(
+            f"ERROR: {mount_point} is not empty, move its contents aside before mounting a data volume over it")
+
+
+def _aligned_buffer(size):
+    # mmap memory is page aligned, as O_DIRECT requires
+    return mmap.mmap(-1, size)
+
+
+def benchmark(directory, size_mb=512, block_kb=1024, random_seconds=5, queue_depth=16):
+    """sequential write/read MB/s and random 4KiB read IOPS for directory
+
+    Reads bypass the page cache with O_DIRECT where the filesystem supports
+    it, otherwise the cache is dropped for the file with fadvise.
+    """
+    path = Path(directory) / ".nst-benchmark"
+    block = block_kb * 1024
+    blocks = max(size_mb * 1024 // block_kb, 1)
+    result = {"path": str(directory), "size_mb": size_mb}
+
+    buffer = _aligned_buffer(block)
+    buffer.write(os.urandom(block))
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        started = time.perf_counter()
+        for _ in range(blocks):
+            os.write(fd, buffer)
+        os.fsync(fd)
+        elapsed = time.perf_counter() - started
+        os.close(fd)
+        result["write_mb_s"] = round(blocks * block / 1024 ** 2 / elapsed, 1)
+
+        fd = None
+        try:
+            fd = os.open(path, os.O_RDONLY | getattr(os, "O_DIRECT", 0))
+            result["direct"] = hasattr(os, "O_DIRECT")
+            os.preadv(fd, [_aligned_buffer(4096)], 0)
+        except OSError:
+            # opened, but the filesystem refuses direct reads
+            if fd is not None:
+                os.close(fd)
+            fd = os.open(path, os.O_RDONLY)
+            result["direct"] = False
+        if not result["direct"]:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+
+        started = time.perf_counter()
+        for i in range(blocks):
+            os.preadv(fd, [buffer], i * block)
+        result["read_mb_s"] = round(blocks * block / 1024 ** 2 / (time.perf_counter() - started), 1)
+
+        if not result["direct"]:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        pages = blocks * block // 4096
+        deadline = time.monotonic() + random_seconds
+
+        def reader(seed):
+            rng = random.Random(seed)
+            page = _aligned_buffer(4096)
+            count = 0
+            while time.monotonic() < deadline:
+                os.preadv(fd, [page], rng.randrange(pages) * 4096)
+                count += 1
+            return count
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=queue_depth) as executor:
+            reads = sum(executor.map(reader, range(queue_depth)))
+        result["random_read_iops"] = round(reads / (time.perf_counter() - started))
+        result["queue_depth"] = queue_depth
+        os.close(fd)
+    finally:
+        path.unlink(missing_ok=True)
+    return result
+
+
+def prepare(mount_point, devices=None, include_instance_store=False, include_loop=False,
+            min_size=MIN_SIZE, stripe=True, chunk_kb=CHUNK_KB, allocsize=ALLOCSIZE, dry_run=False):
+    """lay out the data root and return the steps run (or planned)
+
+    Without spare devices the data root stays on the root volume, which is
+    what the bootstrap did before.
+    """
+    if is_mounted(mount_point):
+        logger.info(f"{mount_point} is already a mount point, nothing to do")
+        return []
+
+    existing = find_labeled()
+    if existing and not devices:
+        logger.info(f"Found existing {LABEL} filesystem on {existing['path']}, remounting")
+        line = fstab_line(mount_point, allocsize=allocsize)
+        steps = [
+            (f"create {mount_point}", ["mkdir", "-p", mount_point]),
+            (f"persist mount in {FSTAB_PATH}: {line}", lambda: update_fstab(mount_point, line)),
+            (f"mount {mount_point}", ["mount", mount_point]),
+        ]
+    else:
+        if devices:
+            by_path = {d["path"]: d for d in _lsblk()}
+            selected = []
+            for path in devices:
+                device = by_path.get(path)
+                if device is None:
+                    raise Exception(f"ERROR: No block device at {path}")
+                if _in_use(device, _swaps()):
+                    raise Exception(f"ERROR: {path} is partitioned, formatted or mounted")
+                selected.append({"path": path, "kind": device_kind(device), "size": int(device["size"])})
+        else:
+            selected = discover_devices(include_instance_store, include_loop, min_size)
+
+        if not selected:
+            logger.info(f"No spare block devices, {mount_point} stays on the root volume")
+            return []
+
+        logger.info(f"Devices: {[(d['path'], d['kind'], d['size']) for d in selected]}")
+        check_mount_point(mount_point)
+        steps = plan(selected, mount_point, stripe, chunk_kb, allocsize)
+
+    if not dry_run:
+        execute(steps)
+    return steps
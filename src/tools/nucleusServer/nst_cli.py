@@ -12,13 +12,21 @@ helper tools for omniverse nucleus deployment configuration
 
 # std lib modules
 import os
+import json
+import time
 import logging
 from pathlib import Path
 
 # 3rd party modules
 import click
 
-import nst.logger as logger
+import ovetools.logger as logger
+import nst.compression as compression
+import nst.metrics as metrics
+import nst.prewarm as prewarm
+import nst.profile as profile
+import nst.stack as stack
+import nst.storage as storage
 
 pass_config = click.make_pass_decorator(object, ensure=True)
 
@@ -44,6 +52,8 @@ def hello_world(config, my_opt_arg):
 @click.option("--master-password", required=True)
 @click.option("--service-password", required=True)
 @click.option("--data-root", required=True)
+@click.option("--lft-compression", type=click.Choice(["auto", "0", "1"]), default="auto", show_default=True,
+              help="auto: the last `nst benchmark-lft-compression` recommendation, 1 without one")
 def generate_nucleus_stack_env(
     config,
     server_ip,
@@ -52,9 +62,12 @@ def generate_nucleus_stack_env(
     master_password,
     service_password,
     data_root,
+    lft_compression,
 ):
+    logger.add_secret(master_password)
+    logger.add_secret(service_password)
     logger.info(
-        f"generate_nucleus_stack_env:{server_ip=},{reverse_proxy_domain=},{instance_name=},{master_password=},{service_password=},{data_root=}"
+        f"generate_nucleus_stack_env:{server_ip=},{reverse_proxy_domain=},{instance_name=},{data_root=}"
     )
 
     tools_path = "/".join(list(Path(__file__).parts[:-1]))
@@ -67,6 +80,11 @@ def generate_nucleus_stack_env(
     if not Path(template_path).is_file():
         raise Exception("File not found: {template_path}")
 
+    if lft_compression == "auto":
+        recommended = compression.load_recommendation()
+        lft_compression = "1" if recommended is None else str(recommended)
+        logger.info(f"LFT_COMPRESSION={lft_compression} ({'default' if recommended is None else 'benchmarked'})")
+
     data = ""
     with open(template_path, "r") as file:
         data = file.read()
@@ -78,11 +96,315 @@ def generate_nucleus_stack_env(
         MASTER_PASSWORD=master_password,
         SERVICE_PASSWORD=service_password,
         DATA_ROOT=data_root,
+        LFT_COMPRESSION=lft_compression,
         ACCEPT_EULA="1",
         SECURITY_REVIEWED="1",
     )
 
+    if Path(output_path).is_file():
+        with open(f"{output_path}", "r") as file:
+            previous = file.read()
+        changed = stack.diff_env_text(previous, data)
+        logger.info(f"{output_path} changed keys: {sorted(changed)}")
+
     with open(f"{output_path}", "w") as file:
         file.write(data)
 
     logger.info(output_path)
+
+
+@main.command()
+@pass_config
+@click.option("--previous-env", required=True, help="nucleus-stack.env the stack is currently running with")
+@click.option("--env-file", default="nucleus-stack.env", show_default=True)
+@click.option("--compose-file", default="nucleus-stack-ssl.yml", show_default=True)
+@click.option("--previous-compose-file", default=None,
+              help="compose file the stack is currently running with, any change recreates the whole stack")
+@click.option("--timeout", default=300, show_default=True, help="seconds to wait for each service to be ready")
+@click.option("--dry-run", is_flag=True, default=False)
+def apply_nucleus_stack_env(
+    config,
+    previous_env,
+    env_file,
+    compose_file,
+    previous_compose_file,
+    timeout,
+    dry_run,
+):
+    logger.info(
+        f"apply_nucleus_stack_env:{previous_env=},{env_file=},{compose_file=},{previous_compose_file=},{dry_run=}"
+    )
+
+    services = stack.apply_env_changes(
+        previous_env,
+        env_file,
+        compose_file,
+        previous_compose=previous_compose_file,
+        timeout=timeout,
+        dry_run=dry_run,
+    )
+
+    logger.info(f"Recreated services: {services}")
+
+
+@main.command()
+@pass_config
+@click.option("--env-file", default="nucleus-stack.env", show_default=True)
+@click.option("--compose-file", default="nucleus-stack-ssl.yml", show_default=True)
+@click.option("--host", default="127.0.0.1", show_default=True, help="where the service ports are probed")
+@click.option("--port", "ports", multiple=True, type=int,
+              help="port that must accept connections, the reverse proxy's upstream ports from --env-file by default")
+@click.option("--timeout", default=300, show_default=True, help="seconds to wait for the whole stack")
+@click.option("--interval", default=1.0, show_default=True, help="seconds between checks")
+@click.option("--output-format", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def wait_ready(config, env_file, compose_file, host, ports, timeout, interval, output_format):
+    logger.info(f"wait_ready:{env_file=},{compose_file=},{host=},{ports=},{timeout=}")
+
+    result = stack.wait_ready(
+        env_file,
+        compose_file,
+        host=host,
+        ports={f"PORT_{p}": p for p in ports} if ports else None,
+        timeout=timeout,
+        interval=interval,
+    )
+    logger.info(f"Ready in {result['seconds']}s", seconds=result["seconds"])
+
+    if output_format == "json":
+        click.echo(json.dumps(result, indent=2))
+
+
+@main.command()
+@pass_config
+@click.option("--mount-point", default="/var/lib/omni/nucleus-data", show_default=True)
+@click.option("--device", "devices", multiple=True,
+              help="use these devices instead of discovering unused ones")
+@click.option("--include-instance-store", is_flag=True, default=False,
+              help="also use NVMe instance store, whose data is lost when the instance stops")
+@click.option("--include-loop", is_flag=True, default=False, help="also use loop devices, for testing")
+@click.option("--min-size", default=storage.MIN_SIZE, show_default=True, help="ignore smaller devices, in bytes")
+@click.option("--stripe/--no-stripe", default=True, show_default=True,
+              help="RAID 0 several devices so bandwidth adds up")
+@click.option("--chunk-kb", default=storage.CHUNK_KB, show_default=True)
+@click.option("--allocsize", default=storage.ALLOCSIZE, show_default=True, help="XFS allocsize mount option")
+@click.option("--benchmark-mb", default=512, show_default=True, help="benchmark file size, 0 to skip")
+@click.option("--always-benchmark", is_flag=True, default=False,
+              help="benchmark even when the data root was already prepared")
+@click.option("--dry-run", is_flag=True, default=False, help="print the plan without changing anything")
+def prepare_data_root(
+    config,
+    mount_point,
+    devices,
+    include_instance_store,
+    include_loop,
+    min_size,
+    stripe,
+    chunk_kb,
+    allocsize,
+    benchmark_mb,
+    always_benchmark,
+    dry_run,
+):
+    logger.info(f"prepare_data_root:{mount_point=},{devices=},{stripe=},{dry_run=}")
+
+    steps = storage.prepare(
+        mount_point,
+        devices=list(devices),
+        include_instance_store=include_instance_store,
+        include_loop=include_loop,
+        min_size=min_size,
+        stripe=stripe,
+        chunk_kb=chunk_kb,
+        allocsize=allocsize,
+        dry_run=dry_run,
+    )
+
+    if dry_run:
+        for i, step in enumerate(storage.describe(steps), 1):
+            click.echo(f"{i}. {step}")
+        return
+
+    # nothing changed on a rerun, e.g. every server update
+    if benchmark_mb and (steps or always_benchmark):
+        Path(mount_point).mkdir(parents=True, exist_ok=True)
+        with logger.timer("benchmark"):
+            result = storage.benchmark(mount_point, benchmark_mb)
+        logger.info(f"Benchmark: {json.dumps(result)}", **result)
+
+    click.echo(mount_point)
+
+
+@main.command("profile")
+@pass_config
+@click.option("--path", default=profile.PROFILE_PATH, show_default=True, help="ring buffer file")
+@click.option("--interval", default=10.0, show_default=True, help="seconds between samples")
+@click.option("--retention-hours", default=168, show_default=True,
+              help="history kept before the oldest samples are overwritten, sizes a new file")
+@click.option("--stack-dir", default=profile.STACK_DIR, show_default=True, help="compose project to sample")
+@click.option("--refresh", default=30, show_default=True, help="samples between container list refreshes")
+@click.option("--max-mb", default=128, show_default=True, help="upper bound on the ring buffer file size")
+@click.option("--duration", default=None, type=float, help="seconds to sample, until SIGTERM by default")
+@click.option("--nice", default=10, show_default=True)
+def profile_record(config, path, interval, retention_hours, stack_dir, refresh, max_mb, duration, nice):
+    # host, self and up to ~14 services per sample
+    capacity = min(int(retention_hours * 3600 / interval) * 16, max_mb * 1024 ** 2 // profile.RECORD.size)
+    logger.info(f"profile:{path=},{interval=},{retention_hours=},{capacity=},{stack_dir=}")
+
+    profile.record(path, interval, capacity, stack_dir, refresh, duration, nice)
+
+
+@main.command()
+@pass_config
+@click.option("--path", default=profile.PROFILE_PATH, show_default=True)
+@click.option("--hours", default=None, type=float, help="only the last N hours")
+@click.option("--cpu-target", default=0.6, show_default=True, help="p95 CPU utilization to size for")
+@click.option("--memory-headroom", default=1.25, show_default=True, help="multiplier on p99 memory")
+@click.option("--output-format", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def profile_report(config, path, hours, cpu_target, memory_headroom, output_format):
+    since = time.time() - hours * 3600 if hours else None
+    summary = profile.summarize(path, since)
+    recommendation = profile.recommend(summary, cpu_target, memory_headroom)
+
+    if output_format == "json":
+        click.echo(json.dumps({"summary": summary, "recommendation": recommendation}, indent=2))
+    else:
+        click.echo(profile.format_report(summary, recommendation))
+
+
+@main.command("prewarm")
+@pass_config
+@click.option("--data-root", default=prewarm.DATA_ROOT, show_default=True)
+@click.option("--device", default=None, help="block device to read, the one holding --data-root by default")
+@click.option("--mode", type=click.Choice(["both", "files", "device"]), default="both", show_default=True,
+              help="files under --data-root (most recently used first), the whole device, or files then device")
+@click.option("--recent-hours", default=0.0, show_default=True,
+              help="only read files used in the last N hours in the files pass, 0 for all")
+@click.option("--parallelism", default=8, show_default=True, help="concurrent reads")
+@click.option("--rate-mb", default=0.0, show_default=True, help="MB/s limit across all reads, 0 for none")
+@click.option("--progress-seconds", default=10.0, show_default=True)
+@click.option("--state-dir", default=prewarm.STATE_DIR, show_default=True, help="where progress is kept for resuming")
+@click.option("--restart", is_flag=True, default=False, help="ignore saved progress")
+@click.option("--max-seconds", default=0.0, show_default=True,
+              help="stop after N seconds, the next run continues, 0 for no limit")
+def prewarm_volume(config, data_root, device, mode, recent_hours, parallelism, rate_mb, progress_seconds,
+                   state_dir, restart, max_seconds):
+    logger.info(f"prewarm:{data_root=},{device=},{mode=},{recent_hours=},{parallelism=},{rate_mb=}")
+
+    with logger.timer("prewarm"):
+        result = prewarm.prewarm(
+            data_root,
+            device=device,
+            mode=mode,
+            recent_hours=recent_hours,
+            parallelism=parallelism,
+            rate_mb=rate_mb,
+            progress_seconds=progress_seconds,
+            state_dir=state_dir,
+            restart=restart,
+            max_seconds=max_seconds,
+        )
+    logger.info(f"Prewarm: {json.dumps(result)}", **result)
+    if result["interrupted"]:
+        raise SystemExit(1)
+
+
+@main.command()
+@pass_config
+@click.option("--data-root", default=prewarm.DATA_ROOT, show_default=True)
+@click.option("--sample-mb", default=64, show_default=True, help="data to sample in total")
+@click.option("--max-files", default=500, show_default=True, help="files to sample from")
+@click.option("--chunk-mb", default=4, show_default=True, help="data read from each file at most")
+@click.option("--level", default=6, show_default=True, help="zlib compression level")
+@click.option("--threads", default=None, type=int, help="for the multi-core throughput, all cores by default")
+@click.option("--bandwidth-mbps", "bandwidths", multiple=True, type=int, default=(50, 200, 1000, 10000),
+              show_default=True, help="link bandwidths to compare transfer times at")
+@click.option("--client-mbps", default=200, show_default=True, help="typical client bandwidth, decides the recommendation")
+@click.option("--concurrent-transfers", default=None, type=int,
+              help="transfers sharing the spare cores on a busy server, one per core by default")
+@click.option("--min-gain", default=1.1, show_default=True, help="speedup compression must bring to be recommended")
+@click.option("--margin", default=0.1, show_default=True,
+              help="how far the gain must cross --min-gain to change a saved recommendation")
+@click.option("--seed", default=0, show_default=True, help="file sample seed")
+@click.option("--profile-path", default=profile.PROFILE_PATH, show_default=True,
+              help="`nst profile` ring buffer the spare cores are read from")
+@click.option("--output", default=compression.RECOMMENDATION_PATH, show_default=True,
+              help="where the recommendation for generate-nucleus-stack-env is saved")
+@click.option("--force", is_flag=True, default=False, help="measure again even when a recommendation is saved")
+@click.option("--output-format", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def benchmark_lft_compression(config, data_root, sample_mb, max_files, chunk_mb, level, threads, bandwidths,
+                              client_mbps, concurrent_transfers, min_gain, margin, seed, profile_path, output,
+                              force, output_format):
+    logger.info(f"benchmark_lft_compression:{data_root=},{sample_mb=},{level=},{bandwidths=},{client_mbps=}")
+
+    previous = compression.load_recommendation(output)
+    if previous is not None and not force:
+        logger.info(f"LFT_COMPRESSION={previous} already saved in {output}, --force to measure again",
+                    lft_compression=previous)
+        return
+
+    result = compression.benchmark(
+        data_root,
+        sample_mb=sample_mb,
+        max_files=max_files,
+        chunk_mb=chunk_mb,
+        level=level,
+        threads=threads,
+        bandwidths=bandwidths,
+        client_mbps=client_mbps,
+        concurrent_transfers=concurrent_transfers,
+        min_gain=min_gain,
+        margin=margin,
+        previous=previous,
+        profile_path=profile_path,
+        seed=seed,
+    )
+    if result is None:
+        logger.warning(f"No files under {data_root} to sample, no recommendation saved")
+        return
+
+    compression.save_recommendation(result, output)
+    logger.info(f"LFT_COMPRESSION={result['LFT_COMPRESSION']} saved to {output}",
+                lft_compression=result["LFT_COMPRESSION"], gain=result["gain"])
+
+    if output_format == "json":
+        click.echo(json.dumps(result, indent=2))
+    else:
+        click.echo(compression.format_report(result))
+
+
+@main.command("metrics")
+@pass_config
+@click.option("--url", default=metrics.METRICS_URL, show_default=True, help="Nucleus METRICS_PORT endpoint")
+@click.option("--interval", default=60.0, show_default=True, help="seconds between scrapes")
+@click.option("--include", multiple=True, help="regex on metric names to publish, all by default")
+@click.option("--exclude", multiple=True, default=metrics.DEFAULT_EXCLUDE, show_default=True,
+              help="regex on metric names to drop")
+@click.option("--dimension", "dimensions", multiple=True,
+              help="label kept as a CloudWatch dimension, other labels are summed away")
+@click.option("--namespace", default=metrics.NAMESPACE, show_default=True)
+@click.option("--output", type=click.Choice(["emf", "put-metric-data"]), default="emf", show_default=True)
+@click.option("--emf-target", default="stdout", show_default=True,
+              help="stdout, a file the CloudWatch agent tails, or its tcp://host:port or udp://host:port listener")
+@click.option("--instance-dimension/--no-instance-dimension", default=True, show_default=True,
+              help="add InstanceId from instance metadata")
+@click.option("--count", default=None, type=int, help="stop after N scrapes")
+@click.option("--local-exporter", is_flag=True, default=False, help="scrape a built-in stub exporter instead")
+def scrape_metrics(config, url, interval, include, exclude, dimensions, namespace, output, emf_target,
+                   instance_dimension, count, local_exporter):
+    logger.info(f"metrics:{url=},{interval=},{include=},{exclude=},{dimensions=},{output=},{emf_target=}")
+
+    static_dimensions = {}
+    if instance_dimension:
+        instance_id = metrics.instance_id()
+        if instance_id:
+            static_dimensions["InstanceId"] = instance_id
+        else:
+            logger.warning("No instance metadata, publishing without InstanceId")
+
+    metric_filter = metrics.Filter(include, exclude, dimensions)
+    if local_exporter:
+        with metrics.LocalExporter() as exporter:
+            metrics.run(exporter.url, interval, metric_filter, namespace, static_dimensions,
+                        output, emf_target, count)
+    else:
+        metrics.run(url, interval, metric_filter, namespace, static_dimensions, output, emf_target, count)
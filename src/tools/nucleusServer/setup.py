@@ -16,7 +16,8 @@ setup(
     install_requires=[
         "boto3",
         "python-dotenv",
-        "Click"
+        "Click",
+        "PyYAML"
     ],
     entry_points='''
         [console_scripts]
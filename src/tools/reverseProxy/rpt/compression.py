@@ -0,0 +1,170 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+precompressed Navigator assets and a before/after byte count replay for the
+compression profile rendered by `rpt generate-nginx-config --compression`
+"""
+
+import os
+import re
+import gzip
+import mimetypes
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+import ovetools.logger as logger
+import rpt.logs as logs
+from rpt.nginx import GZIP_TYPES, GZIP_LEVEL, GZIP_MIN_LENGTH, HASHED_ASSET_PATTERN
+
+NAVIGATOR_PREFIX = "/omni/web2/"
+
+_hashed = re.compile(HASHED_ASSET_PATTERN, re.IGNORECASE)
+
+mimetypes.add_type("application/javascript", ".mjs")
+mimetypes.add_type("application/wasm", ".wasm")
+mimetypes.add_type("font/ttf", ".ttf")
+mimetypes.add_type("font/otf", ".otf")
+
+
+def is_hashed(path):
+    return _hashed.match(path) is not None
+
+
+def is_compressible(path):
+    content_type = mimetypes.guess_type(path)[0]
+    return content_type == "text/html" or content_type in GZIP_TYPES
+
+
+def precompress(root, level=9, min_length=GZIP_MIN_LENGTH):
+    """write `<file>.gz` next to every compressible file for gzip_static
+
+    Files whose .gz is newer are skipped, so this can run after every
+    Navigator upgrade. Returns (files written, bytes before, bytes after).
+    """
+    written, before, after = 0, 0, 0
+    for path in sorted(Path(root).rglob("*")):
+        if not path.is_file() or path.suffix == ".gz" or not is_compressible(path.name):
+            continue
+        size = path.stat().st_size
+        if size < min_length:
+            continue
+
+        target = path.with_name(path.name + ".gz")
+        if not target.is_file() or target.stat().st_mtime < path.stat().st_mtime:
+            with open(path, "rb") as file:
+                data = gzip.compress(file.read(), compresslevel=level, mtime=0)
+            # never serve a .gz larger than the original
+            if len(data) >= size:
+                continue
+            with open(target, "wb") as file:
+                file.write(data)
+            os.utime(target, (path.stat().st_atime, path.stat().st_mtime))
+            written += 1
+
+        before += size
+        after += target.stat().st_size
+    return written, before, after
+
+
+def paths_from_logs(log_paths):
+    """unique Navigator GET paths answered with 200, in first-seen order"""
+    paths = {}
+    for log_path in log_paths:
+        for line in logs.read_lines(log_path):
+            m = logs.LOG_PATTERN.match(line)
+            if m is None or m["status"] != "200":
+                continue
+            parts = m["request"].split(" ")
+            if len(parts) < 2 or parts[0] != "GET":
+                continue
+            path = parts[1].split("?")[0]
+            if path.startswith(NAVIGATOR_PREFIX):
+                paths.setdefault(path, None)
+    return list(paths)
+
+
+def measure_local(asset_root, path, gzip_level=GZIP_LEVEL):
+    """bytes for one asset before and after the profile, from files on disk"""
+    file_path = Path(asset_root) / path[len(NAVIGATOR_PREFIX):]
+    if not file_path.is_file():
+        return None
+
+    with open(file_path, "rb") as file:
+        data = file.read()
+    compressed = len(data)
+    if is_compressible(path) and len(data) >= GZIP_MIN_LENGTH:
+        static = file_path.with_name(file_path.name + ".gz")
+        if static.is_file():
+            compressed = static.stat().st_size
+        else:
+            compressed = min(len(gzip.compress(data, compresslevel=gzip_level, mtime=0)), len(data))
+    return len(data), compressed, is_hashed(path)
+
+
+def _fetch(url, headers, timeout):
+    request = urllib.request.Request(url, headers=headers)
+    # urllib leaves Content-Encoding alone, so this is the body on the wire
+    with urllib.request.urlopen(request, timeout=timeout) as response:
+        return len(response.read()), response.headers.get("Cache-Control") or ""
+
+
+def measure_remote(base_url, path, timeout=30):
+    """bytes for one asset fetched without and with Accept-Encoding: gzip"""
+    url = base_url.rstrip("/") + path
+    try:
+        identity, _ = _fetch(url, {"Accept-Encoding": "identity"}, timeout)
+        compressed, cache_control = _fetch(url, {"Accept-Encoding": "gzip"}, timeout)
+    except urllib.error.URLError as e:
+        logger.warning(f"{url}: {e}")
+        return None
+    return identity, compressed, "immutable" in cache_control
+
+
+def replay(paths, asset_root=None, base_url=None, gzip_level=GZIP_LEVEL):
+    """byte counts for a first and a repeat page load of `paths`
+
+    Before: every asset uncompressed on every load. After: compressed, and
+    on the repeat load immutable assets come from the browser cache.
+    """
+    rows = []
+    for path in paths:
+        if base_url:
+            measured = measure_remote(base_url, path)
+        else:
+            measured = measure_local(asset_root, path, gzip_level)
+        if measured is None:
+            logger.warning(f"Skipping {path}: not found")
+            continue
+        before, after, immutable = measured
+        rows.append({"path": path, "before": before, "after": after, "immutable": immutable})
+
+    first_before = sum(r["before"] for r in rows)
+    first_after = sum(r["after"] for r in rows)
+    repeat_after = sum(r["after"] for r in rows if not r["immutable"])
+    return {
+        "assets": len(rows),
+        "immutable": sum(r["immutable"] for r in rows),
+        "first_load": {"before": first_before, "after": first_after},
+        "repeat_load": {"before": first_before, "after": repeat_after},
+        "rows": rows,
+    }
+
+
+def format_report(report, top=20):
+    def ratio(before, after):
+        return f"{100 * (1 - after / before):.1f}%" if before else "-"
+
+    lines = [f"{'path':<60}{'before':>12}{'after':>12}{'saved':>8}  immutable"]
+    for row in sorted(report["rows"], key=lambda r: r["before"], reverse=True)[:top]:
+        lines.append(
+            f"{row['path'][-60:]:<60}{row['before']:>12}{row['after']:>12}"
+            f"{ratio(row['before'], row['after']):>8}  {'yes' if row['immutable'] else 'no'}")
+    lines.append("")
+    lines.append(f"assets: {report['assets']}  immutable: {report['immutable']}")
+    for title, key in (("first load", "first_load"), ("repeat load", "repeat_load")):
+        before, after = report[key]["before"], report[key]["after"]
+        lines.append(f"{title:<12}  before: {before:>12}  after: {after:>12}  saved: {ratio(before, after)}")
+    return "\n".join(lines)
@@ -0,0 +1,223 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+noisy neighbour scenario for the per client limits rendered by
+`rpt generate-nginx-config --limits`
+
+Well-behaved clients send requests at a fixed rate while one noisy client
+hammers the same route over many connections. Each simulated client sends its
+own X-Forwarded-For address, so the proxy must trust the load generator
+(`--trusted-proxy`) to key the limits per simulated client. The scenario runs
+a quiet phase and a noisy phase and reports the well-behaved clients' latency
+in both; with the limits on, the tail should stay flat while the noisy client
+collects 429s. The noisy client runs in its own process, so its tight loops
+do not compete for the GIL with the well-behaved clients being measured.
+"""
+
+import math
+import time
+import threading
+import multiprocessing
+import http.client
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+import ovetools.logger as logger
+
+# documentation ranges, RFC 5737
+CLIENT_ADDRESS = "198.51.100.{}"
+NOISY_ADDRESS = "203.0.113.1"
+
+
+class LocalBackend:
+    """stand-in for a single Nucleus backend: `capacity` requests are served
+    at a time, each taking `service_ms`, the rest wait for a slot. Point a
+    local nginx at it to run the scenario where no Nucleus is at hand."""
+
+    def __init__(self, host="127.0.0.1", port=0, capacity=8, service_ms=20, body_bytes=1024):
+        slots = threading.BoundedSemaphore(capacity)
+        body = b"x" * body_bytes
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_GET(self):
+                with slots:
+                    time.sleep(service_ms / 1000)
+                self.send_response(200)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.server.request_queue_size = 1024
+        self.host, self.port = self.server.server_address[:2]
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * pct / 100) - 1, 0)]
+
+
+class _Client:
+    """one keep-alive connection sending requests as `address`"""
+
+    def __init__(self, url, address, timeout):
+        self.url = urllib.parse.urlsplit(url)
+        self.path = self.url.path or "/"
+        if self.url.query:
+            self.path += "?" + self.url.query
+        self.address = address
+        self.timeout = timeout
+        self.connection = None
+
+    def _connect(self):
+        cls = http.client.HTTPSConnection if self.url.scheme == "https" else http.client.HTTPConnection
+        self.connection = cls(self.url.hostname, self.url.port, timeout=self.timeout)
+
+    def request(self):
+        """(status, seconds); status 0 for a connection error or timeout"""
+        if self.connection is None:
+            self._connect()
+        started = time.perf_counter()
+        try:
+            self.connection.request("GET", self.path, headers={"X-Forwarded-For": self.address})
+            response = self.connection.getresponse()
+            response.read()
+            if response.will_close:
+                self.close()
+            return response.status, time.perf_counter() - started
+        except (OSError, http.client.HTTPException):
+            self.close()
+            return 0, time.perf_counter() - started
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+
+def _steady(url, address, rate, deadline, timeout, results):
+    client = _Client(url, address, timeout)
+    next_at = time.monotonic()
+    while next_at < deadline:
+        status, seconds = client.request()
+        results.append((status, seconds))
+        next_at += 1 / rate
+        delay = next_at - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+    client.close()
+
+
+def _flood(url, deadline, timeout, results):
+    client = _Client(url, NOISY_ADDRESS, timeout)
+    while time.monotonic() < deadline:
+        results.append(client.request())
+    client.close()
+
+
+def _flood_process(url, connections, deadline, timeout):
+    """every noisy connection, run in a process of its own; deadline is on
+    the monotonic clock, which processes on one host share"""
+    results = []
+    threads = [
+        threading.Thread(target=_flood, args=(url, deadline, timeout, results))
+        for _ in range(connections)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def _summarize(results):
+    statuses = {}
+    for status, _ in results:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    latencies = [seconds * 1000 for status, seconds in results if status == 200]
+    summary = {"requests": len(results), "statuses": statuses}
+    for pct in (50, 95, 99):
+        value = _percentile(latencies, pct)
+        summary[f"p{pct}_ms"] = round(value, 1) if value is not None else None
+    summary["max_ms"] = round(max(latencies), 1) if latencies else None
+    return summary
+
+
+def run_phase(url, clients, rate, noisy_connections, duration, timeout=10):
+    """latency of `clients` well-behaved clients, with `noisy_connections`
+    flooding connections from one noisy client alongside"""
+    with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+        if noisy_connections:
+            # start the process before the clock runs, spawning takes a while
+            pool.submit(int).result()
+        deadline = time.monotonic() + duration
+        flood = None
+        if noisy_connections:
+            flood = pool.submit(_flood_process, url, noisy_connections, deadline, timeout)
+
+        steady = []
+        threads = [
+            threading.Thread(target=_steady, args=(url, CLIENT_ADDRESS.format(i + 1), rate, deadline, timeout, steady))
+            for i in range(clients)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        noisy = flood.result() if flood else []
+
+    phase = {"well_behaved": _summarize(steady)}
+    if noisy_connections:
+        phase["noisy"] = _summarize(noisy)
+    return phase
+
+
+def noisy_neighbour(url, clients=8, rate=5, noisy_connections=64, duration=20, timeout=10):
+    """quiet phase, then the same clients next to a noisy neighbour"""
+    report = {"url": url, "clients": clients, "rate": rate, "noisy_connections": noisy_connections}
+    logger.info(f"Quiet phase: {clients} clients at {rate} requests/s for {duration}s")
+    report["quiet"] = run_phase(url, clients, rate, 0, duration, timeout)
+    logger.info(f"Noisy phase: adding {noisy_connections} flooding connections from {NOISY_ADDRESS}")
+    report["noisy"] = run_phase(url, clients, rate, noisy_connections, duration, timeout)
+    return report
+
+
+def format_report(report):
+    lines = [
+        f"{report['url']}: {report['clients']} clients at {report['rate']} requests/s, "
+        f"noisy neighbour with {report['noisy_connections']} connections",
+        "",
+        f"{'phase':<8}{'client':<14}{'requests':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'max ms':>10}  statuses",
+    ]
+    for phase in ("quiet", "noisy"):
+        for client, summary in report[phase].items():
+            values = [summary[k] for k in ("p50_ms", "p95_ms", "p99_ms", "max_ms")]
+            lines.append(
+                f"{phase:<8}{client:<14}{summary['requests']:>10}"
+                + "".join(f"{'-' if v is None else v:>10}" for v in values)
+                + "  " + " ".join(f"{status}:{count}" for status, count in sorted(summary["statuses"].items())))
+
+    quiet, noisy = report["quiet"]["well_behaved"]["p99_ms"], report["noisy"]["well_behaved"]["p99_ms"]
+    if quiet and noisy:
+        lines.append("")
+        lines.append(f"well-behaved p99 with the noisy neighbour: {noisy / quiet:.2f}x the quiet phase")
+    return "\n".join(lines)
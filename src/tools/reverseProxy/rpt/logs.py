@@ -0,0 +1,282 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+streaming analyzer for nginx access logs written with the `main` log_format
+from templates/nginx.conf
+
+Files are read line by line (transparently gunzipping `.gz` rotations), so
+memory use is bounded by the number of distinct routes, statuses, clients and
+time buckets rather than by log size. Latencies are accumulated in fixed
+log-spaced histograms so per-file results can be merged across processes.
+"""
+
+import gzip
+import math
+import re
+import calendar
+from datetime import datetime, timezone
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+
+# `main` log_format. request_time / upstream_response_time are optional so
+# logs written before they were added to the template still parse.
+LOG_PATTERN = re.compile(
+    r'(?P<remote_addr>\S+) - (?P<remote_user>\S+) \[(?P<time_local>[^\]]+)\] '
+    r'"(?P<request>[^"]*)" (?P<status>\d{3}) (?P<body_bytes_sent>\d+|-) '
+    r'"(?P<http_referer>[^"]*)" "(?P<http_user_agent>[^"]*)" "(?P<http_x_forwarded_for>[^"]*)"'
+    r'(?: (?P<request_time>[\d.]+|-))?(?: "(?P<upstream_response_time>[^"]*)")?'
+)
+
+# longest prefix first, mirrors the `location` blocks in templates/nginx.conf
+ROUTES = [
+    ("/omni/auth/login", "auth-login"),
+    ("/omni/auth", "auth"),
+    ("/omni/api", "api"),
+    ("/omni/lft/", "lft"),
+    ("/omni/discovery", "discovery"),
+    ("/omni/web2/", "navigator"),
+    ("/omni/tagging2", "tagging"),
+    ("/omni/search2", "search"),
+    ("/omniverse:", "omniverse-redirect"),
+    ("/healthcheck", "healthcheck"),
+    ("/_sys/canon-name", "canon-name"),
+]
+
+MONTHS = {
+    "Jan": 1, "Feb": 2, "Mar": 3, "Apr": 4, "May": 5, "Jun": 6,
+    "Jul": 7, "Aug": 8, "Sep": 9, "Oct": 10, "Nov": 11, "Dec": 12,
+}
+
+# latency histogram: 1ms .. ~10 minutes, ~5% relative error per bucket
+HIST_MIN = 0.001
+HIST_FACTOR = 1.05
+HIST_SIZE = int(math.log(600 / HIST_MIN, HIST_FACTOR)) + 2
+_LOG_FACTOR = math.log(HIST_FACTOR)
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+def open_log(path):
+    if str(path).endswith(".gz"):
+        return gzip.open(path, "rt", encoding="utf-8", errors="replace")
+    return open(path, "r", encoding="utf-8", errors="replace")
+
+
+def read_lines(path):
+    with open_log(path) as file:
+        for line in file:
+            yield line
+
+
+def route_for(request):
+    parts = request.split(" ", 2)
+    path = parts[1] if len(parts) > 1 else parts[0]
+    if path == "/":
+        return "root"
+    for prefix, name in ROUTES:
+        if path.startswith(prefix):
+            return name
+    return "other"
+
+
+def histogram_index(seconds):
+    if seconds <= HIST_MIN:
+        return 0
+    return min(int(math.log(seconds / HIST_MIN) / _LOG_FACTOR) + 1, HIST_SIZE - 1)
+
+
+def histogram_value(index):
+    return HIST_MIN * HIST_FACTOR ** index
+
+
+class Summary:
+    """count, bytes and latency histogram for one route or status"""
+
+    __slots__ = ("count", "bytes", "timed", "histogram")
+
+    def __init__(self):
+        self.count = 0
+        self.bytes = 0
+        self.timed = 0
+        self.histogram = [0] * HIST_SIZE
+
+    def add(self, size, latency):
+        self.count += 1
+        self.bytes += size
+        if latency is not None:
+            self.timed += 1
+            self.histogram[histogram_index(latency)] += 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.bytes += other.bytes
+        self.timed += other.timed
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def percentile(self, pct):
+        if not self.timed:
+            return None
+        rank = math.ceil(self.timed * pct / 100)
+        seen = 0
+        for i, n in enumerate(self.histogram):
+            seen += n
+            if seen >= rank:
+                return histogram_value(i)
+        return histogram_value(HIST_SIZE - 1)
+
+    def to_dict(self):
+        data = {"count": self.count, "bytes": self.bytes}
+        for pct in PERCENTILES:
+            value = self.percentile(pct)
+            data[f"p{pct}"] = None if value is None else round(value, 4)
+        return data
+
+
+class LogStats:
+    def __init__(self, bucket_seconds=60):
+        self.bucket_seconds = bucket_seconds
+        self.lines = 0
+        self.skipped = 0
+        self.routes = {}
+        self.statuses = {}
+        self.clients = Counter()
+        self.buckets = Counter()
+        self.bucket_bytes = Counter()
+        self._minute_cache = {}
+
+    def _epoch(self, time_local):
+        # "10/Oct/2000:13:55:36 -0700"; strptime is the bottleneck so the
+        # epoch of each minute is computed once and cached
+        key = time_local[:17]
+        base = self._minute_cache.get(key + time_local[20:])
+        if base is None:
+            day, month, rest = key.split("/")
+            year, hour, minute = rest.split(":")
+            base = calendar.timegm(
+                (int(year), MONTHS[month], int(day), int(hour), int(minute), 0))
+            tz = time_local[21:26]
+            if tz:
+                offset = int(tz[1:3]) * 3600 + int(tz[3:5]) * 60
+                base -= offset if tz[0] == "+" else -offset
+            self._minute_cache[key + time_local[20:]] = base
+        return base + int(time_local[18:20])
+
+    def add(self, record):
+        size = record["body_bytes_sent"]
+        size = int(size) if size != "-" else 0
+        latency = record.get("request_time")
+        latency = float(latency) if latency and latency != "-" else None
+
+        route = route_for(record["request"])
+        summary = self.routes.get(route)
+        if summary is None:
+            summary = self.routes[route] = Summary()
+        summary.add(size, latency)
+
+        status = record["status"]
+        summary = self.statuses.get(status)
+        if summary is None:
+            summary = self.statuses[status] = Summary()
+        summary.add(size, latency)
+
+        client = record["http_x_forwarded_for"]
+        if not client or client == "-":
+            client = record["remote_addr"]
+        self.clients[client.split(",")[0].strip()] += 1
+
+        bucket = self._epoch(record["time_local"]) // self.bucket_seconds * self.bucket_seconds
+        self.buckets[bucket] += 1
+        self.bucket_bytes[bucket] += size
+
+    def merge(self, other):
+        self.lines += other.lines
+        self.skipped += other.skipped
+        for attr in ("routes", "statuses"):
+            mine = getattr(self, attr)
+            for key, summary in getattr(other, attr).items():
+                if key in mine:
+                    mine[key].merge(summary)
+                else:
+                    mine[key] = summary
+        self.clients.update(other.clients)
+        self.buckets.update(other.buckets)
+        self.bucket_bytes.update(other.bucket_bytes)
+
+    def to_dict(self, top_clients=10):
+        return {
+            "lines": self.lines,
+            "skipped": self.skipped,
+            "routes": {k: v.to_dict() for k, v in sorted(self.routes.items())},
+            "statuses": {k: v.to_dict() for k, v in sorted(self.statuses.items())},
+            "top_clients": self.clients.most_common(top_clients),
+            "throughput": [
+                {
+                    "start": bucket,
+                    "requests": self.buckets[bucket],
+                    "requests_per_second": round(self.buckets[bucket] / self.bucket_seconds, 3),
+                    "bytes": self.bucket_bytes[bucket],
+                }
+                for bucket in sorted(self.buckets)
+            ],
+        }
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_minute_cache"] = {}
+        return state
+
+
+def analyze_file(path, bucket_seconds=60):
+    stats = LogStats(bucket_seconds)
+    match = LOG_PATTERN.match
+    for line in read_lines(path):
+        stats.lines += 1
+        m = match(line)
+        if m is None:
+            stats.skipped += 1
+            continue
+        stats.add(m.groupdict())
+    return stats
+
+
+def analyze_files(paths, bucket_seconds=60, workers=None):
+    """analyze each file in its own process and merge the results"""
+    total = LogStats(bucket_seconds)
+    if workers == 1 or len(paths) <= 1:
+        for path in paths:
+            total.merge(analyze_file(path, bucket_seconds))
+        return total
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        for stats in executor.map(analyze_file, paths, [bucket_seconds] * len(paths)):
+            total.merge(stats)
+    return total
+
+
+def format_report(report):
+    def fmt(value):
+        return "-" if value is None else f"{value * 1000:.0f}ms"
+
+    lines = [f"lines: {report['lines']}  skipped: {report['skipped']}", ""]
+    for title, key in (("route", "routes"), ("status", "statuses")):
+        lines.append(
+            f"{title:<20}{'count':>10}{'bytes':>15}"
+            + "".join(f"{'p' + str(p):>10}" for p in PERCENTILES))
+        for name, row in report[key].items():
+            lines.append(
+                f"{name:<20}{row['count']:>10}{row['bytes']:>15}"
+                + "".join(f"{fmt(row['p' + str(p)]):>10}" for p in PERCENTILES))
+        lines.append("")
+
+    lines.append("top clients")
+    for client, count in report["top_clients"]:
+        lines.append(f"  {client:<40}{count:>10}")
+    lines.append("")
+
+    lines.append(f"{'bucket start (UTC)':<24}{'requests':>10}{'req/s':>10}{'bytes':>15}")
+    for row in report["throughput"]:
+        lines.append(
+            f"{datetime.fromtimestamp(row['start'], timezone.utc):%Y-%m-%d %H:%M:%S}    {row['requests']:>10}{row['requests_per_second']:>10}{row['bytes']:>15}")
+    return "\n".join(lines)
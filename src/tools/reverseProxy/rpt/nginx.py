@@ -0,0 +1,448 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+blocks rendered into templates/nginx.conf
+"""
+
+import hashlib
+
+# upstream name -> Nucleus port, see the port section of nucleus-stack.env
+UPSTREAM_PORTS = {
+    "nucleus_api": 3019,            # API_PORT_2
+    "nucleus_lft": 3030,            # LFT_PORT
+    "nucleus_discovery": 3333,      # DISCOVERY_PORT
+    "nucleus_auth": 3100,           # AUTH_PORT
+    "nucleus_auth_login": 3180,     # AUTH_LOGIN_FORM_PORT
+    "nucleus_web": 8080,            # WEB_PORT
+    "nucleus_tagging": 3020,        # TAGGING_PORT
+    "nucleus_search": 3400,         # SEARCH_PORT
+}
+
+# header a client or connector sets to route by mount rather than by its
+# own address; it has to be sent on every request, API websockets included
+MOUNT_HEADER = "X-Nucleus-Mount"
+# ring points per server, as nginx's own consistent hash
+RING_POINTS = 160
+# split_clients percentages have two decimals
+RING_UNITS = 10000
+
+
+def ring(servers, points=RING_POINTS):
+    """[(units, server index)] buckets of a consistent hash ring over servers
+
+    split_clients hashes the key to 0-100% and picks the entry whose
+    cumulative range covers it. The buckets are the arcs between ring points
+    placed by server address alone, so the range boundaries of the existing
+    servers stay put when a server is added: only keys on the arcs in front
+    of its new points move, ~1/N of them, all to the new server.
+    """
+    ring_points = sorted(
+        (int.from_bytes(hashlib.md5(f"{server}-{i}".encode()).digest()[:4], "big") * RING_UNITS >> 32, index)
+        for index, server in enumerate(servers)
+        for i in range(points)
+    )
+    buckets, start = [], 0
+    for position, index in ring_points:
+        if position > start:
+            if buckets and buckets[-1][1] == index:
+                buckets[-1] = (buckets[-1][0] + position - start, index)
+            else:
+                buckets.append((position - start, index))
+            start = position
+    # past the last point wraps around to the first
+    buckets.append((RING_UNITS - start, ring_points[0][1]))
+    return buckets
+
+
+def render_upstreams(servers):
+    """upstreams per Nucleus service and server, and $<service> naming the
+    one a request goes to
+
+    With more than one server, $nucleus_route_key is placed once on a
+    consistent hash ring of the server addresses (split_clients) and every
+    service proxies to the server picked there, so all requests with the
+    same key land on the same server for api, lft, auth and the rest, and on
+    every proxy. The key is the X-Nucleus-Mount header if present, otherwise
+    the client address from X-Forwarded-For, see render_real_ip. It is never
+    taken from the URI: API websockets carry no mount in their path, and
+    keying only file requests by mount would split a client's session
+    across servers. Mount affinity therefore needs the header on every
+    request. The next server in sorted order is the backup if the picked one
+    is down.
+    """
+    if not servers:
+        raise Exception("ERROR: At least one Nucleus server address is required")
+
+    # sorted so every proxy renders an identical ring
+    servers = sorted(set(servers))
+    lines = []
+
+    if len(servers) > 1:
+        header_variable = "$http_" + MOUNT_HEADER.lower().replace("-", "_")
+        lines += [
+            "    # Multi-Nucleus routing key, see rpt/nginx.py",
+            f"    map {header_variable} $nucleus_route_key {{",
+            '        "" $remote_addr;',
+            f"        default {header_variable};",
+            "    }",
+            "",
+            "    # server index, picked once for every service",
+            '    split_clients "$nucleus_route_key" $nucleus_server {',
+        ]
+        buckets = ring(servers)
+        lines += [f"        {units / 100:.2f}% {index};" for units, index in buckets[:-1]]
+        lines += [f"        * {buckets[-1][1]};", "    }", ""]
+    else:
+        lines += ["    geo $nucleus_server {", "        default 0;", "    }", ""]
+
+    for name, port in UPSTREAM_PORTS.items():
+        lines.append(f"    map $nucleus_server ${name} {{")
+        lines += [f"        {index} {name}_{index};" for index in range(len(servers))]
+        lines += ["    }", ""]
+        for index, server in enumerate(servers):
+            lines.append(f"    upstream {name}_{index} {{")
+            lines.append(f"        server {server}:{port};")
+            if len(servers) > 1:
+                backup = servers[(index + 1) % len(servers)]
+                lines.append(f"        server {backup}:{port} backup;")
+            lines += ["    }", ""]
+
+    return "\n".join(lines).rstrip()
+
+
+# stanza the ACM for Nitro Enclaves service writes, see templates/acm.yaml
+ACM_STANZA_PATH = "/etc/pki/nginx/nginx-acm.conf"
+SESSION_TICKET_DIR = "/etc/nginx/tickets"
+SESSION_TICKET_KEYS = 3
+# Amazon provided DNS, reachable from every VPC
+VPC_RESOLVER = "169.254.169.253"
+
+
+def render_main_directives(tls=False, acm=True):
+    if tls and acm:
+        # private key stays in the enclave, nginx signs through PKCS#11
+        return "ssl_engine pkcs11;"
+    return ""
+
+
+def render_listen(tls=False):
+    lines = [
+        "        listen       80;",
+        "        listen       [::]:80;",
+    ]
+    if tls:
+        lines += [
+            "        listen       443 ssl http2;",
+            "        listen       [::]:443 ssl http2;",
+        ]
+    return "\n".join(lines)
+
+
+def render_tls(tls=False, certificate=None, certificate_key=None, trusted_certificate=None,
+               ticket_dir=SESSION_TICKET_DIR, ticket_keys=SESSION_TICKET_KEYS,
+               session_cache_mb=50, resolver=VPC_RESOLVER):
+    """server level TLS directives, empty unless tls
+
+    Without certificate/certificate_key the ACM for Nitro Enclaves stanza is
+    included. Resumption uses both a shared session cache (TLS 1.2 session
+    ids, ~4000 sessions per MB) and session tickets encrypted with the first
+    of `ticket_keys` rotated key files; the others only decrypt tickets
+    issued before the last rotation.
+    """
+    if not tls:
+        return ""
+
+    if certificate and certificate_key:
+        lines = [
+            f"        ssl_certificate     {certificate};",
+            f"        ssl_certificate_key {certificate_key};",
+        ]
+    else:
+        lines = [f'        include "{ACM_STANZA_PATH}";']
+
+    lines += [
+        "        ssl_protocols TLSv1.2 TLSv1.3;",
+        "        ssl_prefer_server_ciphers off;",
+        "",
+        "        # resumption: skip the full handshake for reconnecting clients",
+        f"        ssl_session_cache shared:SSL:{session_cache_mb}m;",
+        "        ssl_session_timeout 1d;",
+        "        ssl_session_tickets on;",
+    ]
+    lines += [
+        f"        ssl_session_ticket_key {ticket_dir}/ticket.{i}.key;"
+        for i in range(ticket_keys)
+    ]
+    lines += [
+        "",
+        "        # OCSP stapling saves clients a round trip to the CA",
+        "        ssl_stapling on;",
+    ]
+    if trusted_certificate:
+        lines += [
+            "        ssl_stapling_verify on;",
+            f"        ssl_trusted_certificate {trusted_certificate};",
+        ]
+    lines += [
+        f"        resolver {resolver} valid=300s;",
+        "        resolver_timeout 5s;",
+        "",
+        "        # small TLS records get the first bytes to interactive clients",
+        "        # sooner; large transfers are unaffected once the window opens",
+        "        ssl_buffer_size 4k;",
+        "        http2_max_concurrent_streams 256;",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+# compressible Navigator responses; text/html is always compressed by gzip
+GZIP_TYPES = [
+    "text/css",
+    "text/plain",
+    "text/javascript",
+    "application/javascript",
+    "application/json",
+    "application/manifest+json",
+    "application/wasm",
+    "image/svg+xml",
+    "font/ttf",
+    "font/otf",
+]
+GZIP_LEVEL = 5
+GZIP_MIN_LENGTH = 1024
+
+# bundler output with a content hash in the name, e.g. main.3f2a9c1d.js,
+# safe to cache forever since a new build changes the name. Matches both
+# $uri and $request_uri, which keeps the query string
+HASHED_ASSET_PATTERN = (
+    r"^/omni/web2/.+[.-][0-9a-f]{8,}\.(?:js|mjs|css|map|woff2?|ttf|otf|eot|svg|png|jpe?g|gif|webp|ico|wasm)(?:\?|$)"
+)
+IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+
+
+def render_navigator_maps(compression=False):
+    """http level map picking Cache-Control for Navigator responses
+
+    Keyed on $request_uri: add_header reads the map after the Navigator
+    locations rewrite $uri to the path Nucleus serves.
+    """
+    if not compression:
+        return ""
+    return "\n".join([
+        "    # Navigator caching, hashed assets are immutable, everything else",
+        "    # keeps the Cache-Control sent by Nucleus",
+        "    map $request_uri $navigator_cache_control {",
+        f'        "~*{HASHED_ASSET_PATTERN}" "{IMMUTABLE_CACHE_CONTROL}";',
+        "        default $upstream_http_cache_control;",
+        "    }",
+        "",
+    ])
+
+
+def _gzip_lines(indent, gzip_level):
+    pad = " " * indent
+    return [
+        f"{pad}gzip on;",
+        f"{pad}gzip_comp_level {gzip_level};",
+        f"{pad}gzip_min_length {GZIP_MIN_LENGTH};",
+        f"{pad}gzip_proxied any;",
+        f"{pad}gzip_vary on;",
+        f"{pad}gzip_types {' '.join(GZIP_TYPES)};",
+        f"{pad}proxy_hide_header Cache-Control;",
+        f"{pad}add_header Cache-Control $navigator_cache_control;",
+    ]
+
+
+def render_navigator(compression=False, gzip_level=GZIP_LEVEL, static_root=None):
+    """directives inside `location /omni/web2/`
+
+    Only this location gets them, so API, LFT and the other websocket routes
+    stay uncompressed. With static_root, hashed assets are served from disk,
+    using `<file>.gz` from `rpt precompress-assets` when present, and fall
+    back to Nucleus through @navigator.
+    """
+    if not compression:
+        return ""
+
+    lines = ["", "            # compression profile, see rpt/nginx.py"]
+    lines += _gzip_lines(12, gzip_level)
+    if static_root:
+        lines += [
+            "",
+            f'            location ~* "{HASHED_ASSET_PATTERN}" {{',
+            f"                root {static_root};",
+            "                gzip_static on;",
+            f'                add_header Cache-Control "{IMMUTABLE_CACHE_CONTROL}";',
+            "                try_files $uri @navigator;",
+            "            }",
+        ]
+    return "\n".join(lines)
+
+
+def render_navigator_fallback(compression=False, gzip_level=GZIP_LEVEL, static_root=None):
+    """server level @navigator, proxying assets missing from static_root"""
+    if not (compression and static_root):
+        return ""
+
+    lines = [
+        "        location @navigator {",
+        "            rewrite ^/omni/web2/(.*)$ /$1 break;",
+        "            proxy_pass http://$nucleus_web;",
+        "            proxy_http_version 1.1;",
+        "            proxy_read_timeout 60s;",
+        "            proxy_set_header Host $http_host;",
+    ]
+    lines += _gzip_lines(12, gzip_level)
+    lines += ["        }", ""]
+    return "\n".join(lines)
+
+
+# route class -> per client (requests/s, burst, concurrent connections)
+LIMIT_CLASSES = {
+    "api": (20, 50, 32),     # /omni/api, discovery, tagging, search: websocket upgrades and calls
+    "auth": (5, 20, 8),      # /omni/auth and the login form
+    "lft": (50, 200, 32),    # /omni/lft/ file transfers
+    "web": (50, 200, 32),    # /omni/web2/, a Navigator page load fetches many assets at once
+}
+LIMIT_POLICIES = ["reject", "queue"]
+LIMIT_STATUS = 429
+# the VPC, where the load balancer that appends X-Forwarded-For lives
+TRUSTED_PROXIES = ["10.0.0.0/16"]
+
+
+def parse_limit(spec):
+    """`class=rate[:burst[:connections]]` -> (class, (rate, burst, connections))"""
+    name, _, values = spec.partition("=")
+    if name not in LIMIT_CLASSES or not values:
+        raise Exception(f"ERROR: Invalid limit {spec!r}, expected one of {list(LIMIT_CLASSES)}=rate[:burst[:connections]]")
+    defaults = LIMIT_CLASSES[name]
+    parts = values.split(":")
+    try:
+        numbers = [int(p) for p in parts] + list(defaults[len(parts):])
+    except ValueError:
+        raise Exception(f"ERROR: Invalid limit {spec!r}, rate, burst and connections are integers")
+    if len(numbers) != 3 or min(numbers) < 0 or numbers[0] == 0:
+        raise Exception(f"ERROR: Invalid limit {spec!r}")
+    return name, tuple(numbers)
+
+
+def render_real_ip(trusted_proxies=None):
+    """http level $remote_addr from X-Forwarded-For, set by the load balancer
+
+    Needed wherever the client address matters: the per client limits and
+    the multi-Nucleus routing key of requests without a mount. Without it
+    $remote_addr is the load balancer node.
+    """
+    if not trusted_proxies:
+        return ""
+    lines = ["    # client address behind the load balancer, see rpt/nginx.py"]
+    lines += [f"    set_real_ip_from {cidr};" for cidr in trusted_proxies]
+    lines += [
+        "    real_ip_header X-Forwarded-For;",
+        "    real_ip_recursive on;",
+        "",
+    ]
+    return "\n".join(lines)
+
+
+def render_limit_zones(limits=None, allowlist=(), dry_run=False):
+    """http level zones for the per client limits
+
+    Clients are keyed by their address, which render_real_ip takes from
+    X-Forwarded-For, so the limits apply to users and not to the load
+    balancer. Addresses in allowlist, e.g. the hosts running service account
+    connectors, get an empty key, which nginx does not count.
+    """
+    if not limits:
+        return ""
+
+    lines = [
+        "    # per client limits, see rpt/nginx.py",
+        "    geo $limit_exempt {",
+        "        default 0;",
+    ]
+    lines += [f"        {cidr} 1;" for cidr in allowlist]
+    lines += [
+        "    }",
+        "",
+        "    map $limit_exempt $limit_key {",
+        '        1 "";',
+        "        default $binary_remote_addr;",
+        "    }",
+        "",
+    ]
+    for name in limits:
+        rate = limits[name][0]
+        lines.append(f"    limit_req_zone $limit_key zone={name}_req:10m rate={rate}r/s;")
+        lines.append(f"    limit_conn_zone $limit_key zone={name}_conn:10m;")
+    lines += [
+        "",
+        f"    limit_req_status {LIMIT_STATUS};",
+        f"    limit_conn_status {LIMIT_STATUS};",
+        "    limit_req_log_level warn;",
+        "    limit_conn_log_level warn;",
+    ]
+    if dry_run:
+        # log what would be limited without limiting
+        lines += ["    limit_req_dry_run on;", "    limit_conn_dry_run on;"]
+    lines.append("")
+    return "\n".join(lines)
+
+
+def render_limited_location(limits=None):
+    """server level 429 response with Retry-After"""
+    if not limits:
+        return ""
+    return "\n".join([
+        f"        error_page {LIMIT_STATUS} @limited;",
+        "        location @limited {",
+        "            default_type application/json;",
+        "            add_header Retry-After 1 always;",
+        f"            return {LIMIT_STATUS} '{{\"error\": \"too many requests\"}}';",
+        "        }",
+        "",
+    ])
+
+
+def render_limits(route_class, limits=None, policy="reject"):
+    """limit_req/limit_conn inside the locations of route_class
+
+    reject: a client may send `burst` requests over the rate at once, any
+    more get 429 right away. queue: requests over the rate wait their turn,
+    up to `burst` of them, which smooths spikes at the cost of latency.
+    """
+    if not limits or route_class not in limits:
+        return ""
+    _, burst, connections = limits[route_class]
+    lines = [f"            limit_req zone={route_class}_req burst={burst}{' nodelay' if policy == 'reject' else ''};"]
+    if connections:
+        lines.append(f"            limit_conn {route_class}_conn {connections};")
+    return "\n".join(lines)
+
+
+def render_config(template, domain, servers, tls=False, certificate=None, certificate_key=None,
+                  trusted_certificate=None, ticket_dir=SESSION_TICKET_DIR, compression=False,
+                  gzip_level=GZIP_LEVEL, static_root=None, limits=None, policy="reject", allowlist=(),
+                  trusted_proxies=TRUSTED_PROXIES, dry_run=False):
+    """templates/nginx.conf with every block rendered"""
+    acm = certificate is None
+    # both key on the client address
+    real_ip = bool(limits) or len(set(servers)) > 1
+    return template.format(PUBLIC_DOMAIN=domain,
+                           UPSTREAMS=render_upstreams(servers),
+                           MAIN_DIRECTIVES=render_main_directives(tls, acm),
+                           LISTEN=render_listen(tls),
+                           TLS=render_tls(tls, certificate, certificate_key, trusted_certificate, ticket_dir),
+                           NAVIGATOR_MAPS=render_navigator_maps(compression),
+                           NAVIGATOR=render_navigator(compression, gzip_level, static_root),
+                           NAVIGATOR_FALLBACK=render_navigator_fallback(compression, gzip_level, static_root),
+                           REAL_IP=render_real_ip(trusted_proxies if real_ip else None),
+                           LIMIT_ZONES=render_limit_zones(limits, allowlist, dry_run),
+                           LIMITED=render_limited_location(limits),
+                           LIMITS_API=render_limits("api", limits, policy),
+                           LIMITS_AUTH=render_limits("auth", limits, policy),
+                           LIMITS_LFT=render_limits("lft", limits, policy),
+                           LIMITS_WEB=render_limits("web", limits, policy))
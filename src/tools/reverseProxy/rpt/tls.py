@@ -0,0 +1,271 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+"""
+session ticket keys, self-signed certificates and a TLS handshake benchmark
+for the profile rendered by `rpt generate-nginx-config --tls`
+"""
+
+import os
+import re
+import ssl
+import math
+import time
+import shutil
+import socket
+import subprocess
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+import ovetools.logger as logger
+from rpt.nginx import SESSION_TICKET_DIR, SESSION_TICKET_KEYS
+
+# 80 byte keys select AES-256 for ticket encryption
+TICKET_KEY_BYTES = 80
+
+REQUEST = b"GET /healthcheck HTTP/1.1\r\nHost: %s\r\nConnection: close\r\n\r\n"
+
+
+def _ticket_path(ticket_dir, i):
+    return Path(ticket_dir) / f"ticket.{i}.key"
+
+
+def _write_key(path):
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, "wb") as file:
+        file.write(os.urandom(TICKET_KEY_BYTES))
+
+
+def ensure_ticket_keys(ticket_dir=SESSION_TICKET_DIR, keys=SESSION_TICKET_KEYS):
+    """create any missing key file so `nginx -t` passes on first render"""
+    Path(ticket_dir).mkdir(mode=0o700, parents=True, exist_ok=True)
+    for i in range(keys):
+        path = _ticket_path(ticket_dir, i)
+        if not path.is_file():
+            _write_key(path)
+            logger.info(f"Created session ticket key: {path}")
+
+
+def rotate_ticket_keys(ticket_dir=SESSION_TICKET_DIR, keys=SESSION_TICKET_KEYS):
+    """shift every key down one slot and put a fresh key in slot 0
+
+    nginx encrypts new tickets with ticket.0.key and still accepts tickets
+    encrypted with the older ones, so clients resume across a rotation as
+    long as it happens less often than every `keys` ticket lifetimes.
+    """
+    ensure_ticket_keys(ticket_dir, keys)
+    for i in reversed(range(1, keys)):
+        os.replace(_ticket_path(ticket_dir, i - 1), _ticket_path(ticket_dir, i))
+    _write_key(_ticket_path(ticket_dir, 0))
+    logger.info(f"Rotated {keys} session ticket keys in {ticket_dir}")
+
+
+# tickets are accepted for ssl_session_timeout (1d), and a key keeps
+# decrypting them for SESSION_TICKET_KEYS - 1 rotations after it stops
+# issuing them, so rotating every 12h resumes every ticket until it expires
+ROTATION_UNIT = "rpt-rotate-session-tickets"
+ROTATION_CALENDAR = "*-*-* 00/12:00:00"
+
+
+def install_rotation_timer(ticket_dir=SESSION_TICKET_DIR, calendar=ROTATION_CALENDAR,
+                           unit_dir="/etc/systemd/system"):
+    """systemd timer running `rpt rotate-session-tickets` on `calendar`"""
+    rpt = shutil.which("rpt") or "/usr/bin/rpt"
+    units = {
+        f"{ROTATION_UNIT}.service": "\n".join([
+            "[Unit]",
+            "Description=Rotate the nginx TLS session ticket keys",
+            "",
+            "[Service]",
+            "Type=oneshot",
+            f"ExecStart={rpt} rotate-session-tickets --ticket-dir {ticket_dir}",
+            "",
+        ]),
+        f"{ROTATION_UNIT}.timer": "\n".join([
+            "[Unit]",
+            "Description=Rotate the nginx TLS session ticket keys",
+            "",
+            "[Timer]",
+            f"OnCalendar={calendar}",
+            "Persistent=true",
+            "",
+            "[Install]",
+            "WantedBy=timers.target",
+            "",
+        ]),
+    }
+    for name, content in units.items():
+        (Path(unit_dir) / name).write_text(content)
+    subprocess.run(["systemctl", "daemon-reload"], check=True)
+    subprocess.run(["systemctl", "enable", "--now", f"{ROTATION_UNIT}.timer"], check=True)
+    logger.info(f"Installed {ROTATION_UNIT}.timer, {calendar=}")
+
+
+def generate_self_signed(out_dir, common_name="localhost", days=30):
+    """self-signed certificate and key via the openssl cli, returns both paths"""
+    Path(out_dir).mkdir(parents=True, exist_ok=True)
+    certificate = str(Path(out_dir) / "self-signed.crt")
+    certificate_key = str(Path(out_dir) / "self-signed.key")
+    subprocess.run(
+        ["openssl", "req", "-x509", "-nodes", "-newkey", "ec",
+         "-pkeyopt", "ec_paramgen_curve:prime256v1",
+         "-keyout", certificate_key, "-out", certificate,
+         "-days", str(days), "-subj", f"/CN={common_name}"],
+        check=True, capture_output=True,
+    )
+    return certificate, certificate_key
+
+
+# rendered config -> local copy, see LocalNginx
+LOCAL_TEMP_PATHS = ["client_body", "proxy", "fastcgi", "uwsgi", "scgi"]
+
+
+def local_config(config, workdir, host, http_port, https_port):
+    """a rendered nginx.conf moved to loopback ports, with pid, logs, temp
+    files in workdir and without /etc/nginx/conf.d, so it runs next to the
+    installed nginx and without root"""
+    replacements = [
+        (r"^pid .*;$", f"pid {workdir}/nginx.pid;"),
+        (r"^error_log .*;$", f"error_log {workdir}/error.log;"),
+        (r"^(\s*)access_log .*;$", rf"\g<1>access_log {workdir}/access.log main;"),
+        (r"^\s*include /etc/nginx/conf\.d/.*;$", ""),
+        (r"^(\s*)listen\s+80;$", rf"\g<1>listen {host}:{http_port};"),
+        (r"^(\s*)listen\s+443 (.*);$", rf"\g<1>listen {host}:{https_port} \g<2>;"),
+        (r"^\s*listen\s+\[::\].*;$", ""),
+    ]
+    for pattern, replacement in replacements:
+        config = re.sub(pattern, replacement, config, flags=re.M)
+    temp_paths = "".join(f"\n    {name}_temp_path {workdir}/{name};" for name in LOCAL_TEMP_PATHS)
+    return re.sub(r"^http {", "http {" + temp_paths, config, count=1, flags=re.M)
+
+
+def _free_port(host):
+    with socket.socket() as probe:
+        probe.bind((host, 0))
+        return probe.getsockname()[1]
+
+
+class LocalNginx:
+    """nginx running a config rendered by `rpt generate-nginx-config`, moved
+    to loopback ports by local_config, so the benchmark exercises the real
+    session cache, tickets and TLS settings of the profile"""
+
+    def __init__(self, config, workdir, host="127.0.0.1", startup_timeout=10):
+        self.host = host
+        self.port = _free_port(host)
+        self.workdir = str(workdir)
+        self.startup_timeout = startup_timeout
+        self.config_path = Path(workdir) / "nginx.conf"
+        self.config_path.write_text(local_config(config, self.workdir, host, _free_port(host), self.port))
+        self.process = None
+
+    def __enter__(self):
+        self.process = subprocess.Popen(
+            ["nginx", "-p", self.workdir, "-c", str(self.config_path), "-g", "daemon off;"],
+            stderr=subprocess.PIPE, text=True)
+        deadline = time.monotonic() + self.startup_timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise Exception(f"ERROR: nginx exited with {self.process.returncode}: {self.process.stderr.read()}")
+            try:
+                socket.create_connection((self.host, self.port), timeout=1).close()
+                return self
+            except OSError:
+                time.sleep(0.1)
+        self.__exit__()
+        raise Exception(f"ERROR: nginx did not listen on {self.host}:{self.port} within {self.startup_timeout}s")
+
+    def __exit__(self, *args):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+
+def _percentile(values, pct):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[max(math.ceil(len(values) * pct / 100) - 1, 0)]
+
+
+def _worker(host, port, server_name, context, resume, deadline):
+    handshakes = []
+    resumed = 0
+    errors = 0
+    session = None
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=10) as raw:
+                raw.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                started = time.perf_counter()
+                with context.wrap_socket(raw, server_hostname=server_name,
+                                         session=session if resume else None) as tls:
+                    handshakes.append(time.perf_counter() - started)
+                    resumed += tls.session_reused
+                    tls.sendall(REQUEST % server_name.encode())
+                    # TLS 1.3 tickets arrive after the handshake, read the
+                    # response so the session is resumable
+                    while tls.recv(4096):
+                        pass
+                    session = tls.session
+        except (OSError, ssl.SSLError) as e:
+            errors += 1
+            logger.debug(f"handshake failed: {e}")
+    return handshakes, resumed, errors
+
+
+def benchmark_handshakes(host, port, server_name=None, duration=10, concurrency=8,
+                         resume=False, tls_version=None, verify=False):
+    """connections per second with a full or resumed handshake each
+
+    Every connection does a TCP connect, the TLS handshake (timed) and one
+    /healthcheck request, so the rate is what a fleet of reconnecting
+    clients would cost the proxy.
+    """
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+    context.set_alpn_protocols(["http/1.1"])
+    if not verify:
+        context.check_hostname = False
+        context.verify_mode = ssl.CERT_NONE
+    if tls_version:
+        version = ssl.TLSVersion.TLSv1_3 if tls_version == "1.3" else ssl.TLSVersion.TLSv1_2
+        context.minimum_version = context.maximum_version = version
+
+    server_name = server_name or host
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(
+            lambda _: _worker(host, port, server_name, context, resume, deadline),
+            range(concurrency)))
+    elapsed = time.monotonic() - started
+
+    handshakes = [h for result in results for h in result[0]]
+    resumed = sum(result[1] for result in results)
+    report = {
+        "mode": "resumed" if resume else "full",
+        "tls_version": tls_version or "negotiated",
+        "concurrency": concurrency,
+        "duration": round(elapsed, 2),
+        "connections": len(handshakes),
+        "errors": sum(result[2] for result in results),
+        "connections_per_second": round(len(handshakes) / elapsed, 1) if elapsed else 0,
+        "resumed_ratio": round(resumed / len(handshakes), 3) if handshakes else 0,
+    }
+    for pct in (50, 90, 99):
+        value = _percentile(handshakes, pct)
+        report[f"handshake_p{pct}_ms"] = None if value is None else round(value * 1000, 2)
+    return report
+
+
+def format_report(reports):
+    columns = ["mode", "tls_version", "connections_per_second", "resumed_ratio",
+               "handshake_p50_ms", "handshake_p90_ms", "handshake_p99_ms", "errors"]
+    lines = ["".join(f"{c:>24}" for c in columns)]
+    for report in reports:
+        lines.append("".join(f"{str(report[c]):>24}" for c in columns))
+    return "\n".join(lines)
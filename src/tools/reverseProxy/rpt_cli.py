@@ -8,13 +8,21 @@ helper tools for reverse proxy nginx configuration
 
 # std lib modules
 import os
+import json
 import logging
+import tempfile
+import subprocess
 from pathlib import Path
 
 # 3rd party modules
 import click
 
-import rpt.logger as logger
+import ovetools.logger as logger
+import rpt.logs as logs
+import rpt.nginx as nginx
+import rpt.tls as tls
+import rpt.compression as compression
+import rpt.loadtest as loadtest
 
 pass_config = click.make_pass_decorator(object, ensure=True)
 
@@ -60,9 +68,48 @@ def generate_acm_yaml(config, cert_arn):
 @main.command()
 @pass_config
 @click.option("--domain", required=True)
-@click.option("--server-address", required=True)
-def generate_nginx_config(config, domain, server_address):
-    logger.info(f'generate_nginx_config: {domain=}')
+@click.option("--server-address", "server_addresses", required=True, multiple=True,
+              help="Nucleus server, repeat for a multi-Nucleus fleet")
+@click.option("--output-path", default="/etc/nginx/nginx.conf", show_default=True,
+              help="write somewhere else to validate with `nginx -t -c` before swapping it in")
+@click.option("--tls/--no-tls", "tls_enabled", default=False, show_default=True,
+              help="also terminate TLS on 443 with HTTP/2 and session resumption")
+@click.option("--certificate", default=None,
+              help="certificate chain, defaults to the ACM for Nitro Enclaves stanza")
+@click.option("--certificate-key", default=None)
+@click.option("--trusted-certificate", default=None,
+              help="CA chain, enables ssl_stapling_verify")
+@click.option("--ticket-dir", default=nginx.SESSION_TICKET_DIR, show_default=True)
+@click.option("--compression/--no-compression", default=False, show_default=True,
+              help="gzip and immutable caching of hashed assets on the Navigator route")
+@click.option("--gzip-level", default=nginx.GZIP_LEVEL, show_default=True, type=click.IntRange(1, 9))
+@click.option("--static-root", default=None,
+              help="serve hashed Navigator assets from here, see precompress-assets")
+@click.option("--limits/--no-limits", default=False, show_default=True,
+              help="per client limit_req/limit_conn on the api, auth, lft and web routes")
+@click.option("--limit", "limit_specs", multiple=True,
+              help="override a route class, class=rate[:burst[:connections]], e.g. lft=100:400:64")
+@click.option("--limit-policy", type=click.Choice(nginx.LIMIT_POLICIES), default="reject", show_default=True,
+              help="reject requests over the burst right away, or queue them")
+@click.option("--limit-allow", "limit_allowlist", multiple=True,
+              help="address or CIDR never limited, e.g. service account connector hosts")
+@click.option("--trusted-proxy", "trusted_proxies", multiple=True, default=nginx.TRUSTED_PROXIES,
+              show_default=True, help="load balancer addresses whose X-Forwarded-For is trusted")
+@click.option("--limit-dry-run", is_flag=True, default=False, help="only log requests that would be limited")
+def generate_nginx_config(config, domain, server_addresses, output_path,
+                          tls_enabled, certificate, certificate_key, trusted_certificate, ticket_dir,
+                          compression, gzip_level, static_root, limits, limit_specs, limit_policy,
+                          limit_allowlist, trusted_proxies, limit_dry_run):
+    logger.info(f'generate_nginx_config: {domain=}, {server_addresses=}, {tls_enabled=}, {limits=}')
+
+    if bool(certificate) != bool(certificate_key):
+        raise Exception("ERROR: --certificate and --certificate-key must be given together")
+
+    route_limits = None
+    if limits:
+        route_limits = dict(nginx.LIMIT_CLASSES)
+        route_limits.update(nginx.parse_limit(spec) for spec in limit_specs)
+        logger.info(f"Limits (requests/s, burst, connections): {route_limits}, {limit_policy=}")
 
     nginx_template_path = os.path.join(
         os.getcwd(), 'templates', 'nginx.conf')
@@ -72,21 +119,185 @@ def generate_nginx_config(config, domain, server_address):
         raise Exception(
             f"ERROR: No NGINX template found at: {nginx_template_path}")
 
-    output_path = f'/etc/nginx/nginx.conf'
-    if Path(output_path).is_file():
-        logger.info(f"NGINX default configuration found at: {output_path}")
+    default_path = f'/etc/nginx/nginx.conf'
+    if Path(default_path).is_file():
+        logger.info(f"NGINX default configuration found at: {default_path}")
     else:
         raise Exception(
-            f"ERROR: No NGINX default configuration found at: {output_path}. Verify NGINX installation.")
+            f"ERROR: No NGINX default configuration found at: {default_path}. Verify NGINX installation.")
 
     data = ''
     with open(nginx_template_path, 'r') as file:
         data = file.read()
 
-    data = data.format(PUBLIC_DOMAIN=domain,
-                       NUCLEUS_SERVER_DOMAIN=server_address)
+    if tls_enabled:
+        tls.ensure_ticket_keys(ticket_dir)
+
+    data = nginx.render_config(data, domain, server_addresses, tls_enabled, certificate, certificate_key,
+                               trusted_certificate, ticket_dir, compression, gzip_level, static_root,
+                               route_limits, limit_policy, limit_allowlist, trusted_proxies, limit_dry_run)
 
     with open(output_path, 'w') as file:
         file.write(data)
 
     logger.info(output_path)
+
+
+@main.command()
+@pass_config
+@click.option("--ticket-dir", default=nginx.SESSION_TICKET_DIR, show_default=True)
+@click.option("--reload/--no-reload", default=True, show_default=True,
+              help="reload nginx so the new key is used for new tickets")
+def rotate_session_tickets(config, ticket_dir, reload):
+    logger.info(f'rotate_session_tickets: {ticket_dir=}')
+
+    tls.rotate_ticket_keys(ticket_dir)
+    if reload:
+        subprocess.run(["nginx", "-s", "reload"], check=True)
+
+
+@main.command()
+@pass_config
+@click.option("--ticket-dir", default=nginx.SESSION_TICKET_DIR, show_default=True)
+@click.option("--on-calendar", "calendar", default=tls.ROTATION_CALENDAR, show_default=True,
+              help="systemd calendar expression for the rotation")
+def install_ticket_rotation(config, ticket_dir, calendar):
+    logger.info(f'install_ticket_rotation: {ticket_dir=}, {calendar=}')
+
+    tls.install_rotation_timer(ticket_dir, calendar)
+
+
+@main.command()
+@pass_config
+@click.option("--host", default="127.0.0.1", show_default=True)
+@click.option("--port", default=443, show_default=True)
+@click.option("--server-name", default=None, help="SNI name, defaults to --host")
+@click.option("--duration", default=10, show_default=True, help="seconds per mode")
+@click.option("--concurrency", default=8, show_default=True)
+@click.option("--tls-version", type=click.Choice(["1.2", "1.3"]), default=None,
+              help="pin the protocol version, defaults to negotiating")
+@click.option("--local-server", is_flag=True, default=False,
+              help="benchmark nginx running the rendered TLS profile with a throwaway self-signed certificate")
+@click.option("--output-format", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def benchmark_tls(config, host, port, server_name, duration, concurrency, tls_version,
+                  local_server, output_format):
+    logger.info(f'benchmark_tls: {host=}, {port=}, {concurrency=}, {local_server=}')
+
+    def run(host, port):
+        return [
+            tls.benchmark_handshakes(host, port, server_name, duration, concurrency,
+                                     resume, tls_version)
+            for resume in (False, True)
+        ]
+
+    if local_server:
+        with open(os.path.join(os.getcwd(), 'templates', 'nginx.conf'), 'r') as file:
+            template = file.read()
+        with tempfile.TemporaryDirectory() as tmp:
+            certificate, certificate_key = tls.generate_self_signed(tmp)
+            ticket_dir = os.path.join(tmp, "tickets")
+            tls.ensure_ticket_keys(ticket_dir)
+            data = nginx.render_config(template, "localhost", ["127.0.0.1"], tls=True, certificate=certificate,
+                                       certificate_key=certificate_key, ticket_dir=ticket_dir)
+            with tls.LocalNginx(data, tmp) as server:
+                server_name = server_name or "localhost"
+                reports = run(server.host, server.port)
+    else:
+        reports = run(host, port)
+
+    if output_format == "json":
+        click.echo(json.dumps(reports, indent=2))
+    else:
+        click.echo(tls.format_report(reports))
+
+
+@main.command()
+@pass_config
+@click.argument("root", type=click.Path(exists=True, file_okay=False))
+@click.option("--level", default=9, show_default=True, type=click.IntRange(1, 9))
+def precompress_assets(config, root, level):
+    logger.info(f'precompress_assets: {root=}, {level=}')
+
+    written, before, after = compression.precompress(root, level)
+    logger.info(f"Wrote {written} .gz file(s), compressible assets {before} -> {after} bytes")
+
+
+@main.command()
+@pass_config
+@click.option("--access-log", "access_logs", multiple=True, type=click.Path(exists=True, dir_okay=False),
+              help="replay the Navigator requests found in these logs")
+@click.option("--path", "paths", multiple=True, help="Navigator path to replay, e.g. /omni/web2/main.js")
+@click.option("--asset-root", default=None, type=click.Path(exists=True, file_okay=False),
+              help="estimate from a local copy of the Navigator assets")
+@click.option("--base-url", default=None, help="measure a running proxy instead, e.g. https://nucleus.example.com")
+@click.option("--gzip-level", default=nginx.GZIP_LEVEL, show_default=True, type=click.IntRange(1, 9))
+@click.option("--output-format", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def replay_assets(config, access_logs, paths, asset_root, base_url, gzip_level, output_format):
+    logger.info(f'replay_assets: {asset_root=}, {base_url=}')
+
+    if bool(asset_root) == bool(base_url):
+        raise Exception("ERROR: Exactly one of --asset-root and --base-url is required")
+
+    paths = list(paths) + compression.paths_from_logs(access_logs)
+    if not paths:
+        raise Exception("ERROR: No Navigator paths given, use --path or --access-log")
+
+    report = compression.replay(paths, asset_root, base_url, gzip_level)
+
+    if output_format == "json":
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(compression.format_report(report))
+
+
+@main.command()
+@pass_config
+@click.argument("paths", nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option("--bucket-seconds", default=60, show_default=True, help="throughput bucket size")
+@click.option("--top-clients", default=10, show_default=True)
+@click.option("--workers", default=None, type=int, help="worker processes, defaults to cpu count")
+@click.option("--output-format", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def analyze_logs(config, paths, bucket_seconds, top_clients, workers, output_format):
+    logger.info(f'analyze_logs: {len(paths)} file(s), {workers=}')
+
+    stats = logs.analyze_files(list(paths), bucket_seconds, workers)
+    report = stats.to_dict(top_clients)
+
+    if output_format == "json":
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(logs.format_report(report))
+
+
+@main.command()
+@pass_config
+@click.option("--url", default=None, help="route to load, e.g. http://127.0.0.1/omni/lft/some/file")
+@click.option("--clients", default=8, show_default=True, help="well-behaved clients")
+@click.option("--rate", default=5.0, show_default=True, help="requests/s per well-behaved client")
+@click.option("--noisy-connections", default=64, show_default=True,
+              help="connections the noisy client floods the route over")
+@click.option("--duration", default=20, show_default=True, help="seconds per phase")
+@click.option("--local-backend", is_flag=True, default=False,
+              help="run a capacity limited stand-in for Nucleus, loaded directly unless --url is given")
+@click.option("--backend-port", default=0, show_default=True, help="port for --local-backend, e.g. 3030 for LFT")
+@click.option("--backend-capacity", default=8, show_default=True, help="requests --local-backend serves at once")
+@click.option("--output-format", type=click.Choice(["text", "json"]), default="text", show_default=True)
+def load_test(config, url, clients, rate, noisy_connections, duration, local_backend, backend_port,
+              backend_capacity, output_format):
+    logger.info(f'load_test: {url=}, {clients=}, {rate=}, {noisy_connections=}, {local_backend=}')
+
+    if not url and not local_backend:
+        raise Exception("ERROR: --url or --local-backend is required")
+
+    if local_backend:
+        with loadtest.LocalBackend(port=backend_port, capacity=backend_capacity) as backend:
+            logger.info(f"Local backend on {backend.host}:{backend.port}")
+            report = loadtest.noisy_neighbour(url or f"http://{backend.host}:{backend.port}/",
+                                              clients, rate, noisy_connections, duration)
+    else:
+        report = loadtest.noisy_neighbour(url, clients, rate, noisy_connections, duration)
+
+    if output_format == "json":
+        click.echo(json.dumps(report, indent=2))
+    else:
+        click.echo(loadtest.format_report(report))
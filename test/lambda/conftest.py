@@ -0,0 +1,9 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import os
+import sys
+
+# the Lambda layer, imported as aws_utils.* and config.* by the handlers
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "..", "src", "lambda", "common"))
@@ -0,0 +1,186 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import threading
+
+import pytest
+
+import aws_utils.idempotency as idempotency
+
+
+class Clock:
+    def __init__(self, now=1_000_000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class Context:
+    def __init__(self, remaining_seconds):
+        self.remaining_seconds = remaining_seconds
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_seconds * 1000
+
+
+@pytest.fixture
+def store(tmp_path):
+    return idempotency.SQLiteStore(str(tmp_path / "idempotency.db"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(idempotency.time, "time", clock)
+    return clock
+
+
+def counted(result=None, error=None):
+    def fn():
+        fn.calls += 1
+        if error:
+            raise error
+        return result
+    fn.calls = 0
+    return fn
+
+
+def test_duplicate_returns_stored_outcome(store):
+    fn = counted({"status": "ok"})
+
+    assert idempotency.run_once(store, "token:1", fn, in_flight_seconds=60) == ({"status": "ok"}, False)
+    assert idempotency.run_once(store, "token:1", fn, in_flight_seconds=60) == ({"status": "ok"}, True)
+    assert fn.calls == 1
+
+
+def test_duplicate_in_flight_waits_for_original(store):
+    started, release = threading.Event(), threading.Event()
+    calls = []
+
+    def original():
+        calls.append("original")
+        started.set()
+        release.wait(5)
+        return "done"
+
+    results = {}
+    thread = threading.Thread(
+        target=lambda: results.update(original=idempotency.run_once(store, "token:1", original, 60)))
+    thread.start()
+    started.wait(5)
+
+    # still running: a duplicate that cannot wait long gives up
+    with pytest.raises(idempotency.DuplicateInProgress):
+        idempotency.run_once(store, "token:1", counted(), 60, wait_seconds=0.1, poll_seconds=0.05)
+
+    release.set()
+    result = idempotency.run_once(store, "token:1", counted(), 60, wait_seconds=5, poll_seconds=0.05)
+    thread.join(5)
+
+    assert result == ("done", True)
+    assert results["original"] == ("done", False)
+    assert calls == ["original"]
+
+
+def test_abandoned_claim_is_taken_over(store, clock):
+    # an invocation that timed out leaves its claim IN_PROGRESS
+    store.acquire("token:1", clock.now + 60, clock.now + idempotency.TTL_SECONDS)
+    fn = counted("done")
+
+    clock.now += 61
+    assert idempotency.run_once(store, "token:1", fn, in_flight_seconds=60) == ("done", False)
+    assert fn.calls == 1
+
+
+def test_outcome_expires_with_ttl(store, clock):
+    fn = counted("done")
+
+    idempotency.run_once(store, "token:1", fn, in_flight_seconds=60, ttl_seconds=3600)
+    clock.now += 3599
+    assert idempotency.run_once(store, "token:1", fn, in_flight_seconds=60, ttl_seconds=3600) == ("done", True)
+    assert fn.calls == 1
+
+    clock.now += 2
+    assert idempotency.run_once(store, "token:1", fn, in_flight_seconds=60, ttl_seconds=3600) == ("done", False)
+    assert fn.calls == 2
+
+
+def test_failed_run_is_not_retried_until_ttl(store, clock):
+    # the original already reported the failure (ABANDON, FAILED to
+    # CloudFormation), a redelivered copy must not redo the work
+    failing = counted(error=Exception("ERROR: boom"))
+    with pytest.raises(Exception, match="boom"):
+        idempotency.run_once(store, "token:1", failing, in_flight_seconds=60, ttl_seconds=3600)
+
+    retry = counted("done")
+    with pytest.raises(idempotency.DuplicateFailed, match="boom"):
+        idempotency.run_once(store, "token:1", retry, in_flight_seconds=60, ttl_seconds=3600)
+    assert retry.calls == 0
+    assert store.get("token:1")["status"] == idempotency.FAILED
+
+    clock.now += 3601
+    assert idempotency.run_once(store, "token:1", retry, in_flight_seconds=60, ttl_seconds=3600) == ("done", False)
+    assert retry.calls == 1
+    assert store.get("token:1")["status"] == idempotency.COMPLETED
+
+
+def test_run_for_event_keys_on_inputs(tmp_path, monkeypatch):
+    monkeypatch.delenv("IDEMPOTENCY_TABLE", raising=False)
+    monkeypatch.setenv("IDEMPOTENCY_DB_PATH", str(tmp_path / "idempotency.db"))
+    context = Context(remaining_seconds=60)
+    fn = counted("done")
+
+    inputs = {"RequestType": "Update", "ResourceProperties": {"nounce": 1}}
+    assert idempotency.run_for_event("request-1", inputs, fn, context) == ("done", False)
+    assert idempotency.run_for_event("request-1", dict(inputs), fn, context) == ("done", True)
+    assert fn.calls == 1
+
+    # same token with other inputs is other work, not a duplicate
+    changed = {"RequestType": "Update", "ResourceProperties": {"nounce": 2}}
+    assert idempotency.event_key("request-1", inputs) != idempotency.event_key("request-1", changed)
+    assert idempotency.run_for_event("request-1", changed, fn, context) == ("done", False)
+    assert fn.calls == 2
+
+
+def test_run_for_event_without_store(monkeypatch):
+    monkeypatch.delenv("IDEMPOTENCY_TABLE", raising=False)
+    monkeypatch.delenv("IDEMPOTENCY_DB_PATH", raising=False)
+    fn = counted("done")
+
+    assert idempotency.run_for_event("request-1", {}, fn, Context(60)) == ("done", False)
+    assert idempotency.run_for_event("request-1", {}, fn, Context(60)) == ("done", False)
+    assert fn.calls == 2
+
+
+class VanishingStore:
+    """claim always taken, record always gone when read, as if it expired or
+    was deleted between the conditional put and the get"""
+
+    def __init__(self):
+        self.acquires = 0
+
+    def acquire(self, key, in_flight_until, expires_at):
+        self.acquires += 1
+        return False, None
+
+
+def test_vanished_record_backs_off_within_wait(monkeypatch):
+    monotonic = Clock(0.0)
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        monotonic.now += seconds
+
+    monkeypatch.setattr(idempotency.time, "monotonic", monotonic)
+    monkeypatch.setattr(idempotency.time, "sleep", sleep)
+    store = VanishingStore()
+
+    with pytest.raises(idempotency.DuplicateInProgress):
+        idempotency.run_once(store, "token:1", counted(), 60, wait_seconds=5, poll_seconds=1)
+
+    # no tight loop on the store: one claim per poll until the wait runs out
+    assert sleeps == [1] * 5
+    assert store.acquires == 6
@@ -0,0 +1,65 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import os
+import importlib.util
+
+import pytest
+
+HANDLER = os.path.join(
+    os.path.dirname(__file__), "..", "..", "src", "lambda", "scheduled", "nucleusIdleController", "index.py")
+
+
+@pytest.fixture
+def controller(monkeypatch):
+    monkeypatch.setenv("NUCLEUS_INSTANCE_IDS", "i-1")
+    spec = importlib.util.spec_from_file_location("nucleus_idle_controller", HANDLER)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+class Instance:
+    """tags of one running instance, as the ec2 helpers change them"""
+
+    def __init__(self, tags):
+        self.tags = dict(tags)
+
+    def describe(self, instance_id):
+        return {"State": {"Name": "running"}, "Tags": [{"Key": k, "Value": v} for k, v in self.tags.items()]}
+
+    def update_tag_value(self, resource_ids, key, value):
+        self.tags[key] = value
+
+    def delete_tag(self, resource_ids, key, value):
+        self.tags.pop(key, None)
+
+
+@pytest.fixture
+def instance(controller, monkeypatch):
+    instance = Instance({controller.RESUMED_TAG: "1700000000"})
+    monkeypatch.setattr(controller.ec2, "get_instance_description", instance.describe)
+    monkeypatch.setattr(controller.ec2, "update_tag_value", instance.update_tag_value)
+    monkeypatch.setattr(controller.ec2, "delete_tag", instance.delete_tag)
+    monkeypatch.setattr(controller.ec2, "stop_instances", lambda ids: pytest.fail("stopped the instance"))
+    return instance
+
+
+def test_failed_stop_restores_tags(controller, instance, monkeypatch):
+    def run_commands(*args, **kwargs):
+        raise Exception("ERROR: command failed")
+    monkeypatch.setattr(controller.ssm, "run_commands", run_commands)
+
+    with pytest.raises(Exception, match="command failed"):
+        controller.suspend("i-1", stop_instance=True)
+
+    # still running, so check must keep considering it
+    assert instance.tags == {controller.RESUMED_TAG: "1700000000"}
+
+
+def test_suspend_tags_the_stopped_stack(controller, instance, monkeypatch):
+    monkeypatch.setattr(controller.ssm, "run_commands", lambda *args, **kwargs: None)
+
+    assert controller.suspend("i-1", stop_instance=False) == {"suspended": "stack"}
+    assert instance.tags == {controller.SUSPENDED_TAG: "stack"}
@@ -0,0 +1,53 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import aws_utils.ssm as ssm
+from config.phases import PHASE_MARKER
+
+
+def markers(*entries):
+    return "\n".join(f"{PHASE_MARKER}|{kind}|{name}|{stamp}" for kind, name, stamp in entries)
+
+
+def test_phase_profile():
+    output = "\n".join([
+        "Reading package lists...",
+        markers(("script", "nucleus-server-config", 100.0),
+                ("start", "install-packages", 100.0)),
+        "apt output interleaved with the markers",
+        markers(("end", "install-packages", 112.5),
+                ("start", "pull-images", 112.5),
+                ("end", "pull-images", 160.25)),
+    ])
+
+    assert ssm.phase_profile(output) == {
+        "script": "nucleus-server-config",
+        "phases": [
+            {"name": "install-packages", "start": 100.0, "end": 112.5, "seconds": 12.5},
+            {"name": "pull-images", "start": 112.5, "end": 160.25, "seconds": 47.75},
+        ],
+        "total_seconds": 60.25,
+    }
+
+
+def test_phase_left_through_exit_has_no_duration():
+    output = markers(("start", "configure", 10.0), ("end", "configure", 11.0), ("start", "start-stack", 11.0))
+
+    profile = ssm.phase_profile(output)
+
+    assert profile["script"] is None
+    assert profile["phases"][1] == {"name": "start-stack", "start": 11.0, "end": None, "seconds": None}
+    assert profile["total_seconds"] == 1.0
+
+
+def test_malformed_and_unmatched_markers_are_ignored():
+    output = "\n".join([
+        f"{PHASE_MARKER}|start|truncated",
+        f"{PHASE_MARKER}|start|bad-stamp|not-a-number",
+        markers(("end", "never-started", 5.0)),
+        f"  {PHASE_MARKER}|start|indented|1.0",
+    ])
+
+    assert ssm.phase_profile(output) == {"script": None, "phases": [], "total_seconds": None}
+    assert ssm.phase_profile(None)["phases"] == []
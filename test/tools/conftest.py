@@ -0,0 +1,12 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import os
+import sys
+
+# the on-instance tools, installed with `pip install -r requirements.txt`
+# from their own directory
+TOOLS = os.path.join(os.path.dirname(__file__), "..", "..", "src", "tools")
+for tool in ["common", "reverseProxy", "nucleusServer", "lambdaSimulator"]:
+    sys.path.insert(0, os.path.join(TOOLS, tool))
@@ -0,0 +1,80 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import struct
+
+import pytest
+
+import nst.profile as profile
+import nst.compression as compression
+
+
+@pytest.mark.parametrize("gain, previous, expected", [
+    # no previous recommendation: the plain threshold
+    (1.1, None, 1),
+    (1.09, None, 0),
+    # on stays on until the gain drops past the margin
+    (1.05, 1, 1),
+    (1.0, 1, 1),
+    (0.99, 1, 0),
+    # off stays off until the gain rises past the margin
+    (1.15, 0, 0),
+    (1.25, 0, 1),
+])
+def test_recommend_hysteresis(gain, previous, expected):
+    assert compression.recommend(gain, min_gain=1.1, margin=0.1, previous=previous) == expected
+
+
+def test_recommend_without_margin_is_the_threshold():
+    for previous in (None, 0, 1):
+        assert compression.recommend(1.1, 1.1, previous=previous) == 1
+        assert compression.recommend(1.09, 1.1, previous=previous) == 0
+
+
+def write_profile(path, cpus_used):
+    ring = profile.RingFile(path, capacity=8, interval=10)
+    host = ring.series_id(profile.HOST)
+    for i in range(4):
+        ring.append(100.0 + 10 * i, host, [int(i * cpus_used * 10_000_000), 0, 0, 0, 0, 0, 0, 0])
+    ring.close()
+    return ring.cpus
+
+
+def test_spare_cores_from_profile(tmp_path):
+    path = tmp_path / "profile.ring"
+    cpus = write_profile(path, cpus_used=0.25)
+
+    assert compression.spare_cores(path, cpus=8) == (max(cpus - 0.25, 0.5), "profile")
+    assert compression.spare_cores(tmp_path / "missing.ring", cpus=8) == (4, "default")
+
+
+def stale_ring(path):
+    # the header of another version
+    write_profile(path, cpus_used=1)
+    with open(path, "r+b") as file:
+        file.write(struct.pack("<8sH", b"NSTPROF0", 0))
+
+
+def foreign_file(path):
+    path.write_bytes(b"not a profile" * 1000)
+
+
+def truncated_ring(path):
+    write_profile(path, cpus_used=1)
+    with open(path, "r+b") as file:
+        file.truncate(profile.DATA_OFFSET + 2 * profile.RECORD.size)
+
+
+def no_host_series(path):
+    ring = profile.RingFile(path, capacity=8, interval=10)
+    ring.append(100.0, ring.series_id("nucleus-api"), [0] * len(profile.FIELDS))
+    ring.close()
+
+
+@pytest.mark.parametrize("make", [stale_ring, foreign_file, truncated_ring, no_host_series])
+def test_spare_cores_falls_back_on_an_unreadable_profile(tmp_path, make):
+    path = tmp_path / "profile.ring"
+    make(path)
+
+    assert compression.spare_cores(path, cpus=8) == (4, "default")
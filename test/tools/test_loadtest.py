@@ -0,0 +1,32 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import os
+
+import rpt.loadtest as loadtest
+
+
+def test_noisy_neighbour_against_local_backend():
+    with loadtest.LocalBackend(capacity=4, service_ms=5) as backend:
+        report = loadtest.noisy_neighbour(f"http://{backend.host}:{backend.port}/", clients=2, rate=10,
+                                          noisy_connections=4, duration=1)
+
+    assert set(report["quiet"]) == {"well_behaved"}
+    assert report["quiet"]["well_behaved"]["statuses"] == {"200": report["quiet"]["well_behaved"]["requests"]}
+    assert report["noisy"]["noisy"]["requests"] > report["noisy"]["well_behaved"]["requests"]
+    assert report["noisy"]["well_behaved"]["p99_ms"] is not None
+    assert "well-behaved p99 with the noisy neighbour" in loadtest.format_report(report)
+
+
+def test_flood_runs_outside_the_measuring_process(monkeypatch):
+    pids = []
+    monkeypatch.setattr(loadtest, "_flood", lambda *args: pids.append(os.getpid()))
+
+    with loadtest.LocalBackend() as backend:
+        loadtest.run_phase(f"http://{backend.host}:{backend.port}/", clients=1, rate=5,
+                           noisy_connections=2, duration=0.2)
+
+    # the patched _flood only exists in this process, the spawned one
+    # runs the real flood
+    assert pids == []
@@ -0,0 +1,98 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import gzip
+import calendar
+
+import pytest
+
+import rpt.logs as logs
+
+
+def line(path="/omni/api", status=200, size=512, request_time="0.120", forwarded="-",
+         time_local="10/Oct/2023:13:55:36 +0000", remote_addr="10.0.0.1"):
+    entry = (f'{remote_addr} - - [{time_local}] "GET {path} HTTP/1.1" {status} {size} '
+             f'"-" "curl/8.0" "{forwarded}"')
+    if request_time is not None:
+        entry += f' {request_time} "0.118"'
+    return entry + "\n"
+
+
+def test_parses_with_and_without_timings():
+    timed = logs.LOG_PATTERN.match(line()).groupdict()
+    assert timed["request"] == "GET /omni/api HTTP/1.1"
+    assert timed["status"] == "200"
+    assert timed["request_time"] == "0.120"
+    assert timed["upstream_response_time"] == "0.118"
+
+    # written before request_time was added to the template
+    untimed = logs.LOG_PATTERN.match(line(request_time=None)).groupdict()
+    assert untimed["request_time"] is None
+
+    assert logs.LOG_PATTERN.match("not an access log line") is None
+
+
+@pytest.mark.parametrize("request_line, route", [
+    ("GET /omni/auth/login/token HTTP/1.1", "auth-login"),
+    ("GET /omni/auth/other HTTP/1.1", "auth"),
+    ("GET /omni/lft/abc HTTP/1.1", "lft"),
+    ("GET /omni/web2/index.html HTTP/1.1", "navigator"),
+    ("GET / HTTP/1.1", "root"),
+    ("GET /favicon.ico HTTP/1.1", "other"),
+    ("garbage", "other"),
+])
+def test_route_for(request_line, route):
+    assert logs.route_for(request_line) == route
+
+
+def test_histogram_buckets_within_relative_error():
+    for seconds in (0.0015, 0.02, 0.3, 4.5, 120.0):
+        # a bucket reports its upper edge
+        value = logs.histogram_value(logs.histogram_index(seconds))
+        assert value / logs.HIST_FACTOR < seconds <= value * 1.0001
+
+    assert logs.histogram_index(0) == 0
+    assert logs.histogram_index(10 ** 6) == logs.HIST_SIZE - 1
+
+
+def test_percentiles():
+    summary = logs.Summary()
+    assert summary.percentile(50) is None
+
+    for i in range(1, 101):
+        summary.add(10, i / 1000)
+    summary.add(10, None)
+
+    assert summary.count == 101 and summary.timed == 100 and summary.bytes == 1010
+    for pct in logs.PERCENTILES:
+        assert summary.percentile(pct) == pytest.approx(pct / 1000, rel=0.05)
+
+
+def test_clients_and_buckets():
+    stats = logs.LogStats(bucket_seconds=60)
+    stats.add(logs.LOG_PATTERN.match(line(forwarded="203.0.113.7, 10.0.0.2")).groupdict())
+    stats.add(logs.LOG_PATTERN.match(line(time_local="10/Oct/2023:15:56:10 +0200")).groupdict())
+
+    assert stats.clients == {"203.0.113.7": 1, "10.0.0.1": 1}
+    # both are 13:55 and 13:56 UTC
+    start = calendar.timegm((2023, 10, 10, 13, 55, 0))
+    assert dict(stats.buckets) == {start: 1, start + 60: 1}
+
+
+def test_files_merge_the_same_in_parallel(tmp_path):
+    plain = tmp_path / "access.log"
+    plain.write_text(line() + line(status=404, request_time="0.002") + "broken\n")
+    rotated = tmp_path / "access.log.1.gz"
+    with gzip.open(rotated, "wt") as file:
+        file.write(line(path="/omni/lft/x", size=2048) + line(request_time=None))
+
+    serial = logs.analyze_files([str(plain), str(rotated)], workers=1).to_dict()
+    parallel = logs.analyze_files([str(plain), str(rotated)], workers=2).to_dict()
+
+    assert serial == parallel
+    assert serial["lines"] == 5 and serial["skipped"] == 1
+    assert serial["routes"]["api"]["count"] == 3
+    assert serial["routes"]["lft"]["bytes"] == 2048
+    assert serial["statuses"]["404"]["count"] == 1
+    assert "lines: 5  skipped: 1" in logs.format_report(serial)
@@ -0,0 +1,132 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import urllib.request
+
+import nst.metrics as metrics
+
+
+class CloudWatch:
+    def __init__(self):
+        self.calls = []
+
+    def put_metric_data(self, Namespace, MetricData):
+        self.calls.append((Namespace, MetricData))
+
+
+def test_iter_samples_from_local_exporter():
+    with metrics.LocalExporter() as exporter:
+        with urllib.request.urlopen(exporter.url, timeout=5) as response:
+            samples = list(metrics.iter_samples(response))
+
+    types = {name: metric_type for name, _, _, metric_type in samples}
+    assert types["nucleus_requests_total"] == "counter"
+    assert types["nucleus_connections"] == "gauge"
+    # buckets, _sum and _count of a histogram only go up
+    assert types["nucleus_request_duration_seconds_bucket"] == "counter"
+    assert types["nucleus_request_duration_seconds_sum"] == "counter"
+    assert types["nucleus_request_duration_seconds_count"] == "counter"
+
+    labels = [labels for name, labels, _, _ in samples if name == "nucleus_requests_total"]
+    assert {"service": "lft", "status": "200"} in labels
+    assert len(labels) == 2 * len(metrics.LocalExporter.SERVICES)
+
+
+def test_iter_samples_parses_escapes_and_skips_bad_lines():
+    lines = [
+        b"# TYPE jobs_total counter",
+        b'jobs_total{path="a \\"b\\"\\\\c",host=""} 3 1600000000000',
+        b"",
+        b"not a sample line {",
+        b"jobs_total{path=\"x\"} NaN-ish",
+        b"temperature 21.5",
+    ]
+    samples = list(metrics.iter_samples(lines))
+
+    assert samples == [
+        ("jobs_total", {"path": 'a "b"\\c', "host": ""}, 3.0, "counter"),
+        ("temperature", {}, 21.5, "untyped"),
+    ]
+
+
+def test_scrape_filters_and_sums_dropped_labels():
+    metric_filter = metrics.Filter(include=[r"^nucleus_requests_total$", r"^nucleus_request_duration"],
+                                   dimensions=["service"])
+    with metrics.LocalExporter() as exporter:
+        series = metrics.scrape(exporter.url, metric_filter)
+
+    names = {name for name, _ in series}
+    # buckets are excluded by default
+    assert names == {"nucleus_requests_total", "nucleus_request_duration_seconds_sum",
+                     "nucleus_request_duration_seconds_count"}
+    # the status label is summed away, service stays a dimension
+    assert sorted(dims for name, dims in series if name == "nucleus_requests_total") == sorted(
+        (("service", service),) for service in metrics.LocalExporter.SERVICES)
+
+
+def test_rates_between_scrapes_and_counter_reset():
+    rates = metrics.Rates()
+    key = ("nucleus_requests_total", (("service", "api"),))
+    gauge = ("nucleus_connections", ())
+
+    # the first scrape has no rate yet, gauges go out right away
+    assert rates.update({key: (100.0, "counter"), gauge: (7.0, "gauge")}, now=1000) == [
+        (gauge, 7.0, "None", False)]
+    assert rates.update({key: (160.0, "counter")}, now=1060) == [
+        (key, 1.0, "Count/Second", True)]
+    # Nucleus restarted: the counter starts again from zero
+    assert rates.update({key: (30.0, "counter")}, now=1090) == [
+        (key, 1.0, "Count/Second", True)]
+    # a series missing from one scrape starts over
+    rates.update({}, now=1150)
+    assert rates.update({key: (90.0, "counter")}, now=1210) == []
+
+
+def test_emf_documents_batch_per_dimension_set():
+    values = [((f"metric_{i}", (("service", "api"),)), float(i), "None", False) for i in range(250)]
+    values.append((("other", (("service", "lft"),)), 1.0, "Count/Second", True))
+    values.append((("skipped", ()), float("inf"), "None", False))
+
+    documents = metrics.emf_documents(values, "Test", {"InstanceId": "i-1"}, timestamp=1600000000.5)
+
+    sizes = [len(d["_aws"]["CloudWatchMetrics"][0]["Metrics"]) for d in documents]
+    assert sizes == [100, 100, 50, 1]
+    assert all(size <= metrics.EMF_MAX_METRICS for size in sizes)
+    first, last = documents[0], documents[-1]
+    assert first["_aws"]["Timestamp"] == 1600000000500
+    assert first["_aws"]["CloudWatchMetrics"][0]["Dimensions"] == [["InstanceId", "service"]]
+    assert first["InstanceId"] == "i-1" and first["service"] == "api" and first["metric_99"] == 99.0
+    assert last["service"] == "lft" and last["other_per_second"] == 1.0
+    assert not any("skipped" in d for d in documents)
+
+
+def test_put_metric_data_chunks():
+    client = CloudWatch()
+    writer = metrics.PutMetricDataWriter("Test", {"InstanceId": "i-1"}, client=client)
+    values = [((f"metric_{i}", ()), float(i), "None", False) for i in range(2500)]
+
+    assert writer.write(values, timestamp=1600000000) == 2500
+    assert [len(data) for _, data in client.calls] == [1000, 1000, 500]
+    namespace, data = client.calls[0]
+    assert namespace == "Test"
+    assert data[0] == {
+        "MetricName": "metric_0",
+        "Dimensions": [{"Name": "InstanceId", "Value": "i-1"}],
+        "Timestamp": 1600000000,
+        "Value": 0.0,
+        "Unit": "None",
+    }
+
+
+def test_run_publishes_local_exporter_rates(tmp_path):
+    target = tmp_path / "emf.log"
+    with metrics.LocalExporter() as exporter:
+        scrapes = metrics.run(exporter.url, interval=0.2, emf_target=str(target), count=2,
+                              metric_filter=metrics.Filter(include=[r"^nucleus_requests_total$"]))
+
+    assert scrapes == 2
+    lines = target.read_text().splitlines()
+    # rates need two scrapes, so only the second one is written
+    assert len(lines) == 1
+    assert '"nucleus_requests_total_per_second"' in lines[0]
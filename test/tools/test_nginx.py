@@ -0,0 +1,198 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import functools
+import os
+import re
+
+import pytest
+
+import rpt.compression as compression
+import rpt.nginx as nginx
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "src", "tools", "reverseProxy",
+                             "templates", "nginx.conf")
+SERVERS = ["10.0.1.10", "10.0.1.11", "10.0.1.12"]
+
+
+def render(servers=SERVERS, **options):
+    with open(TEMPLATE_PATH) as file:
+        return nginx.render_config(file.read(), "nucleus.example.com", servers, **options)
+
+
+@functools.lru_cache()
+def blocks(config, directive):
+    """{variable: (source, [(key, value)])} of the map/split_clients blocks"""
+    found = {}
+    pattern = rf'^\s*{directive} "?(\$\w+)"? \$(\w+) {{\n(.*?)\n\s*}}'
+    for source, variable, body in re.findall(pattern, config, re.M | re.S):
+        entries = []
+        for line in body.splitlines():
+            match = re.match(r'\s*("(?:[^"\\]|\\.)*"|\S+)\s+("(?:[^"\\]|\\.)*"|\S+);', line)
+            if match:
+                entries.append(tuple(part.strip('"') for part in match.groups()))
+        found[variable] = (source, entries)
+    return found
+
+
+def murmur2(data):
+    """ngx_murmur_hash2, the hash split_clients places keys with"""
+    m, mask = 0x5bd1e995, 0xffffffff
+    h, length = len(data), len(data)
+    while length >= 4:
+        k = int.from_bytes(data[:4], "little")
+        k = (k * m) & mask
+        k ^= k >> 24
+        k = (k * m) & mask
+        h = ((h * m) & mask) ^ k
+        data, length = data[4:], length - 4
+    if length:
+        h ^= int.from_bytes(data, "little")
+        h = (h * m) & mask
+    h ^= h >> 13
+    h = (h * m) & mask
+    return h ^ (h >> 15)
+
+
+class Request:
+    """evaluates the maps of a rendered config for one request, as nginx
+    does lazily when a variable is used"""
+
+    def __init__(self, config, **variables):
+        self.maps = blocks(config, "map")
+        self.splits = blocks(config, "split_clients")
+        self.variables = variables
+
+    def __getitem__(self, name):
+        if name in self.variables:
+            return self.variables[name]
+        if name in self.splits:
+            source, entries = self.splits[name]
+            position, bound = murmur2(self.expand(source).encode()), 0
+            for key, value in entries:
+                if key == "*":
+                    return value
+                bound += round(float(key.rstrip("%")) * 100)
+                if position < bound * 0xffffffff // nginx.RING_UNITS:
+                    return value
+            return ""
+        source, entries = self.maps[name]
+        value = self[source[1:]]
+        for key, result in entries:
+            if key == value and not key.startswith("~"):
+                return self.expand(result)
+        for key, result in entries:
+            if key.startswith("~") and re.search(key.lstrip("~*"), value, re.I if key.startswith("~*") else 0):
+                return self.expand(result)
+        return self.expand(dict(entries).get("default", ""))
+
+    def expand(self, value):
+        return re.sub(r"\$(\w+)", lambda match: self[match.group(1)], value)
+
+
+def locations(config):
+    """{prefix: body} of the server's location blocks"""
+    return dict(re.findall(r"^\s*location (\S+) {\n(.*?)\n\s*}", config, re.M | re.S))
+
+
+@pytest.mark.parametrize("uri", [
+    "/omni/api",
+    "/omni/lft/Projects/Car/scene.usd?version=3",
+    "/omni/web2/omniverse://nucleus.example.com/Projects/Car/scene.usd",
+    "/omni/auth/login",
+])
+def test_route_key_is_the_client_for_every_service(uri):
+    config = render()
+    request = Request(config, request_uri=uri, uri=uri, remote_addr="192.0.2.7", http_x_nucleus_mount="")
+
+    assert request["nucleus_route_key"] == "192.0.2.7"
+
+
+@pytest.mark.parametrize("uri", [
+    "/omni/api",
+    "/omni/lft/Projects/Car/scene.usd",
+    "/omni/web2/omniverse://nucleus.example.com/Projects/Car/scene.usd",
+])
+def test_mount_header_keys_every_service(uri):
+    config = render()
+    request = Request(config, request_uri=uri, uri=uri, remote_addr="192.0.2.7",
+                      http_x_nucleus_mount="Projects/Car")
+
+    assert request["nucleus_route_key"] == "Projects/Car"
+
+
+def test_route_key_does_not_depend_on_the_rewritten_uri():
+    # lft, auth/login and web2 rewrite $uri before proxy_pass reads the maps
+    config = render()
+    rewriting = [body for body in locations(config).values() if "rewrite" in body]
+    assert len(rewriting) == 3
+    assert all("proxy_pass http://$nucleus_" in body for body in rewriting)
+
+    for variable in ["nucleus_route_key", "nucleus_server", "nucleus_lft", "nucleus_web"]:
+        source, _ = {**blocks(config, "map"), **blocks(config, "split_clients")}[variable]
+        assert source != "$uri"
+
+    before = Request(config, uri="/omni/lft/Projects/Car/a.usd", remote_addr="192.0.2.7", http_x_nucleus_mount="")
+    after = Request(config, uri="/Projects/Car/a.usd", remote_addr="192.0.2.7", http_x_nucleus_mount="")
+    assert before["nucleus_lft"] == after["nucleus_lft"]
+    assert before["nucleus_web"].split("_")[-1] == after["nucleus_lft"].split("_")[-1]
+
+
+def test_every_service_goes_to_the_picked_server():
+    config = render()
+    for client in range(50):
+        request = Request(config, remote_addr=f"192.0.2.{client}", http_x_nucleus_mount="")
+        picked = {request[f"nucleus_{service}"].rsplit("_", 1)[-1]
+                  for service in ["api", "lft", "auth", "auth_login", "web", "discovery", "tagging", "search"]}
+        assert len(picked) == 1
+
+
+def test_single_server_has_no_ring():
+    config = render(servers=["10.0.1.10"])
+
+    assert "split_clients" not in config
+    assert "set_real_ip_from" not in config
+    assert "geo $nucleus_server {\n        default 0;" in config
+    assert Request(config, nucleus_server="0")["nucleus_api"] == "nucleus_api_0"
+
+
+def test_adding_a_server_moves_about_one_nth_of_the_keys():
+    keys = [f"10.{i // 65536}.{i // 256 % 256}.{i % 256}" for i in range(20000)]
+
+    def owners(servers):
+        config = render(servers=servers)
+        ordered = sorted(servers)
+        return [ordered[int(Request(config, remote_addr=key, http_x_nucleus_mount="")["nucleus_server"])]
+                for key in keys]
+
+    before = owners(SERVERS)
+    after = owners(SERVERS + ["10.0.1.13"])
+    moved = [(old, new) for old, new in zip(before, after) if old != new]
+
+    assert {new for _, new in moved} == {"10.0.1.13"}
+    assert 0.15 < len(moved) / len(keys) < 0.35
+    # the ring spreads keys about evenly
+    assert all(0.2 < after.count(server) / len(keys) < 0.3 for server in SERVERS + ["10.0.1.13"])
+
+
+HASHED_ASSET = "/omni/web2/static/js/main.3f2a9c1d.js"
+
+
+@pytest.mark.parametrize("request_uri, immutable", [
+    (HASHED_ASSET, True),
+    (HASHED_ASSET + "?v=2", True),
+    ("/omni/web2/index.html", False),
+    ("/omni/web2/static/js/main.js", False),
+])
+def test_navigator_cache_control_after_rewrite(request_uri, immutable):
+    config = render(compression=True, static_root="/var/www/navigator")
+    # the Navigator location and @navigator rewrite $uri before add_header
+    assert "add_header Cache-Control $navigator_cache_control;" in locations(config)["@navigator"]
+    rewritten = "/" + request_uri.split("?")[0][len("/omni/web2/"):]
+    request = Request(config, request_uri=request_uri, uri=rewritten, upstream_http_cache_control="no-cache")
+
+    expected = nginx.IMMUTABLE_CACHE_CONTROL if immutable else "no-cache"
+    assert request["navigator_cache_control"] == expected
+    # the replay report predicts what the config sends
+    assert compression.is_hashed(request_uri.split("?")[0]) == immutable
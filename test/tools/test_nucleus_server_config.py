@@ -0,0 +1,72 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import lsim.simulator as simulator
+from lsim.backends import SSM
+
+SERVERS = ["i-nucleus0001", "i-nucleus0002", "i-nucleus0003"]
+# the virtual clock adds up the sleeps of the concurrent runs, short
+# installs keep three of them inside the Lambda timeout
+COMMAND_DURATIONS = {"NUCLEUS SERVER CONFIG": 20.0}
+
+
+class FailingSSM(SSM):
+    """the bootstrap fails on the given instances"""
+
+    def __init__(self, world, failing):
+        super().__init__(world)
+        self.failing = failing
+
+    def get_command_invocation(self, CommandId, InstanceId):
+        result = super().get_command_invocation(CommandId, InstanceId)
+        if InstanceId in self.failing and result["Status"] == "Success":
+            result.update(Status="Failed", StandardErrorContent=f"install failed on {InstanceId}")
+        return result
+
+
+def sent_to(sim):
+    return sorted({i for c in sim.world.commands.values() for i in c["InstanceIds"]})
+
+
+def configure(failing=()):
+    sim = simulator.Simulation(command_durations=COMMAND_DURATIONS)
+    sim.setup_stack()
+    for instance_id in SERVERS[1:]:
+        sim.world.add_instance(instance_id, f"{simulator.STACK_NAME}/NucleusServer")
+    sim.world.services["ssm"] = FailingSSM(sim.world, failing)
+
+    properties = dict(simulator._nucleus_properties(), instanceIds=SERVERS)
+    result = sim.invoke("test", "nucleusServerConfig", simulator._cfn_event("Create", properties))
+    return result, sent_to(sim)
+
+
+def test_every_server_is_configured():
+    result, sent = configure()
+
+    assert result["status"] == "SUCCESS"
+    assert sent == SERVERS
+
+
+def test_failures_are_reported_together_once_all_finished():
+    result, sent = configure(failing={"i-nucleus0001", "i-nucleus0003"})
+
+    assert result["status"] == "FAILED"
+    # the healthy server was still configured
+    assert sent == SERVERS
+    assert result["reason"].startswith("Failed to configure Nucleus servers.")
+    assert "i-nucleus0001: Error Running Command: install failed on i-nucleus0001" in result["reason"]
+    assert "i-nucleus0003: Error Running Command: install failed on i-nucleus0003" in result["reason"]
+    assert "i-nucleus0002" not in result["reason"]
+
+
+def test_single_instance_id_still_works():
+    sim = simulator.Simulation(command_durations=COMMAND_DURATIONS)
+    sim.setup_stack()
+    properties = simulator._nucleus_properties()
+    properties["instanceId"] = properties.pop("instanceIds")[0]
+
+    result = sim.invoke("test", "nucleusServerConfig", simulator._cfn_event("Create", properties))
+
+    assert result["status"] == "SUCCESS"
+    assert sent_to(sim) == ["i-nucleus0001"]
@@ -0,0 +1,123 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import pytest
+
+import nst.profile as profile
+
+
+def values(cpu_usec=0, memory_bytes=0, read_bytes=0, write_bytes=0):
+    return [cpu_usec, memory_bytes, read_bytes, write_bytes, 0, 0, 0, 0]
+
+
+def test_ring_round_trip(tmp_path):
+    path = tmp_path / "profile.ring"
+    ring = profile.RingFile(path, capacity=8, interval=10)
+    host, api = ring.series_id(profile.HOST), ring.series_id("nucleus-api")
+    ring.append(100.0, host, values(1))
+    ring.append(100.0, api, values(2))
+    ring.flush()
+    ring.close()
+
+    reader = profile.RingFile(path, create=False)
+    assert (reader.capacity, reader.interval, reader.count) == (8, 10, 2)
+    assert reader.series == [profile.HOST, "nucleus-api"]
+    assert list(reader.records()) == [(100.0, profile.HOST, values(1)), (100.0, "nucleus-api", values(2))]
+    reader.close()
+
+
+def test_ring_keeps_the_newest_records(tmp_path):
+    ring = profile.RingFile(tmp_path / "profile.ring", capacity=3, interval=1)
+    host = ring.series_id(profile.HOST)
+    for i in range(5):
+        ring.append(float(i), host, values(i))
+
+    assert [timestamp for timestamp, _, _ in ring.records()] == [2.0, 3.0, 4.0]
+    ring.close()
+
+    # an existing ring keeps its size
+    reopened = profile.RingFile(tmp_path / "profile.ring", capacity=100)
+    assert reopened.capacity == 3
+    assert [timestamp for timestamp, _, _ in reopened.records()] == [2.0, 3.0, 4.0]
+    reopened.close()
+
+
+def test_series_table_is_bounded(tmp_path):
+    ring = profile.RingFile(tmp_path / "profile.ring", capacity=1)
+    ids = [ring.series_id(f"service-{i}") for i in range(profile.MAX_SERIES)]
+
+    assert ids == list(range(profile.MAX_SERIES))
+    assert ring.series_id("one-too-many") is None
+    assert ring.series_id("service-3") == 3
+    ring.close()
+
+
+def test_foreign_file_is_rejected(tmp_path):
+    path = tmp_path / "profile.ring"
+    path.write_bytes(b"\0" * profile.DATA_OFFSET)
+
+    with pytest.raises(profile.ProfileError, match="not an nst profile"):
+        profile.RingFile(path, create=False)
+    with pytest.raises(profile.ProfileError, match="No profile"):
+        profile.RingFile(tmp_path / "missing.ring", create=False)
+
+
+def test_summarize_rates(tmp_path):
+    path = tmp_path / "profile.ring"
+    ring = profile.RingFile(path, capacity=16, interval=10)
+    host = ring.series_id(profile.HOST)
+    gib = 1024 ** 3
+    # one core busy, 10 MiB/s written
+    for i in range(5):
+        ring.append(1000.0 + 10 * i, host, values(i * 10_000_000, 4 * gib, 0, i * 100 * 1024 ** 2))
+    # a counter going backwards, then a gap of more than three intervals
+    ring.append(1050.0, host, values(0, 4 * gib))
+    ring.append(1200.0, host, values(10_000_000, 4 * gib))
+    ring.close()
+
+    summary = profile.summarize(path)
+    host_summary = summary["series"][profile.HOST]
+
+    assert host_summary["samples"] == 4
+    assert host_summary["cpu_cores"] == {"p50": 1.0, "p95": 1.0, "p99": 1.0, "max": 1.0}
+    assert host_summary["memory_gib"]["max"] == 4.0
+    assert host_summary["write_mb_s"]["p95"] == 10.0
+    assert summary["hours"] == round(200 / 3600, 2)
+
+
+def summary(cpu_cores=1.0, memory_gib=6.0, read_iops=0.0, write_mb_s=0.0, rx_mb_s=0.0):
+    def stat(value):
+        return {"p50": value, "p95": value, "p99": value, "max": value}
+    return {"series": {profile.HOST: {
+        "cpu_cores": stat(cpu_cores), "memory_gib": stat(memory_gib),
+        "read_mb_s": stat(0.0), "write_mb_s": stat(write_mb_s),
+        "read_iops": stat(read_iops), "write_iops": stat(0.0),
+        "rx_mb_s": stat(rx_mb_s), "tx_mb_s": stat(0.0),
+    }}}
+
+
+def test_recommend_smallest_instance():
+    # 1.7 vCPUs and 7.5 GiB: m6i.large fits, c6i.large lacks memory
+    recommendation = profile.recommend(summary(cpu_cores=1.0, memory_gib=6.0))
+    assert recommendation["instance_type"] == "m6i.large"
+    assert recommendation["needed"] == {"vcpus": 1.7, "memory_gib": 7.5, "network_gbps": 0.0, "ebs_mbps": 0}
+    assert recommendation["gp3"] == {"volumes": 1, "iops": 3000, "throughput_mb_s": 125}
+
+    # memory bound: fewer, larger-memory vCPUs are cheaper
+    assert profile.recommend(summary(cpu_cores=1.0, memory_gib=48.0))["instance_type"] == "r6i.2xlarge"
+    # network bound: 0.78 Gbps baseline is not enough for 100 MB/s
+    assert profile.recommend(summary(cpu_cores=0.1, memory_gib=1.0, rx_mb_s=100.0))["instance_type"] == "c6i.xlarge"
+    assert profile.recommend(summary(cpu_cores=100.0))["instance_type"] == "larger than r6i.16xlarge"
+
+
+def test_recommend_stripes_gp3_past_one_volume():
+    gp3 = profile.recommend(summary(read_iops=20000.0, write_mb_s=100.0))["gp3"]
+
+    # 24000 IOPS with headroom, over the 16000 of one volume
+    assert gp3 == {"volumes": 2, "iops": 12000, "throughput_mb_s": 125}
+
+
+def test_recommend_needs_host_samples():
+    with pytest.raises(Exception, match="No host samples"):
+        profile.recommend({"series": {}})
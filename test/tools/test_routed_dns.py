@@ -0,0 +1,55 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import lsim.simulator as simulator
+
+
+def create(sim, request_id, properties=None):
+    event = simulator._cfn_event("Create", properties or simulator._dns_record_properties(),
+                                 request_id=request_id)
+    return sim.invoke("test", "dnsRecord", event)
+
+
+def test_rerun_reuses_the_health_check():
+    sim = simulator.Simulation()
+
+    assert create(sim, "req-1")["status"] == "SUCCESS"
+    # a new request right after, as a retried deployment sends
+    rerun = create(sim, "req-2")
+
+    assert rerun["status"] == "SUCCESS"
+    assert "route53.CreateHealthCheck" not in rerun["api_calls"]
+    assert len(sim.world.health_checks) == 1
+    [record] = sim.world.record_sets
+    assert record["HealthCheckId"] in sim.world.health_checks
+    assert record["Region"] == "us-west-2"
+    config = sim.world.health_checks[record["HealthCheckId"]]["HealthCheckConfig"]
+    assert config["Type"] == "CLOUDWATCH_METRIC"
+
+
+def test_regions_keep_their_own_records_and_health_checks():
+    sim = simulator.Simulation()
+    create(sim, "req-1", simulator._dns_record_properties(region="us-west-2"))
+    create(sim, "req-2", simulator._dns_record_properties(region="eu-west-1"))
+
+    assert sorted(r["SetIdentifier"] for r in sim.world.record_sets) == ["omni-app-eu-west-1", "omni-app-us-west-2"]
+    assert len(sim.world.health_checks) == 2
+
+    sim.invoke("test", "dnsRecord", simulator._cfn_event(
+        "Delete", simulator._dns_record_properties(region="eu-west-1")))
+    assert [r["SetIdentifier"] for r in sim.world.record_sets] == ["omni-app-us-west-2"]
+    assert len(sim.world.health_checks) == 1
+
+
+def test_routing_policy_change_replaces_the_record():
+    sim = simulator.Simulation()
+    create(sim, "req-1")
+
+    result = sim.invoke("test", "dnsRecord", simulator._cfn_event(
+        "Update", simulator._dns_record_properties("failover"), simulator._dns_record_properties()))
+
+    assert result["status"] == "SUCCESS"
+    [record] = sim.world.record_sets
+    assert record["Failover"] == "PRIMARY" and "Region" not in record
+    assert list(sim.world.health_checks) == [record["HealthCheckId"]]
@@ -0,0 +1,88 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import pytest
+
+import nst.stack as stack
+
+COMPOSE = """
+services:
+  nucleus-api:
+    image: api:${API_VERSION}
+    ports: ["${API_PORT_2}:3019"]
+    depends_on: [nucleus-auth]
+  nucleus-lft:
+    image: lft:${LFT_VERSION}
+    depends_on:
+      nucleus-api:
+        condition: service_started
+  nucleus-auth:
+    image: auth:${AUTH_VERSION}
+    environment:
+      SECRET: $AUTH_SECRET
+  nucleus-search:
+    image: search:${API_VERSION}
+networks:
+  default:
+    name: ${NETWORK_NAME}
+"""
+
+
+@pytest.fixture
+def compose(tmp_path):
+    path = tmp_path / "docker-compose.yml"
+    path.write_text(COMPOSE)
+    return stack.load_compose(str(path))
+
+
+def test_diff_env(tmp_path):
+    previous = tmp_path / "previous.env"
+    current = tmp_path / "nucleus-stack.env"
+    previous.write_text("A=1\nB=2\nC=3\n")
+    current.write_text("A=1\nB=20\nD=4\n")
+
+    assert stack.diff_env(str(previous), str(current)) == {"B", "C", "D"}
+    # first apply: everything is new
+    assert stack.diff_env(str(tmp_path / "missing.env"), str(current)) == {"A", "B", "D"}
+    assert stack.diff_env_text("A=1\n# comment\n", "A=1\n") == set()
+
+
+def test_load_compose(compose):
+    services, shared = compose
+
+    assert services["nucleus-api"] == {"variables": {"API_VERSION", "API_PORT_2"}, "depends_on": ["nucleus-auth"]}
+    assert services["nucleus-lft"]["depends_on"] == ["nucleus-api"]
+    assert services["nucleus-auth"]["variables"] == {"AUTH_VERSION", "AUTH_SECRET"}
+    assert shared == {"NETWORK_NAME"}
+
+
+def test_affected_services(compose):
+    services, shared = compose
+
+    assert stack.affected_services({"LFT_VERSION"}, services, shared) == {"nucleus-lft"}
+    assert stack.affected_services({"API_VERSION", "AUTH_SECRET"}, services, shared) == {
+        "nucleus-api", "nucleus-search", "nucleus-auth"}
+    assert stack.affected_services(set(), services, shared) == set()
+    # used outside services, or possibly read through env_file
+    assert stack.affected_services({"LFT_VERSION", "NETWORK_NAME"}, services, shared) is None
+    assert stack.affected_services({"UNREFERENCED"}, services, shared) is None
+
+
+def test_restart_order(compose):
+    services, _ = compose
+
+    assert stack.restart_order(services, {"nucleus-lft", "nucleus-auth", "nucleus-api"}) == [
+        "nucleus-auth", "nucleus-api", "nucleus-lft"]
+    # dependencies that are not recreated still order the targets
+    assert stack.restart_order(services, {"nucleus-lft", "nucleus-auth"}) == ["nucleus-auth", "nucleus-lft"]
+    assert stack.restart_order(services, {"missing"}) == []
+
+
+def test_restart_order_rejects_cycles():
+    services = {
+        "a": {"variables": set(), "depends_on": ["b"]},
+        "b": {"variables": set(), "depends_on": ["a"]},
+    }
+    with pytest.raises(Exception, match="Circular depends_on"):
+        stack.restart_order(services, {"a"})
@@ -0,0 +1,173 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import os
+
+import pytest
+
+import nst.storage as storage
+
+GIB = 1024 ** 3
+
+
+def disk(name, size=100 * GIB, model=storage.EBS_MODEL, kind="disk", **fields):
+    return {"name": name, "path": f"/dev/{name}", "type": kind, "size": size, "model": model,
+            "mountpoint": None, "fstype": None, "label": None, **fields}
+
+
+DEVICES = [
+    # root volume
+    disk("nvme0n1", children=[disk("nvme0n1p1", kind="part", mountpoint="/", fstype="xfs")]),
+    disk("nvme1n1"),
+    disk("nvme2n1"),
+    disk("nvme3n1", model=storage.INSTANCE_STORE_MODEL),
+    disk("nvme4n1", size=GIB // 2),
+    disk("nvme5n1", fstype="swap"),
+    disk("loop0", model=None, kind="loop"),
+    disk("loop1", model=None, kind="loop"),
+    disk("zram0", model=None),
+]
+
+
+@pytest.fixture
+def devices(monkeypatch):
+    listed = list(DEVICES)
+    monkeypatch.setattr(storage, "_lsblk", lambda: listed)
+    monkeypatch.setattr(storage, "_swaps", lambda: {"/dev/nvme5n1"})
+    # every tool installed, so plans have no install step
+    monkeypatch.setattr(storage.shutil, "which", lambda tool: f"/usr/sbin/{tool}")
+    return listed
+
+
+@pytest.fixture
+def no_commands(monkeypatch):
+    def run(*args, **kwargs):
+        raise AssertionError(f"ran {args}")
+    monkeypatch.setattr(storage.subprocess, "run", run)
+
+
+def commands(steps):
+    return [command for _, command in steps if not callable(command)]
+
+
+def test_discover_spare_devices(devices):
+    assert [d["path"] for d in storage.discover_devices()] == ["/dev/nvme1n1", "/dev/nvme2n1"]
+    assert [d["path"] for d in storage.discover_devices(include_instance_store=True)] == [
+        "/dev/nvme1n1", "/dev/nvme2n1", "/dev/nvme3n1"]
+    assert [d["kind"] for d in storage.discover_devices(include_loop=True, min_size=0)][-2:] == ["loop", "loop"]
+
+
+def test_plan_stripes_several_devices(devices):
+    selected = storage.discover_devices()
+    steps = storage.plan(selected, "/var/lib/omni/nucleus-data", chunk_kb=512)
+
+    assert commands(steps) == [
+        ["mdadm", "--create", storage.RAID_DEVICE, "--run", "--level=0", "--chunk=512",
+         "--raid-devices=2", f"--name={storage.LABEL}", "/dev/nvme1n1", "/dev/nvme2n1"],
+        ["sh", "-c", f"mdadm --detail --scan {storage.RAID_DEVICE} >> {storage.MDADM_CONF_PATH}"
+                     " && update-initramfs -u"],
+        ["mkfs.xfs", "-f", "-K", "-L", storage.LABEL, "-d", "su=512k,sw=2", storage.RAID_DEVICE],
+        ["mkdir", "-p", "/var/lib/omni/nucleus-data"],
+        ["mount", "/var/lib/omni/nucleus-data"],
+    ]
+    fstab = [description for description, command in steps if callable(command)]
+    assert fstab == [f"persist mount in {storage.FSTAB_PATH}: "
+                     f"LABEL={storage.LABEL} /var/lib/omni/nucleus-data xfs "
+                     "defaults,noatime,allocsize=16m,logbsize=256k,nofail 0 2"]
+
+
+def test_plan_single_device_needs_no_array(devices, monkeypatch):
+    monkeypatch.setattr(storage.shutil, "which", lambda tool: None)
+    steps = storage.plan([{"path": "/dev/nvme1n1", "kind": "ebs", "size": 100 * GIB}], "/data")
+
+    assert commands(steps)[:2] == [
+        ["apt-get", "install", "-y", "xfsprogs"],
+        ["mkfs.xfs", "-f", "-K", "-L", storage.LABEL, "/dev/nvme1n1"],
+    ]
+    assert not any(command[0] == "mdadm" for command in commands(steps))
+
+
+def test_plan_refuses_unsafe_layouts(devices):
+    ebs = {"path": "/dev/nvme1n1", "kind": "ebs", "size": 100 * GIB}
+    local = {"path": "/dev/nvme3n1", "kind": "instance-store", "size": 100 * GIB}
+
+    with pytest.raises(Exception, match="instance store"):
+        storage.plan([ebs, local], "/data")
+    with pytest.raises(Exception, match="--stripe"):
+        storage.plan([ebs, dict(ebs, path="/dev/nvme2n1")], "/data", stripe=False)
+
+
+def test_prepare_dry_run_on_loop_devices(devices, no_commands, tmp_path):
+    devices[:] = [d for d in devices if d["type"] == "loop"]
+    mount_point = str(tmp_path / "data")
+
+    steps = storage.prepare(mount_point, include_loop=True, min_size=0, dry_run=True)
+
+    assert commands(steps)[0][:2] == ["mdadm", "--create"]
+    assert commands(steps)[0][-2:] == ["/dev/loop0", "/dev/loop1"]
+    assert not os.path.exists(mount_point)
+
+
+def test_prepare_explicit_devices(devices, no_commands, tmp_path):
+    steps = storage.prepare(str(tmp_path / "data"), devices=["/dev/nvme2n1"], dry_run=True)
+    assert commands(steps)[0] == ["mkfs.xfs", "-f", "-K", "-L", storage.LABEL, "/dev/nvme2n1"]
+
+    with pytest.raises(Exception, match="partitioned, formatted or mounted"):
+        storage.prepare(str(tmp_path / "data"), devices=["/dev/nvme0n1"], dry_run=True)
+    with pytest.raises(Exception, match="No block device"):
+        storage.prepare(str(tmp_path / "data"), devices=["/dev/nvme9n1"], dry_run=True)
+
+
+def test_prepare_remounts_existing_filesystem(devices, no_commands, tmp_path):
+    devices.append(disk("md127", kind="raid0", fstype="xfs", label=storage.LABEL))
+    mount_point = str(tmp_path / "data")
+
+    steps = storage.prepare(mount_point, dry_run=True)
+
+    assert commands(steps) == [["mkdir", "-p", mount_point], ["mount", mount_point]]
+
+
+def test_prepare_without_spare_devices_keeps_the_root_volume(devices, no_commands, tmp_path):
+    devices[:] = devices[:1]
+    assert storage.prepare(str(tmp_path / "data"), dry_run=True) == []
+
+
+def test_prepare_refuses_to_hide_existing_data(devices, no_commands, tmp_path):
+    (tmp_path / "data").mkdir()
+    (tmp_path / "data" / "omni.db").write_text("x")
+
+    with pytest.raises(Exception, match="not empty"):
+        storage.prepare(str(tmp_path / "data"), dry_run=True)
+
+
+def test_update_fstab_replaces_the_mount_point_entry(tmp_path):
+    fstab = tmp_path / "fstab"
+    fstab.write_text("# static\nUUID=1 / xfs defaults 0 0\nLABEL=old /data xfs defaults 0 2\n")
+
+    storage.update_fstab("/data", storage.fstab_line("/data"), str(fstab))
+    storage.update_fstab("/data", storage.fstab_line("/data"), str(fstab))
+
+    assert fstab.read_text().splitlines() == [
+        "# static", "UUID=1 / xfs defaults 0 0", storage.fstab_line("/data")]
+
+
+def test_benchmark_closes_the_direct_fd_on_fallback(tmp_path, monkeypatch):
+    preadv = os.preadv
+    refused = []
+
+    def refuse_first(fd, buffers, offset):
+        if not refused:
+            refused.append(fd)
+            raise OSError(22, "Invalid argument")
+        return preadv(fd, buffers, offset)
+
+    monkeypatch.setattr(storage.os, "preadv", refuse_first)
+    open_fds = len(os.listdir("/proc/self/fd"))
+
+    result = storage.benchmark(tmp_path, size_mb=1, block_kb=64, random_seconds=0.1, queue_depth=2)
+
+    assert result["direct"] is False
+    assert result["read_mb_s"] > 0 and result["random_read_iops"] > 0
+    assert len(os.listdir("/proc/self/fd")) == open_fds
+    assert not list(tmp_path.iterdir())
@@ -0,0 +1,70 @@
+# Copyright 2022 Amazon.com, Inc. or its affiliates. All Rights Reserved.
+# SPDX-License-Identifier: LicenseRef-.amazon.com.-AmznSL-1.0
+# Licensed under the Amazon Software License  http://aws.amazon.com/asl/
+
+import os
+import re
+import shutil
+
+import pytest
+
+import rpt.nginx as nginx
+import rpt.tls as tls
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(__file__), "..", "..", "src", "tools", "reverseProxy",
+                             "templates", "nginx.conf")
+
+
+def render(tmp_path, **options):
+    with open(TEMPLATE_PATH) as file:
+        return nginx.render_config(file.read(), "localhost", ["127.0.0.1"], tls=True,
+                                   ticket_dir=str(tmp_path / "tickets"), **options)
+
+
+def test_tls_profile_directives_are_valid_in_the_server_block(tmp_path):
+    config = render(tmp_path, certificate="/tmp/c.crt", certificate_key="/tmp/c.key")
+    server = config[config.index("    server {"):]
+
+    # http context only, `nginx -t` rejects them in a server block
+    for directive in ["http2_recv_buffer_size", "ssl_engine"]:
+        assert directive not in server
+    assert "ssl_session_ticket_key" in server
+    assert "ssl_engine" not in config
+
+
+def test_rotation_keeps_older_keys_for_resumption(tmp_path):
+    ticket_dir = tmp_path / "tickets"
+    tls.ensure_ticket_keys(ticket_dir)
+    before = [(ticket_dir / f"ticket.{i}.key").read_bytes() for i in range(nginx.SESSION_TICKET_KEYS)]
+
+    tls.rotate_ticket_keys(ticket_dir)
+    after = [(ticket_dir / f"ticket.{i}.key").read_bytes() for i in range(nginx.SESSION_TICKET_KEYS)]
+
+    assert after[1:] == before[:-1]
+    assert after[0] not in before
+    assert len(after[0]) == tls.TICKET_KEY_BYTES
+
+
+def test_local_config_moves_off_the_installed_nginx(tmp_path):
+    config = tls.local_config(render(tmp_path), str(tmp_path), "127.0.0.1", 8080, 8443)
+
+    listens = re.findall(r"^\s*listen\s+(.*);$", config, re.M)
+    assert listens == ["127.0.0.1:8080", "127.0.0.1:8443 ssl http2"]
+    assert f"pid {tmp_path}/nginx.pid;" in config
+    assert "/var/log/nginx" not in config
+    assert "include /etc/nginx/conf.d" not in config
+    assert f"proxy_temp_path {tmp_path}/proxy;" in config
+
+
+@pytest.mark.skipif(not (shutil.which("nginx") and shutil.which("openssl")), reason="needs nginx and openssl")
+def test_rendered_profile_resumes_sessions(tmp_path):
+    certificate, certificate_key = tls.generate_self_signed(tmp_path)
+    tls.ensure_ticket_keys(tmp_path / "tickets")
+    config = render(tmp_path, certificate=certificate, certificate_key=certificate_key)
+
+    with tls.LocalNginx(config, tmp_path) as server:
+        for version in ["1.2", "1.3"]:
+            report = tls.benchmark_handshakes(server.host, server.port, "localhost", duration=1,
+                                              concurrency=2, resume=True, tls_version=version)
+            assert report["errors"] == 0
+            assert report["resumed_ratio"] > 0.5